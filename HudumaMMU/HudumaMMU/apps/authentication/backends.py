@@ -1,10 +1,11 @@
 import jwt
 
-from django.conf import settings
-
 from rest_framework import authentication, exceptions
 
+from .cache import get_auth_cache
 from .models import User
+from .revocation import get_revocation_list
+from .tokens import decode_token
 
 
 class JWTAuthentication(authentication.BaseAuthentication):
@@ -38,18 +39,38 @@ class JWTAuthentication(authentication.BaseAuthentication):
         return self.authenticate_credentials(request, token)
 
     def authenticate_credentials(self, request, token):
-        """Authenticate the provided credentials."""
+        """Authenticate the provided credentials.
+
+        Verified payloads and their users are cached so repeated requests
+        with the same token skip both the signature check and the query.
+        """
 
-        try:
-            payload = jwt.decode(token, settings.SECRET_KEY)
-        except exceptions.AuthenticationFailed:
-            message = "Could not decode token"
+        cache = get_auth_cache()
+        payload = cache.get_payload(token)
+        if payload is None:
+            try:
+                payload = decode_token(token)
+            except jwt.InvalidTokenError:
+                message = "Could not decode token"
+                raise exceptions.AuthenticationFailed(message)
+            cache.set_payload(token, payload)
+
+        if 'jti' in payload and get_revocation_list().is_revoked(payload['jti']):
+            message = "This token has been revoked"
             raise exceptions.AuthenticationFailed(message)
 
-        try:
-            user = User.objects.get(email=payload['email'])
-        except exceptions.AuthenticationFailed:
-            message = "No user matching this token was found"
+        user_id = payload.get('id')
+        user = cache.get_user(user_id)
+        if user is None:
+            try:
+                user = User.objects.get(pk=user_id)
+            except (User.DoesNotExist, ValueError, TypeError):
+                message = "No user matching this token was found"
+                raise exceptions.AuthenticationFailed(message)
+            cache.set_user(user_id, user)
+
+        if not user.is_active:
+            message = "This user has been deactivated"
             raise exceptions.AuthenticationFailed(message)
 
-        return (user, token)
\ No newline at end of file
+        return (user, token)
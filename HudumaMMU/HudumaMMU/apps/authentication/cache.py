@@ -0,0 +1,177 @@
+import hashlib
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import DEFAULT_DB_ALIAS
+from django.dispatch import receiver
+
+
+DEFAULTS = {
+    # Entries kept in each process before the least recently used is evicted
+    'LOCAL_MAXSIZE': 1024,
+    # Seconds a process may keep serving a user another process invalidated
+    'LOCAL_TIMEOUT': 30,
+    # Alias in CACHES shared by every process, or None for local only
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 300,
+    'KEY_PREFIX': 'jwt-auth',
+}
+
+
+class LRUCache:
+    """A thread safe least recently used cache with a per entry TTL"""
+
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + timeout)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def user_fields():
+    return [field.attname for field in get_user_model()._meta.concrete_fields]
+
+
+class AuthCache:
+    """Caches decoded tokens and the users they belong to
+
+    Lookups go through a per-process LRU first and then the shared Django
+    cache, so most authenticated requests never verify a signature or
+    query the users table.
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self.local = LRUCache(options['LOCAL_MAXSIZE'], options['LOCAL_TIMEOUT'])
+        self.counters = Counter()
+
+    @property
+    def shared(self):
+        alias = self.options['CACHE_ALIAS']
+        return caches[alias] if alias else None
+
+    def make_key(self, kind, identifier):
+        return '%s:%s:%s' % (self.options['KEY_PREFIX'], kind, identifier)
+
+    def token_key(self, token):
+        digest = hashlib.sha256(token.encode('utf-8')).hexdigest()
+        return self.make_key('token', digest)
+
+    def _get(self, kind, key):
+        value = self.local.get(key)
+        if value is not None:
+            self.counters['%s_local_hits' % kind] += 1
+            return value
+        if self.shared is not None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.counters['%s_shared_hits' % kind] += 1
+                self.local.set(key, value)
+                return value
+        self.counters['%s_misses' % kind] += 1
+        return None
+
+    def _set(self, key, value, timeout):
+        self.local.set(key, value, min(timeout, self.options['LOCAL_TIMEOUT']))
+        if self.shared is not None:
+            self.shared.set(key, value, timeout)
+
+    def get_payload(self, token):
+        """Return the verified payload of a token seen before"""
+        key = self.token_key(token)
+        payload = self._get('token', key)
+        if payload is not None and 'exp' in payload \
+                and payload['exp'] <= time.time():
+            self.local.delete(key)
+            return None
+        return payload if payload is None else dict(payload)
+
+    def set_payload(self, token, payload):
+        """Remember a payload whose signature has been verified"""
+        timeout = self.options['TIMEOUT']
+        if 'exp' in payload:
+            timeout = min(timeout, payload['exp'] - time.time())
+        if timeout > 0:
+            self._set(self.token_key(token), payload, timeout)
+
+    def get_user(self, identifier):
+        """Return a fresh User built from the cached field values
+
+        Users are cached as plain values, not instances, so concurrent
+        requests never share, and mutate, the same object.
+        """
+        values = self._get('user', self.make_key('user', identifier))
+        if values is None:
+            return None
+        fields = user_fields()
+        if not isinstance(values, tuple) or len(values) != len(fields):
+            # Cached in another format by an older release
+            return None
+        return get_user_model().from_db(DEFAULT_DB_ALIAS, fields, values)
+
+    def set_user(self, identifier, user):
+        values = tuple(getattr(user, field) for field in user_fields())
+        self._set(self.make_key('user', identifier), values, self.options['TIMEOUT'])
+
+    def invalidate_user(self, identifier):
+        key = self.make_key('user', identifier)
+        self.local.delete(key)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+    def stats(self):
+        """Return the hit and miss counters of this process"""
+        return dict(self.counters)
+
+
+_auth_cache = None
+
+
+def get_auth_cache():
+    """Return the process wide auth cache configured by JWT_AUTH_CACHE"""
+    global _auth_cache
+    if _auth_cache is None:
+        options = dict(DEFAULTS, **getattr(settings, 'JWT_AUTH_CACHE', {}))
+        _auth_cache = AuthCache(options)
+    return _auth_cache
+
+
+@receiver(setting_changed)
+def reset_auth_cache(setting, **kwargs):
+    global _auth_cache
+    if setting in ('JWT_AUTH_CACHE', 'CACHES'):
+        _auth_cache = None
@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """PBKDF2 with the iteration count taken from PASSWORD_HASH_ITERATIONS
+
+    Hashing is the most CPU hungry part of a login, so the cost is tunable
+    per deployment. Stored hashes with a different count are upgraded the
+    next time their user logs in.
+    """
+
+    @property
+    def iterations(self):
+        return getattr(settings, 'PASSWORD_HASH_ITERATIONS',
+                       hashers.PBKDF2PasswordHasher.iterations)
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from ...models import RevokedToken
+
+
+class Command(BaseCommand):
+    help = 'Delete revoked tokens that have expired anyway'
+
+    def handle(self, *args, **options):
+        deleted, _ = RevokedToken.objects.filter(
+            expires_at__lte=timezone.now()).delete()
+        self.stdout.write(self.style.SUCCESS(
+            'Deleted %d expired revoked tokens' % deleted))
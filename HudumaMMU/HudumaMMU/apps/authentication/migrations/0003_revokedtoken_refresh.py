@@ -0,0 +1,18 @@
+# Generated by Django 3.0.3 on 2026-10-18 09:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0002_revokedtoken'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='revokedtoken',
+            name='refresh',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -2,7 +2,20 @@ from __future__ import unicode_literals
 from django.db import models
 from django.utils import timezone
 from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.contrib.auth.hashers import identify_hasher
 from django.contrib.auth.models import (AbstractBaseUser, PermissionsMixin, BaseUserManager)
+from django.utils.crypto import constant_time_compare
+
+from .cache import get_auth_cache
+
+
+def identify_hasher_or_none(encoded):
+    try:
+        return identify_hasher(encoded)
+    except ValueError:
+        return None
 
 
 class UserManager(BaseUserManager):
@@ -56,3 +69,41 @@ class User(AbstractBaseUser, PermissionsMixin):
     def save(self, *args, **kwargs):
         super(User, self).save(*args, **kwargs)
         return self
+
+    def check_legacy_password(self, raw_password):
+        """Accept, and hash, a password stored in plain text
+
+        Accounts registered before passwords were hashed kept the raw
+        value. A match is re-saved with a proper hash so this only ever
+        succeeds once per account.
+        """
+        if not self.password or identify_hasher_or_none(self.password):
+            return False
+        if not constant_time_compare(self.password, raw_password):
+            return False
+        self.set_password(raw_password)
+        self.save(update_fields=['password'])
+        return True
+
+
+class RevokedToken(models.Model):
+    """A token that was revoked before it expired"""
+    jti = models.CharField(max_length=32, unique=True)
+    expires_at = models.DateTimeField(db_index=True)
+    # Refresh tokens are only looked up when exchanged, they are left out
+    # of the revocation bloom filters
+    refresh = models.BooleanField(default=False)
+
+    def __str__(self):
+        return self.jti
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Drop the cached copy of a user once it is saved, deactivated or deleted
+
+    Waits for the commit, a request in between would cache the old row again.
+    """
+    user_id = instance.pk
+    transaction.on_commit(lambda: get_auth_cache().invalidate_user(user_id))
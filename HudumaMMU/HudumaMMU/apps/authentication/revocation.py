@@ -0,0 +1,189 @@
+import hashlib
+import threading
+import uuid
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.utils import timezone
+
+from ...routers import primary
+from .models import RevokedToken
+
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'jwt-revocation',
+    # Bits in each process's bloom filter and hashes per entry, good for
+    # roughly 100k revoked tokens at a 1% false positive rate
+    'BLOOM_SIZE': 2 ** 20,
+    'BLOOM_HASHES': 7,
+    # Logged revocations a process adds to its filter, beyond which it
+    # reloads the table instead
+    'MAX_CHANGES': 1000,
+}
+
+
+class BloomFilter:
+    """A fixed size set that may report false positives but never misses"""
+
+    def __init__(self, size, hashes):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bytearray((size + 7) // 8)
+
+    def positions(self, value):
+        digest = hashlib.sha256(value.encode('utf-8')).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:16], 'big') | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, value):
+        for position in self.positions(value):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, value):
+        return all(
+            self.bits[position // 8] & (1 << (position % 8))
+            for position in self.positions(value)
+        )
+
+
+class RevocationList:
+    """Tracks the ids (jti) of access tokens revoked before they expire
+
+    Revoked ids are stored in the RevokedToken table and the shared cache.
+    Each process keeps a bloom filter of them, so checking a token that
+    was never revoked costs one cache read and no query.
+
+    Every revocation is appended to a numbered log in the cache. A process
+    adds the entries it has not seen yet to its filter and only reloads
+    the whole table when entries went missing, the log fell more than
+    MAX_CHANGES entries behind or the cache lost the log's epoch.
+
+    Refresh tokens are checked once, when exchanged, so they are claimed
+    in the table only and stay out of the filter.
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self.epoch = None
+        self.seen = 0
+        self.bloom = None
+        self.lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.options['CACHE_ALIAS']]
+
+    def key(self, *parts):
+        return ':'.join((self.options['KEY_PREFIX'], ) + parts)
+
+    def get_epoch(self):
+        epoch = self.cache.get(self.key('epoch'))
+        if epoch is None:
+            self.cache.add(self.key('epoch'), uuid.uuid4().hex, None)
+            epoch = self.cache.get(self.key('epoch'))
+        return epoch
+
+    def rebuild(self, epoch, count):
+        bloom = BloomFilter(self.options['BLOOM_SIZE'], self.options['BLOOM_HASHES'])
+        # The filter outlives the request, it must not be built from a
+        # lagging replica
+        with primary():
+            for jti in RevokedToken.objects.filter(
+                    expires_at__gt=timezone.now(), refresh=False
+            ).values_list('jti', flat=True).iterator():
+                bloom.add(jti)
+        self.bloom, self.epoch, self.seen = bloom, epoch, count
+
+    def replay(self, count):
+        """Add the revocations logged since the last one seen"""
+        changes = self.cache.get_many([
+            self.key(self.epoch, 'change', str(number))
+            for number in range(self.seen + 1, count + 1)
+        ])
+        if len(changes) != count - self.seen:
+            return self.rebuild(self.epoch, count)
+        for jti in changes.values():
+            self.bloom.add(jti)
+        self.seen = count
+
+    def sync(self):
+        """Bring the bloom filter up to date with the revocation log"""
+        epoch = self.get_epoch()
+        count = self.cache.get(self.key(epoch, 'count'), 0)
+        if epoch == self.epoch and count == self.seen:
+            return
+        with self.lock:
+            if epoch != self.epoch or count < self.seen \
+                    or count - self.seen > self.options['MAX_CHANGES']:
+                self.rebuild(epoch, count)
+            elif count > self.seen:
+                self.replay(count)
+
+    def is_revoked(self, jti):
+        self.sync()
+        if jti not in self.bloom:
+            return False
+        # Either revoked or a false positive, confirm with the shared store
+        if self.cache.get(self.key('jti', jti)) is not None:
+            return True
+        return RevokedToken.objects.filter(jti=jti).exists()
+
+    def claim(self, jti, expires_at, refresh=True):
+        """Revoke a token in the table only, returning False if it already was
+
+        Of concurrent claims of one token exactly one succeeds, which makes
+        a refresh token single use.
+        """
+        expiry = datetime.fromtimestamp(expires_at, tz=timezone.utc)
+        _, created = RevokedToken.objects.get_or_create(
+            jti=jti, defaults={'expires_at': expiry, 'refresh': refresh})
+        return created
+
+    def revoke(self, jti, expires_at):
+        """Revoke an access token until `expires_at`, a unix timestamp
+
+        The log entry is written once the row is committed, so a process
+        that reloads the table because of it finds the row.
+        """
+        if self.claim(jti, expires_at, refresh=False):
+            transaction.on_commit(lambda: self.publish(jti, expires_at))
+
+    def publish(self, jti, expires_at):
+        timeout = expires_at - timezone.now().timestamp()
+        if timeout <= 0:
+            return
+        self.cache.set(self.key('jti', jti), True, timeout)
+        epoch = self.get_epoch()
+        count_key = self.key(epoch, 'count')
+        try:
+            number = self.cache.incr(count_key)
+        except ValueError:
+            number = 1 if self.cache.add(count_key, 1, None) else self.cache.incr(count_key)
+        self.cache.set(self.key(epoch, 'change', str(number)), jti, timeout)
+        if self.bloom is not None:
+            self.bloom.add(jti)
+
+
+_revocation_list = None
+
+
+def get_revocation_list():
+    """Return the process wide revocation list configured by JWT_REVOCATION"""
+    global _revocation_list
+    if _revocation_list is None:
+        options = dict(DEFAULTS, **getattr(settings, 'JWT_REVOCATION', {}))
+        _revocation_list = RevocationList(options)
+    return _revocation_list
+
+
+@receiver(setting_changed)
+def reset_revocation_list(setting, **kwargs):
+    global _revocation_list
+    if setting in ('JWT_REVOCATION', 'CACHES'):
+        _revocation_list = None
@@ -1,3 +1,135 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient, APIRequestFactory, force_authenticate
 
-# Create your tests here.
+from .cache import AuthCache, DEFAULTS as AUTH_CACHE_DEFAULTS
+from .models import RevokedToken, User
+from .revocation import DEFAULTS, RevocationList
+from .tokens import ACCESS, REFRESH, decode_token, issue_token
+from .views import LogoutUser
+
+
+class TokenTestMixin:
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(
+            email='user@example.com', password='password')
+
+    def login(self):
+        response = self.client.post('/api/v1/user/login/', {
+            'email': 'user@example.com', 'password': 'password'
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def refresh(self, token):
+        return self.client.post(
+            '/api/v1/user/token/refresh/', {'refresh': token}, format='json')
+
+    def logout(self, token, refresh=None):
+        data = {'refresh': refresh} if refresh else {}
+        return self.client.post(
+            '/api/v1/user/logout/', data, format='json',
+            HTTP_AUTHORIZATION='Bearer %s' % token)
+
+
+class TokenExpiryTests(TokenTestMixin, TestCase):
+    def test_tokens_carry_their_type(self):
+        tokens = self.login()
+        self.assertEqual(decode_token(tokens['token'])['id'], self.user.pk)
+        self.assertEqual(decode_token(tokens['refresh'], REFRESH)['id'], self.user.pk)
+
+    def test_access_token_cannot_refresh(self):
+        tokens = self.login()
+        self.assertEqual(self.refresh(tokens['token']).status_code, 401)
+
+    @override_settings(JWT_REFRESH_TOKEN_LIFETIME=-1)
+    def test_expired_refresh_token_is_rejected(self):
+        tokens = self.login()
+        self.assertEqual(self.refresh(tokens['refresh']).status_code, 401)
+        self.assertFalse(RevokedToken.objects.exists())
+
+    @override_settings(JWT_ACCESS_TOKEN_LIFETIME=-1)
+    def test_logout_with_expired_token(self):
+        token = issue_token(self.user, ACCESS)
+        request = APIRequestFactory().post('/api/v1/user/logout/', {}, format='json')
+        force_authenticate(request, user=self.user, token=token)
+        response = LogoutUser.as_view()(request)
+        self.assertEqual(response.status_code, 401)
+
+
+class TokenRotationTests(TokenTestMixin, TransactionTestCase):
+    def test_refresh_token_is_single_use(self):
+        tokens = self.login()
+        response = self.refresh(tokens['refresh'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.data['refresh'], tokens['refresh'])
+        self.assertEqual(self.refresh(tokens['refresh']).status_code, 401)
+        self.assertEqual(self.refresh(response.data['refresh']).status_code, 200)
+
+    def test_refresh_of_inactive_user_is_rejected(self):
+        tokens = self.login()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.refresh(tokens['refresh']).status_code, 401)
+
+
+class TokenRevocationTests(TokenTestMixin, TransactionTestCase):
+    def test_logout_revokes_both_tokens(self):
+        tokens = self.login()
+        self.assertEqual(self.logout(tokens['token'], tokens['refresh']).status_code, 200)
+        self.assertNotEqual(self.logout(tokens['token']).status_code, 200)
+        self.assertEqual(self.refresh(tokens['refresh']).status_code, 401)
+
+    def test_revocations_reach_other_processes_without_reloading(self):
+        first, second = RevocationList(DEFAULTS), RevocationList(DEFAULTS)
+        token = decode_token(self.login()['token'])
+        self.assertFalse(first.is_revoked(token['jti']))
+
+        second.revoke(token['jti'], token['exp'])
+        with self.assertNumQueries(0):
+            self.assertTrue(first.is_revoked(token['jti']))
+            self.assertFalse(first.is_revoked('0' * 32))
+
+    def test_missing_log_entries_reload_the_table(self):
+        first, second = RevocationList(DEFAULTS), RevocationList(DEFAULTS)
+        token = decode_token(self.login()['token'])
+        first.sync()
+        second.revoke(token['jti'], token['exp'])
+        cache.delete('%s:%s:change:1' % (DEFAULTS['KEY_PREFIX'], first.epoch))
+        self.assertTrue(first.is_revoked(token['jti']))
+
+    def test_refresh_tokens_stay_out_of_the_filter(self):
+        revocations = RevocationList(DEFAULTS)
+        token = decode_token(self.login()['refresh'], REFRESH)
+        self.assertTrue(revocations.claim(token['jti'], token['exp']))
+        self.assertFalse(revocations.claim(token['jti'], token['exp']))
+        self.assertFalse(revocations.is_revoked(token['jti']))
+
+
+class AuthCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.cache = AuthCache(AUTH_CACHE_DEFAULTS)
+        self.user = User.objects.create_user(
+            email='user@example.com', password='password', first_name='Amina')
+
+    def test_each_get_builds_its_own_user(self):
+        self.cache.set_user(self.user.pk, self.user)
+        with self.assertNumQueries(0):
+            first = self.cache.get_user(self.user.pk)
+            second = self.cache.get_user(self.user.pk)
+        self.assertIsNot(first, second)
+        self.assertEqual(first, self.user)
+        self.assertFalse(first._state.adding)
+
+        first.first_name = 'Changed'
+        self.assertEqual(second.first_name, 'Amina')
+        self.assertEqual(self.cache.get_user(self.user.pk).first_name, 'Amina')
+
+    def test_shared_cache_values_are_rebuilt(self):
+        self.cache.set_user(self.user.pk, self.user)
+        self.cache.local.clear()
+        user = self.cache.get_user(self.user.pk)
+        self.assertEqual(user.email, 'user@example.com')
+        self.assertEqual(self.cache.stats()['user_shared_hits'], 1)
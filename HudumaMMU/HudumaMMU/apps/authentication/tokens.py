@@ -0,0 +1,52 @@
+import time
+import uuid
+
+import jwt
+from django.conf import settings
+
+
+ALGORITHM = 'HS256'
+ACCESS = 'access'
+REFRESH = 'refresh'
+LIFETIME_SETTINGS = {
+    ACCESS: ('JWT_ACCESS_TOKEN_LIFETIME', 900),
+    REFRESH: ('JWT_REFRESH_TOKEN_LIFETIME', 14 * 24 * 3600),
+}
+
+
+def issue_token(user, token_type=ACCESS):
+    """Return a signed token identifying `user`
+
+    The payload only carries the user id, the token type, the expiry and
+    a unique token id so nothing sensitive about the user ends up in the
+    token.
+    """
+    setting, default = LIFETIME_SETTINGS[token_type]
+    now = int(time.time())
+    payload = {
+        'id': user.pk,
+        'type': token_type,
+        'iat': now,
+        'exp': now + getattr(settings, setting, default),
+        'jti': uuid.uuid4().hex,
+    }
+    return jwt.encode(payload, settings.SECRET_KEY, algorithm=ALGORITHM).decode('utf-8')
+
+
+def issue_token_pair(user):
+    """Return a short lived access token and the refresh token to renew it"""
+    return {
+        'token': issue_token(user, ACCESS),
+        'refresh': issue_token(user, REFRESH),
+    }
+
+
+def decode_token(token, token_type=ACCESS):
+    """Verify a token and return its payload, raising jwt.InvalidTokenError
+
+    Tokens issued before token types existed are access tokens.
+    """
+    payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[ALGORITHM])
+    if payload.get('type', ACCESS) != token_type:
+        raise jwt.InvalidTokenError('Expected an %s token' % token_type)
+    return payload
@@ -1,8 +1,10 @@
 from django.urls import path
 from django.conf.urls import url
-from .views import CreateUserAPIView, LoginUser
+from .views import CreateUserAPIView, LoginUser, LogoutUser, RefreshToken
 
 urlpatterns = [
     path('user/register/', CreateUserAPIView.as_view()),
-    path('user/login/', LoginUser.as_view())
+    path('user/login/', LoginUser.as_view()),
+    path('user/token/refresh/', RefreshToken.as_view()),
+    path('user/logout/', LogoutUser.as_view())
 ]
\ No newline at end of file
@@ -1,13 +1,15 @@
 from django.shortcuts import render
 import jwt
-from django.conf import settings
 from rest_framework.views import APIView
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from django.http import HttpResponse
-from django.http import HttpResponse
 from .serializers import UserSerializer
 from .models import User
+from .ratelimit import LoginRateLimiter
+from .revocation import get_revocation_list
+from .tokens import REFRESH, decode_token, issue_token_pair
 
 
 class CreateUserAPIView(APIView):
@@ -24,44 +26,119 @@ class CreateUserAPIView(APIView):
 
 class LoginUser(APIView):
     def post(self, request, *args, **kwargs):
-        if not request.data:
+        email = request.data.get('email')
+        password = request.data.get('password')
+        if not email or not password:
             return Response(
                 {
                     'Error': 'Please provide an email and a password'
                 },
                 status=status.HTTP_400_BAD_REQUEST
             )
-        email = request.data['email']
-        password = request.data['password']
 
-        try:
-            user = User.objects.get(email=email, password=password)
-        except User.DoesNotExist:
+        limiter = LoginRateLimiter(request, email)
+        if limiter.is_blocked():
+            return Response(
+                {
+                    "Error": "Too many failed login attempts, try again later"
+                },
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={'Retry-After': str(limiter.retry_after())}
+            )
+
+        user = User.objects.filter(email=email).first()
+        if user is None:
+            # Hash anyway so unknown emails take as long as wrong passwords
+            User().set_password(password)
+        elif not user.check_password(password) \
+                and not user.check_legacy_password(password):
+            user = None
+
+        if user is None or not user.is_active:
+            limiter.failed()
             return Response({
                 "Error": "Invalid email or password"
             },
             status=status.HTTP_400_BAD_REQUEST
             )
 
-        if user:
-            payload = {
-                'email': user.email,
-                'password': user.password
-            }
-            response_details = {
-                'token': jwt.encode(payload, settings.SECRET_KEY),
-                'message': "You have been successfully logged in",
-                'status': status.HTTP_200_OK
-            }
+        limiter.succeeded()
+        response_details = dict(
+            issue_token_pair(user),
+            message="You have been successfully logged in",
+            status=status.HTTP_200_OK
+        )
 
-            return Response(response_details, status=response_details['status'])
+        return Response(response_details, status=response_details['status'])
 
 
-        else:
+class RefreshToken(APIView):
+    """Exchange a refresh token for a new access and refresh token
+
+    The refresh token is single use, it is revoked once exchanged.
+    """
+    authentication_classes = ()
+
+    def post(self, request, *args, **kwargs):
+        token = request.data.get('refresh')
+        if not token:
             return Response(
                 {
-                    "Error": "Invalid credentials"
+                    'Error': 'Please provide a refresh token'
                 },
-                status=status.HTTP_400_BAD_REQUEST,
-                content_type="application/json"
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            payload = decode_token(token, REFRESH)
+        except jwt.InvalidTokenError:
+            payload = None
+        # Claiming the token revokes it, only one of several concurrent
+        # exchanges of the same token gets past this
+        if payload is None or not get_revocation_list().claim(payload['jti'], payload['exp']):
+            return Response({
+                "Error": "Invalid or expired refresh token"
+            },
+            status=status.HTTP_401_UNAUTHORIZED
+            )
+
+        user = User.objects.filter(pk=payload['id'], is_active=True).first()
+        if user is None:
+            return Response({
+                "Error": "Invalid or expired refresh token"
+            },
+            status=status.HTTP_401_UNAUTHORIZED
+            )
+
+        return Response(issue_token_pair(user), status=status.HTTP_200_OK)
+
+
+class LogoutUser(APIView):
+    """Revoke the access token of the request and, if given, a refresh token"""
+    permission_classes = (IsAuthenticated,)
+
+    def post(self, request, *args, **kwargs):
+        revocations = get_revocation_list()
+        try:
+            payload = decode_token(request.auth)
+        except jwt.InvalidTokenError:
+            return Response({
+                "Error": "Invalid or expired token"
+            },
+            status=status.HTTP_401_UNAUTHORIZED
             )
+        if 'jti' in payload:
+            revocations.revoke(payload['jti'], payload['exp'])
+
+        refresh = request.data.get('refresh')
+        if refresh:
+            try:
+                payload = decode_token(refresh, REFRESH)
+            except jwt.InvalidTokenError:
+                payload = None
+            if payload is not None and payload['id'] == request.user.pk:
+                revocations.claim(payload['jti'], payload['exp'])
+
+        return Response({
+            'message': "You have been successfully logged out"
+        }, status=status.HTTP_200_OK)
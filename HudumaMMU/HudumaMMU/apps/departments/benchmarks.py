@@ -0,0 +1,321 @@
+"""Seeding and load generation for the API benchmarks
+
+The same scenarios run either in process through the Django test client
+(which also counts the queries of every request) or over HTTP against a
+running server such as a local gunicorn, in which case query counts are
+read from the Server-Timing header added by RequestMetricsMiddleware.
+"""
+import json
+import re
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+
+from ..authentication.models import User
+from . import search
+from .models import Change, Department, Rating, RatingAggregate, Review
+
+
+PASSWORD = 'Benchmark1'
+EMAIL = 'benchmark-user-%d@example.com'
+SERVICES = (
+    'birth certificates', 'passport applications', 'identity cards',
+    'driving licences', 'business permits', 'health insurance',
+    'police clearance', 'land registry', 'tax compliance', 'pensions',
+)
+
+
+def chunked_create(model, objects, batch_size=1000):
+    batch = []
+    for obj in objects:
+        batch.append(obj)
+        if len(batch) == batch_size:
+            model.objects.bulk_create(batch)
+            batch = []
+    model.objects.bulk_create(batch)
+
+
+def seed(departments=50, users=200, reviews=2000, replies=2, ratings=20):
+    """Fill the database with benchmark data using bulk inserts
+
+    Creates `reviews` top-level reviews spread over the departments, each
+    with `replies` replies, and `ratings` ratings per department. Every
+    user shares the PASSWORD, department 0 belongs to user 0.
+    """
+    password = make_password(PASSWORD)
+    chunked_create(User, (
+        User(email=EMAIL % number, password=password) for number in range(users)
+    ))
+    user_ids = list(User.objects.filter(
+        email__startswith='benchmark-user-').order_by('id').values_list('id', flat=True))
+
+    chunked_create(Department, (
+        Department(
+            name='Benchmark department %d' % number,
+            service=SERVICES[number % len(SERVICES)],
+            email='benchmark-department-%d@example.com' % number,
+            created_by_id=user_ids[0]
+        ) for number in range(departments)
+    ))
+    department_ids = list(Department.objects.filter(
+        email__startswith='benchmark-department-').order_by('id').values_list('id', flat=True))
+
+    chunked_create(Review, (
+        Review(
+            body='Benchmark review %d about %s' % (number, SERVICES[number % len(SERVICES)]),
+            department_id=department_ids[number % len(department_ids)],
+            author_id=user_ids[number % len(user_ids)]
+        ) for number in range(reviews)
+    ))
+    parents = Review.objects.filter(
+        department_id__in=department_ids, parent=None
+    ).values_list('id', 'department_id')
+    chunked_create(Review, (
+        Review(
+            body='Benchmark reply %d' % number,
+            department_id=department_id,
+            author_id=user_ids[(parent_id + number) % len(user_ids)],
+            parent_id=parent_id
+        ) for parent_id, department_id in parents.iterator() for number in range(replies)
+    ))
+    Review.objects.filter(department_id__in=department_ids).fill_paths()
+
+    raters = user_ids[1:ratings + 1]
+    chunked_create(Rating, (
+        Rating(
+            department_id=department_id,
+            user_id=user_id,
+            user_rating=1 + (department_id + user_id) % 5
+        ) for department_id in department_ids for user_id in raters
+    ))
+
+    RatingAggregate.objects.rebuild(department_ids)
+    search.reindex(Department.objects.filter(pk__in=department_ids))
+    search.reindex(Review.objects.filter(department_id__in=department_ids))
+    Change.objects.record(Change.DEPARTMENT, department_ids)
+    Change.objects.record(Change.REVIEW, Review.objects.filter(
+        department_id__in=department_ids).values_list('id', flat=True))
+
+
+class ClientTransport:
+    """Sends requests through the Django test client, counting queries"""
+
+    def __init__(self):
+        self.client = Client()
+
+    def request(self, method, path, data=None, token=None):
+        headers = {}
+        if token:
+            headers['HTTP_AUTHORIZATION'] = 'Bearer %s' % token
+        body = json.dumps(data) if data is not None else ''
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = self.client.generic(
+                method, path, body, content_type='application/json', **headers)
+            content = b''.join(response) if response.streaming else response.content
+            duration = time.perf_counter() - started
+        return response.status_code, content, duration, len(queries)
+
+
+class HTTPTransport:
+    """Sends requests to a running server"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, path, data=None, token=None):
+        body = json.dumps(data).encode('utf-8') if data is not None else None
+        request = urllib.request.Request(
+            self.base_url + path, data=body, method=method,
+            headers={'Content-Type': 'application/json'})
+        if token:
+            request.add_header('Authorization', 'Bearer %s' % token)
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                status, content, headers = response.status, response.read(), response.headers
+        except urllib.error.HTTPError as error:
+            status, content, headers = error.code, error.read(), error.headers
+        duration = time.perf_counter() - started
+        timing = re.search(r'desc="(\d+) queries"', headers.get('Server-Timing', ''))
+        return status, content, duration, int(timing.group(1)) if timing else None
+
+
+class Scenarios:
+    """One benchmark scenario per route and method of the API"""
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.counter = count()
+
+    def call(self, method, path, data=None, token=None):
+        status, content, _, _ = self.transport.request(method, path, data, token)
+        return status, json.loads(content.decode('utf-8') or 'null')
+
+    def login(self, number=1):
+        _, body = self.call('POST', '/api/v1/user/login/', {
+            'email': EMAIL % number, 'password': PASSWORD})
+        return body
+
+    def prepare(self):
+        """Find the seeded records and log in as a user that may rate them"""
+        self.token = self.login()['token']
+        _, body = self.call('GET', '/api/v1/departments/?page_size=1', token=self.token)
+        self.department = body['results'][0]['id']
+        self.department_email = body['results'][0]['email']
+        _, body = self.call('GET', '/api/v1/departments/%d/reviews/?page_size=1' % self.department)
+        self.review = body['Reviews'][0]['id']
+
+    def create(self, path, data):
+        """Create a scratch record for a scenario and return its id"""
+        status, body = self.call('POST', path, data, self.token)
+        if status != 201:
+            raise RuntimeError(
+                'POST %s answered %d instead of 201, is the server throttling '
+                'writes? %s' % (path, status, body))
+        return body['id']
+
+    def new_department(self):
+        return self.create('/api/v1/departments/', {
+            'name': 'Scratch department',
+            'service': 'benchmarking',
+            'email': 'scratch-%d-%d@example.com' % (time.time(), next(self.counter)),
+        })
+
+    def new_review(self):
+        return self.create(
+            '/api/v1/departments/%d/reviews/' % self.department,
+            {'body': 'Scratch review'})
+
+    def all(self):
+        """Yield (name, method, path builder, body builder, uses token)
+
+        Builders run before each request and are not part of its timing.
+        """
+        department = lambda: '/api/v1/departments/%d/' % self.department
+        reviews = lambda: '/api/v1/departments/%d/reviews/' % self.department
+        review = lambda: '/api/v1/departments/%d/reviews/%d/' % (self.department, self.review)
+        rating = lambda: '/api/v1/rate/%d/' % self.department
+        fixed = lambda path: lambda: path
+        body = lambda data: lambda: data
+        return (
+            ('departments.list', 'GET', fixed('/api/v1/departments/'), None, True),
+            ('departments.list_summary', 'GET', fixed(
+                '/api/v1/departments/?include=rating_summary,review_count'), None, True),
+            ('departments.create', 'POST', fixed('/api/v1/departments/'), lambda: {
+                'name': 'Benchmark', 'service': 'benchmarking',
+                'email': 'created-%d-%d@example.com' % (time.time(), next(self.counter))
+            }, True),
+            ('departments.retrieve', 'GET', department, None, True),
+            ('departments.update', 'PUT', department, lambda: {
+                'name': 'Benchmark department', 'service': 'benchmarking',
+                'email': self.department_email}, True),
+            ('departments.destroy', 'DELETE',
+             lambda: '/api/v1/departments/%d/' % self.new_department(), None, True),
+            ('departments.lookup', 'POST', fixed('/api/v1/single-department/'),
+             lambda: {'department_id': self.department}, False),
+            ('departments.top', 'GET', fixed('/api/v1/departments/top/'), None, False),
+            ('departments.export', 'GET', fixed('/api/v1/departments/bulk/'), None, True),
+            ('reviews.list', 'GET', reviews, None, False),
+            ('reviews.create', 'POST', reviews, body({'body': 'Benchmark review'}), True),
+            ('reviews.retrieve', 'GET', review, None, False),
+            ('reviews.update', 'PUT',
+             lambda: '/api/v1/departments/%d/reviews/%d/' % (self.department, self.new_review()),
+             body({'body': 'Edited review'}), True),
+            ('reviews.destroy', 'DELETE',
+             lambda: '/api/v1/departments/%d/reviews/%d/' % (self.department, self.new_review()),
+             None, True),
+            ('reviews.reply', 'POST', review, body({'body': 'Benchmark reply'}), True),
+            ('ratings.get', 'GET', rating, None, True),
+            ('ratings.post', 'POST', rating, body({'user_rating': 4}), True),
+            ('ratings.batch', 'GET', lambda: '/api/v1/rate/batch/?ids=%s' % ','.join(
+                str(self.department + offset) for offset in range(20)), None, True),
+            ('search', 'GET', fixed('/api/v1/search/?q=pass'), None, False),
+            ('users.register', 'POST', fixed('/api/v1/user/register/'), lambda: {
+                'email': 'registered-%d-%d@example.com' % (time.time(), next(self.counter)),
+                'password': PASSWORD}, False),
+            ('users.login', 'POST', fixed('/api/v1/user/login/'),
+             body({'email': EMAIL % 1, 'password': PASSWORD}), False),
+            ('users.refresh', 'POST', fixed('/api/v1/user/token/refresh/'),
+             lambda: {'refresh': self.login()['refresh']}, False),
+            ('users.logout', 'POST', fixed('/api/v1/user/logout/'), None, 'fresh'),
+        )
+
+
+def percentile(durations, fraction):
+    """Nearest-rank percentile of a sorted list"""
+    index = max(int(round(fraction * len(durations))) - 1, 0)
+    return durations[min(index, len(durations) - 1)]
+
+
+def run(transport, iterations=50, concurrency=1, only=None):
+    """Run every scenario and return its latency and query statistics"""
+    scenarios = Scenarios(transport)
+    scenarios.prepare()
+    results = {}
+    for name, method, path, data, auth in scenarios.all():
+        if only and not any(name.startswith(prefix) for prefix in only):
+            continue
+
+        def send(_):
+            token = scenarios.token if auth is True else None
+            if auth == 'fresh':
+                token = scenarios.login()['token']
+            return transport.request(
+                method, path(), data() if data else None, token)
+
+        started = time.perf_counter()
+        if concurrency > 1:
+            with ThreadPoolExecutor(concurrency) as pool:
+                samples = list(pool.map(send, range(iterations)))
+        else:
+            samples = [send(number) for number in range(iterations)]
+        elapsed = time.perf_counter() - started
+
+        durations = sorted(sample[2] * 1000 for sample in samples)
+        queries = [sample[3] for sample in samples if sample[3] is not None]
+        statuses = {}
+        for sample in samples:
+            statuses[str(sample[0])] = statuses.get(str(sample[0]), 0) + 1
+        results[name] = {
+            'method': method,
+            'requests': iterations,
+            'statuses': statuses,
+            'mean_ms': round(statistics.mean(durations), 3),
+            'p50_ms': round(percentile(durations, 0.5), 3),
+            'p90_ms': round(percentile(durations, 0.9), 3),
+            'p99_ms': round(percentile(durations, 0.99), 3),
+            'throughput_rps': round(iterations / elapsed, 1),
+            'queries': round(statistics.mean(queries), 2) if queries else None,
+        }
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return the regressions of `results` against a baseline run
+
+    Latency regresses when p50 or p90 grow by more than `tolerance` (a
+    fraction), query counts regress when they grow at all.
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric in ('p50_ms', 'p90_ms'):
+            if current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append('%s %s: %.3f -> %.3f' % (
+                    name, metric, previous[metric], current[metric]))
+        if current['queries'] is not None and previous.get('queries') is not None \
+                and current['queries'] > previous['queries']:
+            regressions.append('%s queries: %s -> %s' % (
+                name, previous['queries'], current['queries']))
+    return regressions
@@ -0,0 +1,155 @@
+"""Bulk import and export of departments as CSV or newline delimited JSON"""
+import csv
+import json
+
+from django.db import transaction
+from rest_framework import serializers
+
+from . import search
+from .cache import bump_generation
+from .models import Change, Department
+from .serializers import DepartmentSerializers
+
+
+FORMATS = ('csv', 'ndjson')
+IMPORT_FIELDS = ('name', 'service', 'email', 'phone_number')
+EXPORT_FIELDS = ('id', ) + IMPORT_FIELDS + ('created_by_id', )
+
+
+class DepartmentImportSerializer(DepartmentSerializers):
+    """Validates a single imported row
+
+    Email uniqueness is checked for a whole batch at once by
+    import_departments instead of with one query per row.
+    """
+    email = serializers.EmailField(
+        required=True,
+        error_messages={
+            'required': 'Ensure the email is inserted',
+            'invalid': 'Enter a valid email address.'
+        }
+    )
+
+    class Meta(DepartmentSerializers.Meta):
+        fields = IMPORT_FIELDS
+
+
+def format_for(content_type=None, filename=None):
+    """Guess the format of an import from its content type or file name"""
+    if filename and filename.endswith('.csv'):
+        return 'csv'
+    if content_type and 'csv' in content_type:
+        return 'csv'
+    return 'ndjson'
+
+
+def read_rows(lines, format):
+    """Yield (row number, row, error) for each record in a stream of lines
+
+    `lines` may yield bytes or text and is consumed lazily, so a file of
+    any size is processed one row at a time.
+    """
+    lines = (
+        line.decode('utf-8') if isinstance(line, bytes) else line
+        for line in lines
+    )
+    if format == 'csv':
+        for number, row in enumerate(csv.DictReader(lines), start=1):
+            yield number, row, None
+        return
+
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield number, None, {'non_field_errors': ['Invalid JSON']}
+            continue
+        if not isinstance(row, dict):
+            yield number, None, {'non_field_errors': ['Expected a JSON object']}
+            continue
+        yield number, row, None
+
+
+def import_departments(rows, created_by=None, batch_size=500):
+    """Validate and insert departments in batches
+
+    Rows are validated individually, then each batch checks the emails it
+    contains with a single query and is written with bulk_create. Invalid
+    rows are skipped and reported; everything else is inserted in one
+    transaction.
+    """
+    report = {'created': 0, 'errors': []}
+    seen_emails = set()
+
+    def flush(batch):
+        emails = [serializer.validated_data['email'] for _, serializer in batch]
+        taken = set(Department.objects.filter(
+            email__in=emails).values_list('email', flat=True))
+        departments = []
+        for number, serializer in batch:
+            email = serializer.validated_data['email']
+            if email in taken or email in seen_emails:
+                report['errors'].append({
+                    'row': number,
+                    'errors': {'email': ['department with this email already exists.']}
+                })
+                continue
+            seen_emails.add(email)
+            departments.append(
+                Department(created_by=created_by, **serializer.validated_data))
+        Department.objects.bulk_create(departments, batch_size=batch_size)
+        created = Department.objects.filter(
+            email__in=[department.email for department in departments])
+        search.reindex(created)
+        Change.objects.record(
+            Change.DEPARTMENT, created.values_list('id', flat=True))
+        report['created'] += len(departments)
+
+    with transaction.atomic():
+        batch = []
+        for number, row, error in rows:
+            if error is None:
+                serializer = DepartmentImportSerializer(data=row)
+                if serializer.is_valid():
+                    batch.append((number, serializer))
+                else:
+                    error = serializer.errors
+            if error is not None:
+                report['errors'].append({'row': number, 'errors': error})
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+
+    report['errors'].sort(key=lambda error: error['row'])
+    if report['created']:
+        # bulk_create does not send post_save, search was reindexed and
+        # the changes logged above
+        bump_generation()
+    return report
+
+
+class Echo:
+    """A file-like object that returns what is written to it"""
+
+    def write(self, value):
+        return value
+
+
+def export_departments(format, chunk_size=2000):
+    """Yield every department as CSV or NDJSON without loading the table"""
+    rows = Department.objects.order_by('id').values_list(
+        *EXPORT_FIELDS).iterator(chunk_size=chunk_size)
+    if format == 'csv':
+        writer = csv.writer(Echo())
+        yield writer.writerow(EXPORT_FIELDS)
+        for row in rows:
+            yield writer.writerow(row)
+        return
+
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_FIELDS, row))) + '\n'
+
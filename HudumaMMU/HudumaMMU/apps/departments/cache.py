@@ -0,0 +1,108 @@
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+
+from ...metrics import rendering
+from ...renderers import FastJSONRenderer
+from ...routers import primary
+
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 600,
+    'KEY_PREFIX': 'departments',
+}
+
+
+def get_options():
+    return dict(DEFAULTS, **getattr(settings, 'DEPARTMENT_RESPONSE_CACHE', {}))
+
+
+def get_cache():
+    return caches[get_options()['CACHE_ALIAS']]
+
+
+def generation_key(namespace):
+    return '%s:generation:%s' % (get_options()['KEY_PREFIX'], namespace)
+
+
+def get_generation(namespace='departments'):
+    """Return the current generation of a namespace of cached responses
+
+    Every cached response is keyed on the generations of the data it
+    shows, so moving one to a new generation invalidates all of them at
+    once. Department responses depend on the 'departments' namespace,
+    those embedding ratings or review counts also on 'ratings' or
+    'reviews'.
+    """
+    generation = get_cache().get(generation_key(namespace))
+    if generation is None:
+        generation = bump_generation(namespace)
+    return generation
+
+
+def bump_generation(namespace='departments'):
+    """Start a new generation, making the namespace's responses stale"""
+    generation = {
+        'version': uuid.uuid4().hex,
+        'last_modified': int(time.time())
+    }
+    get_cache().set(generation_key(namespace), generation, None)
+    return generation
+
+
+def is_not_modified(request, etag, last_modified):
+    """Check the conditional request headers against a cached response
+
+    Unlike django.utils.cache.get_conditional_response this also applies
+    to the POST lookup endpoint, which only reads data.
+    """
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        return '*' in etags or etag in etags
+    if_modified_since = parse_http_date_safe(
+        request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+    return if_modified_since is not None and last_modified <= if_modified_since
+
+
+def cached_response(request, key, build, namespaces=('departments', )):
+    """Serve a department response from the cache
+
+    `build` returns the data to serialize and is only called on a miss.
+    The rendered JSON is stored together with its ETag so conditional
+    requests can be answered with a 304 without touching the database.
+    """
+    options = get_options()
+    generations = [get_generation(namespace) for namespace in namespaces]
+    cache_key = '%s:response:%s:%s' % (
+        options['KEY_PREFIX'],
+        ':'.join(generation['version'] for generation in generations), key)
+    entry = get_cache().get(cache_key)
+    if entry is None:
+        # Built from the primary, the cached entry would otherwise keep
+        # serving a lagging replica's data until the next change
+        with primary():
+            data = build()
+        with rendering(request):
+            content = FastJSONRenderer().render(data)
+        entry = {
+            'content': content,
+            'etag': '"%s"' % hashlib.md5(content).hexdigest(),
+            'last_modified': max(
+                generation['last_modified'] for generation in generations)
+        }
+        get_cache().set(cache_key, entry, options['TIMEOUT'])
+
+    if is_not_modified(request, entry['etag'], entry['last_modified']):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(entry['content'], content_type='application/json')
+    response['ETag'] = entry['etag']
+    response['Last-Modified'] = http_date(entry['last_modified'])
+    return response
@@ -0,0 +1,420 @@
+"""Background processing of department image uploads
+
+Saving a department with an uploaded image no longer resizes it inside
+the request. The original upload is put in the storage backend as is, the
+department is saved with its name in image_original and an image_status
+of pending and, once the transaction commits, a job is queued that
+resizes the image, renders its derivatives (a thumbnail, a medium JPEG
+and a WebP copy), stores them and updates the department. Stored files
+are named by the hash of their content, so their URLs never change
+meaning and can be cached forever.
+
+Jobs of the ThreadPoolQueue only live in memory. Every web process that
+has one also sweeps for departments whose job was lost with a process
+that stopped, and queues their stored original again; the
+requeue_stale_images command runs the same sweep by hand.
+
+The queue and the storage are pluggable through DEPARTMENT_IMAGES, so
+tests can run jobs synchronously against LocalStorage instead of
+Cloudinary.
+"""
+import datetime
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps
+from cloudinary import uploader
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .cache import bump_generation
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'QUEUE': 'HudumaMMU.apps.departments.images.ThreadPoolQueue',
+    'STORAGE': 'HudumaMMU.apps.departments.images.CloudinaryStorage',
+    # Threads of the ThreadPoolQueue in each process
+    'WORKERS': 2,
+    # Directory and URL prefix of the LocalStorage backend
+    'LOCAL_ROOT': os.path.join(tempfile.gettempdir(), 'huduma-images'),
+    'LOCAL_URL': '/api/v1/images/',
+    # Longest side in pixels of the stored image
+    'MAX_DIMENSION': 1600,
+    # Copies rendered from every image, by longest side and format
+    'DERIVATIVES': {
+        'thumbnail': {'dimension': 200, 'format': 'JPEG'},
+        'medium': {'dimension': 800, 'format': 'JPEG'},
+        'webp': {'dimension': 800, 'format': 'WEBP'},
+    },
+    'QUALITY': 85,
+    # Seconds after which requeue_stale() takes a pending or processing
+    # upload's job for lost
+    'STALE_AFTER': 15 * 60,
+    # Seconds between the sweeps of each ThreadPoolQueue for lost jobs,
+    # None to never sweep
+    'REQUEUE_INTERVAL': 5 * 60,
+}
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp', 'PNG': 'png'}
+
+PENDING = 'pending'
+PROCESSING = 'processing'
+READY = 'ready'
+FAILED = 'failed'
+STATUSES = (
+    (PENDING, 'Pending'),
+    (PROCESSING, 'Processing'),
+    (READY, 'Ready'),
+    (FAILED, 'Failed'),
+)
+
+
+def get_options():
+    return dict(DEFAULTS, **getattr(settings, 'DEPARTMENT_IMAGES', {}))
+
+
+class ThreadPoolQueue:
+    """Runs jobs on a pool of threads in the web process
+
+    A daemon thread requeues the jobs other processes lost every
+    REQUEUE_INTERVAL seconds.
+    """
+
+    def __init__(self, options):
+        self.executor = ThreadPoolExecutor(
+            max_workers=options['WORKERS'],
+            thread_name_prefix='department-images')
+        self.stopped = threading.Event()
+        if options['REQUEUE_INTERVAL']:
+            threading.Thread(
+                target=self.sweep, args=(options['REQUEUE_INTERVAL'], ),
+                name='department-images-sweeper', daemon=True).start()
+
+    def submit(self, function, *args):
+        self.executor.submit(self.run, function, *args)
+
+    def sweep(self, interval):
+        while not self.stopped.wait(interval):
+            try:
+                self.run(requeue_stale)
+            except Exception:
+                logger.exception('Requeueing stale image uploads failed')
+
+    def close(self):
+        self.stopped.set()
+
+    @staticmethod
+    def run(function, *args):
+        """Run a job with the connection handling of a request"""
+        close_old_connections()
+        try:
+            function(*args)
+        finally:
+            close_old_connections()
+
+
+class SyncQueue:
+    """Runs jobs right away in the calling thread, for tests and scripts"""
+
+    def __init__(self, options):
+        pass
+
+    def submit(self, function, *args):
+        function(*args)
+
+    def close(self):
+        pass
+
+
+def as_resource(name):
+    """Parse a stored name the way Department.image reads it back"""
+    from .models import Department
+
+    return Department._meta.get_field('image').to_python(name)
+
+
+class CloudinaryStorage:
+    """Stores images on Cloudinary under their name without extension"""
+
+    def __init__(self, options):
+        self.options = options
+
+    def save(self, name, content):
+        """Upload the bytes in `content` and return the stored name"""
+        resource = uploader.upload_resource(
+            io.BytesIO(content), public_id=os.path.splitext(name)[0])
+        return resource.get_prep_value()
+
+    def url(self, name):
+        return as_resource(name).url
+
+    def read(self, name):
+        with urllib.request.urlopen(self.url(name)) as response:
+            return response.read()
+
+    def delete(self, name):
+        uploader.destroy(as_resource(name).public_id)
+
+
+class LocalStorage:
+    """Stores images as files under LOCAL_ROOT
+
+    Names are accepted both as saved and as read back from
+    Department.image, which prefixes them with the resource type.
+    """
+
+    def __init__(self, options):
+        self.root = options['LOCAL_ROOT']
+        self.base_url = options['LOCAL_URL']
+
+    def relative_path(self, name):
+        resource = as_resource(name)
+        if resource.format:
+            return '%s.%s' % (resource.public_id, resource.format)
+        return resource.public_id
+
+    def path(self, name):
+        return os.path.join(self.root, *self.relative_path(name).split('/'))
+
+    def save(self, name, content):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.part', 'wb') as handle:
+            handle.write(content)
+        os.replace(path + '.part', path)
+        return name
+
+    def url(self, name):
+        return self.base_url + self.relative_path(name)
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as handle:
+            return handle.read()
+
+    def delete(self, name):
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+
+_queue = None
+_storage = None
+
+
+def get_queue():
+    """Return the process wide job queue configured by DEPARTMENT_IMAGES"""
+    global _queue
+    if _queue is None:
+        options = get_options()
+        _queue = import_string(options['QUEUE'])(options)
+    return _queue
+
+
+def get_storage():
+    """Return the process wide image storage configured by DEPARTMENT_IMAGES"""
+    global _storage
+    if _storage is None:
+        options = get_options()
+        _storage = import_string(options['STORAGE'])(options)
+    return _storage
+
+
+@receiver(setting_changed)
+def reset_backends(setting, **kwargs):
+    global _queue, _storage
+    if setting == 'DEPARTMENT_IMAGES':
+        if _queue is not None:
+            _queue.close()
+        _queue = _storage = None
+
+
+def store_original(upload):
+    """Put an uploaded file in the storage and return its stored name
+
+    Unlike a local file the stored original outlives the process, so a
+    job lost in a restart can be queued again from any other one.
+    """
+    content = b''.join(upload.chunks())
+    name = 'departments/originals/%s' % hashlib.sha256(content).hexdigest()[:32]
+    return get_storage().save(name, content)
+
+
+def schedule(department):
+    """Process the stored original of a saved department in the background
+
+    The job is queued when the surrounding transaction commits so the
+    worker always finds the department.
+    """
+    name = department.image_original
+    transaction.on_commit(
+        lambda: get_queue().submit(process_upload, department.pk, name))
+
+
+def resized(image, dimension):
+    """Return a copy of `image` no larger than `dimension` on either side"""
+    image = image.copy()
+    image.thumbnail((dimension, dimension), Image.LANCZOS)
+    return image
+
+
+def encode(image, file_format, quality):
+    output = io.BytesIO()
+    if file_format == 'WEBP':
+        image.save(output, file_format, quality=quality, method=4)
+    else:
+        image.save(output, file_format, quality=quality, optimize=True, progressive=True)
+    return output.getvalue()
+
+
+def hashed_name(department_id, content, file_format):
+    """Name stored content by its hash so its URL can be cached forever"""
+    return 'departments/%d/%s.%s' % (
+        department_id, hashlib.sha256(content).hexdigest()[:32],
+        EXTENSIONS[file_format])
+
+
+def decode(content):
+    """Open image bytes upright and in RGB"""
+    with Image.open(io.BytesIO(content)) as original:
+        return ImageOps.exif_transpose(original).convert('RGB')
+
+
+def store_derivatives(department_id, image, storage, options):
+    """Render and store every derivative listed in DERIVATIVES
+
+    Returns the ImageDerivative fields of each kind.
+    """
+    derivatives = {}
+    for kind, spec in options['DERIVATIVES'].items():
+        derivative = resized(image, spec['dimension'])
+        content = encode(derivative, spec['format'], options['QUALITY'])
+        derivatives[kind] = {
+            'name': storage.save(
+                hashed_name(department_id, content, spec['format']), content),
+            'width': derivative.width,
+            'height': derivative.height,
+        }
+    return derivatives
+
+
+def save_derivatives(department_id, derivatives):
+    from .models import Change, ImageDerivative
+
+    for kind, fields in derivatives.items():
+        ImageDerivative.objects.update_or_create(
+            department_id=department_id, kind=kind, defaults=fields)
+    Change.objects.record(Change.DEPARTMENT, [department_id])
+
+
+def process_upload(department_id, name):
+    """Resize, render the derivatives of and store an uploaded original"""
+    from .models import Change, Department
+
+    # The department's original changes when a newer upload replaces it
+    # and is cleared once processed, so a requeued job that already ran
+    # or was superseded does nothing
+    options = get_options()
+    storage = get_storage()
+    if not Department.objects.filter(
+            pk=department_id, image_original=name).update(image_status=PROCESSING):
+        discard_original(storage, name)
+        return
+    try:
+        image = decode(storage.read(name))
+        content = encode(
+            resized(image, options['MAX_DIMENSION']), 'JPEG', options['QUALITY'])
+        stored = storage.save(hashed_name(department_id, content, 'JPEG'), content)
+        derivatives = store_derivatives(department_id, image, storage, options)
+    except Exception:
+        logger.exception('Processing the image of department %s failed', department_id)
+        if Department.objects.filter(pk=department_id, image_original=name).update(
+                image_status=FAILED, image_original=''):
+            Change.objects.record(Change.DEPARTMENT, [department_id])
+            bump_generation()
+        discard_original(storage, name)
+        return
+
+    with transaction.atomic():
+        department = Department.objects.select_for_update().filter(
+            pk=department_id, image_original=name).first()
+        if department is not None:
+            save_derivatives(department_id, derivatives)
+            department.image = stored
+            department.image_status = READY
+            department.image_original = ''
+            department.save(update_fields=['image', 'image_status', 'image_original'])
+    discard_original(storage, name)
+
+
+def discard_original(storage, name):
+    """Delete a processed original no other department is waiting on"""
+    from .models import Department
+
+    if Department.objects.filter(image_original=name).exists():
+        return
+    try:
+        storage.delete(name)
+    except Exception:
+        logger.exception('Deleting the original image %s failed', name)
+
+
+def requeue_stale(stale_after=None):
+    """Queue again the uploads whose jobs were lost with their process
+
+    The ThreadPoolQueue keeps jobs in memory, a restart drops them and
+    their departments would stay pending. Departments pending or
+    processing for longer than STALE_AFTER seconds get their stored
+    original queued again, or are marked failed when they have none.
+    Returns the numbers of requeued and failed departments.
+    """
+    from .models import Change, Department
+
+    if stale_after is None:
+        stale_after = get_options()['STALE_AFTER']
+    now = timezone.now()
+    stale = Department.objects.filter(
+        Q(image_queued_at__lte=now - datetime.timedelta(seconds=stale_after))
+        | Q(image_queued_at=None),
+        image_status__in=(PENDING, PROCESSING))
+    requeued, failed = [], []
+    for department_id, name in stale.values_list('id', 'image_original'):
+        # Claiming the department keeps concurrent sweeps from queueing
+        # the same upload twice
+        claimed = stale.filter(pk=department_id, image_original=name).update(
+            image_status=PENDING if name else FAILED, image_queued_at=now)
+        if not claimed:
+            continue
+        if name:
+            get_queue().submit(process_upload, department_id, name)
+            requeued.append(department_id)
+        else:
+            failed.append(department_id)
+    if failed:
+        Change.objects.record(Change.DEPARTMENT, failed)
+        bump_generation()
+    return len(requeued), len(failed)
+
+
+def backfill(department_id, name):
+    """Render and store the derivatives of an already stored image
+
+    Runs in the worker processes of the backfill_image_derivatives command
+    and touches no database, the caller saves what it returns.
+    """
+    options = get_options()
+    storage = get_storage()
+    image = decode(storage.read(name))
+    return department_id, store_derivatives(department_id, image, storage, options)
@@ -0,0 +1,186 @@
+"""Departments ranked by their Bayesian weighted rating
+
+A department's score is (PRIOR_WEIGHT * prior + rating_sum) /
+(PRIOR_WEIGHT + rating_count). The prior is the mean of every rating, so a
+department needs many good ratings, not one, to climb to the top.
+
+Each process keeps the ranking as a sorted list built from RatingAggregate.
+Whenever a department's aggregate or the department itself changes, its
+id is appended to a change log in the shared cache. Readers replay the log
+and only reload the departments it names, so a ranking that is up to date
+costs one cache read and no query. The prior is frozen between full
+rebuilds, which keeps the scores of unchanged departments stable.
+"""
+import bisect
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+
+from ...routers import primary
+
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'leaderboard',
+    # Ratings worth of prior mean added to every department
+    'PRIOR_WEIGHT': 10,
+    # Seconds between full rebuilds, which refresh the prior
+    'REBUILD_INTERVAL': 3600,
+    # Changes kept in the log, a process further behind rebuilds instead
+    'MAX_CHANGES': 1000,
+}
+
+
+class Entry:
+    __slots__ = ('department_id', 'service', 'rating_count', 'rating_sum', 'score')
+
+    def __init__(self, department_id, service, rating_count, rating_sum, score):
+        self.department_id = department_id
+        self.service = service
+        self.rating_count = rating_count
+        self.rating_sum = rating_sum
+        self.score = score
+
+    @property
+    def key(self):
+        return (-self.score, self.department_id)
+
+    @property
+    def average_rating(self):
+        return self.rating_sum / self.rating_count
+
+
+class Leaderboard:
+    def __init__(self, options):
+        self.options = options
+        self.lock = threading.Lock()
+        self.version = None
+        self.built_at = 0
+        self.prior = 0
+        self.keys = []
+        self.entries = {}
+
+    @property
+    def cache(self):
+        return caches[self.options['CACHE_ALIAS']]
+
+    def key(self, *parts):
+        return ':'.join((self.options['KEY_PREFIX'], ) + tuple(map(str, parts)))
+
+    def current_version(self):
+        version = self.cache.get(self.key('version'))
+        if version is None:
+            self.cache.add(self.key('version'), 0, None)
+            version = self.cache.get(self.key('version'))
+        return version
+
+    def changed(self, department_id=None):
+        """Log that the rating or the department itself changed
+
+        Without a department every process rebuilds its whole ranking.
+        """
+        self.cache.add(self.key('version'), 0, None)
+        if department_id is None:
+            self.cache.incr(self.key('version'), self.options['MAX_CHANGES'] + 1)
+            return
+        version = self.cache.incr(self.key('version'))
+        self.cache.set(self.key('change', version), department_id, 24 * 3600)
+
+    def rows(self, department_ids=None):
+        from .models import RatingAggregate
+
+        aggregates = RatingAggregate.objects.filter(rating_count__gt=0)
+        if department_ids is not None:
+            aggregates = aggregates.filter(pk__in=department_ids)
+        return aggregates.values_list(
+            'department_id', 'department__service', 'rating_count', 'rating_sum')
+
+    def score(self, rating_count, rating_sum):
+        weight = self.options['PRIOR_WEIGHT']
+        return (weight * self.prior + rating_sum) / (weight + rating_count)
+
+    def entry(self, department_id, service, rating_count, rating_sum):
+        return Entry(department_id, (service or '').lower(), rating_count,
+                     rating_sum, self.score(rating_count, rating_sum))
+
+    def rebuild(self, version):
+        rows = list(self.rows())
+        total_count = sum(row[2] for row in rows)
+        self.prior = sum(row[3] for row in rows) / total_count if total_count else 0
+        self.entries = {row[0]: self.entry(*row) for row in rows}
+        self.keys = sorted(entry.key for entry in self.entries.values())
+        self.version = version
+        self.built_at = time.monotonic()
+
+    def remove(self, department_id):
+        entry = self.entries.pop(department_id, None)
+        if entry is not None:
+            del self.keys[bisect.bisect_left(self.keys, entry.key)]
+
+    def replay(self, version):
+        """Reload the departments changed since our version"""
+        changes = self.cache.get_many([
+            self.key('change', number) for number in range(self.version + 1, version + 1)
+        ])
+        if len(changes) != version - self.version:
+            return self.rebuild(version)
+        department_ids = set(changes.values())
+        for department_id in department_ids:
+            self.remove(department_id)
+        for row in self.rows(department_ids):
+            entry = self.entries[row[0]] = self.entry(*row)
+            bisect.insort(self.keys, entry.key)
+        self.version = version
+
+    def sync(self):
+        version = self.current_version()
+        expired = time.monotonic() - self.built_at > self.options['REBUILD_INTERVAL']
+        if version == self.version and not expired:
+            return
+        # The ranking outlives the request, it must not be built from a
+        # lagging replica
+        with self.lock, primary():
+            if self.version is None or expired or version < self.version \
+                    or version - self.version > self.options['MAX_CHANGES']:
+                self.rebuild(version)
+            elif version > self.version:
+                self.replay(version)
+
+    def ranking(self, service=None):
+        """Return the entries best first, optionally of one service only"""
+        self.sync()
+        with self.lock:
+            entries = [self.entries[department_id] for _, department_id in self.keys]
+        if service:
+            service = service.lower()
+            entries = [entry for entry in entries if entry.service == service]
+        return entries
+
+
+_leaderboard = None
+
+
+def get_leaderboard():
+    """Return the process wide ranking configured by DEPARTMENT_LEADERBOARD"""
+    global _leaderboard
+    if _leaderboard is None:
+        options = dict(DEFAULTS, **getattr(settings, 'DEPARTMENT_LEADERBOARD', {}))
+        _leaderboard = Leaderboard(options)
+    return _leaderboard
+
+
+def changed(department_id=None):
+    """Log a change to a department's ranking once the transaction commits"""
+    transaction.on_commit(lambda: get_leaderboard().changed(department_id))
+
+
+@receiver(setting_changed)
+def reset_leaderboard(setting, **kwargs):
+    global _leaderboard
+    if setting in ('DEPARTMENT_LEADERBOARD', 'CACHES'):
+        _leaderboard = None
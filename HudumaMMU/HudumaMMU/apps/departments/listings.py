@@ -0,0 +1,208 @@
+"""Read-only department and review listings built from values() rows
+
+List endpoints render many rows at a time, and creating a model instance
+and running the DRF field machinery for each of them costs more than the
+queries do. These functions produce the same output as
+DepartmentSerializers and ReviewSerializer straight from plain rows, for
+any ?fields= selection.
+"""
+import operator
+from functools import reduce
+
+from django.db.models import Case, F, IntegerField, Q, Value, When, Window
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+
+from .models import DEPARTMENT_COLUMNS, Department, ImageDerivative, Review
+from . import images
+
+
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+          'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+DEPARTMENT_FIELDS = (
+    'id', 'name', 'service', 'email', 'phone_number', 'image', 'image_status',
+    'image_derivatives', 'created_by',
+)
+REVIEW_COLUMNS = {
+    'id': 'id', 'department_id': 'department_id', 'body': 'body',
+    'author_id': 'author_id', 'created_at': 'created_at',
+    'updated_at': 'updated_at', 'author': 'author__email',
+    'department': 'department__name',
+}
+REVIEW_FIELDS = (
+    'id', 'department_id', 'body', 'author_id', 'created_at', 'updated_at',
+    'children', 'author', 'department', 'reply_count',
+)
+
+
+def format_date(value):
+    """Format a timestamp like '05 Mar 2020 14:02:09' without strftime"""
+    return '%02d %s %d %02d:%02d:%02d' % (
+        value.day, MONTHS[value.month - 1], value.year,
+        value.hour, value.minute, value.second)
+
+
+def department_rows(queryset, fields):
+    """The values() of a department queryset needed to render `fields`"""
+    columns = ['id'] + [name for name in DEPARTMENT_COLUMNS if name in fields]
+    columns += [
+        name for name in ('average_rating', 'rating_count', 'review_count')
+        if name in queryset.query.annotations
+    ]
+    return queryset.prefetch_related(None).values(*columns)
+
+
+def departments(rows, fields):
+    """Render department rows like DepartmentSerializers(many=True)"""
+    image_field = Department._meta.get_field('image')
+    derivatives = {}
+    if 'image_derivatives' in fields:
+        storage = images.get_storage()
+        for department_id, kind, name, width, height in ImageDerivative.objects.filter(
+                department_id__in=[row['id'] for row in rows]).values_list(
+                    'department_id', 'kind', 'name', 'width', 'height'):
+            derivatives.setdefault(department_id, {})[kind] = {
+                'url': storage.url(name), 'width': width, 'height': height,
+            }
+
+    selected = [name for name in DEPARTMENT_FIELDS if name in fields]
+    results = []
+    for row in rows:
+        item = {}
+        for name in selected:
+            if name == 'image_derivatives':
+                item[name] = derivatives.get(row['id'], {})
+            elif name == 'image':
+                image = row['image']
+                item[name] = None if image is None else image_field.get_prep_value(image)
+            else:
+                item[name] = row[name]
+        if 'average_rating' in row and 'rating_summary' in fields:
+            item['rating_summary'] = {
+                'average_rating': row['average_rating'],
+                'rating_count': row['rating_count'],
+            }
+        if 'review_count' in row and 'review_count' in fields:
+            item['review_count'] = row['review_count']
+        results.append(item)
+    return results
+
+
+def review_rows(queryset, fields):
+    """The values() of a review queryset needed to render `fields`
+
+    created_at is always loaded as it orders threads and their cursors.
+    """
+    columns = ['id', 'created_at'] + [
+        column for name, column in REVIEW_COLUMNS.items() if name in fields]
+    if 'children' in fields:
+        columns += ['path', 'depth']
+    if 'reply_count' in fields:
+        columns.append('reply_count')
+    return queryset.prefetch_related(None).values(*columns)
+
+
+def reply_trees(roots, depth=None, limit=None):
+    """Return the replies under each (id, path, depth) root as nested lists
+
+    Every subtree is loaded with one query on the indexed path prefixes,
+    limited to `depth` levels below its root. The replies come ordered by
+    depth, then path, so each comes after its parent and the trees are
+    assembled in a single pass. A root keeps its first `limit` replies in
+    that order, which are the ones closest to it; with several roots the
+    replies are numbered per root by a window function so the database
+    only returns those. A root without a path yet gets no replies, an
+    empty prefix would match every review.
+    """
+    trees = {root[0]: [] for root in roots}
+    subtrees = []
+    for root_id, path, root_depth in roots:
+        if not path:
+            continue
+        subtree = Q(path__startswith=path, depth__gt=root_depth)
+        if depth is not None:
+            subtree &= Q(depth__lte=root_depth + depth)
+        subtrees.append((root_id, root_depth, subtree))
+    if not subtrees or depth == 0 or limit == 0:
+        return trees
+    rows = Review.objects.filter(
+        reduce(operator.or_, (subtree for _, _, subtree in subtrees))
+    ).order_by('depth', 'path')
+    if limit is not None and len(subtrees) == 1:
+        rows = rows[:limit]
+    elif limit is not None:
+        rows = rows.filter(pk__in=first_replies(rows, subtrees, limit))
+    rows = rows.values(
+        'id', 'parent_id', 'body', 'author__email', 'created_at', 'updated_at')
+
+    nodes = {}
+    for reply in rows:
+        parent_id = reply['parent_id']
+        if parent_id in nodes:
+            siblings = nodes[parent_id]['children']
+        elif parent_id in trees:
+            siblings = trees[parent_id]
+        else:
+            # Below a reply cut off by the limit
+            continue
+        node = nodes[reply['id']] = {
+            'id': reply['id'],
+            'body': reply['body'],
+            'author': reply['author__email'],
+            'created_at': format_date(reply['created_at']),
+            'updated_at': format_date(reply['updated_at']),
+            'children': trees.get(reply['id'], []),
+        }
+        siblings.append(node)
+    return trees
+
+
+def first_replies(rows, subtrees, limit):
+    """SQL selecting the ids of the first `limit` replies of every root
+
+    The deepest roots are tried first, so a reply under two nested roots
+    counts towards the closer one.
+    """
+    thread = Case(*[
+        When(subtree, then=Value(root_id)) for root_id, _, subtree in sorted(
+            subtrees, key=lambda subtree: -subtree[1])
+    ], output_field=IntegerField())
+    ranked = rows.order_by().annotate(number=Window(
+        RowNumber(), partition_by=[thread], order_by=[F('depth'), F('path')]
+    )).values('id', 'number')
+    sql, params = ranked.query.sql_with_params()
+    return RawSQL(
+        'SELECT ranked.id FROM (%s) ranked WHERE ranked.number <= %%s' % sql,
+        params + (limit,))
+
+
+def attach_replies(reviews, depth=None, limit=None):
+    """Set the reply tree of each review as its _replies"""
+    trees = reply_trees(
+        [(review.id, review.path, review.depth) for review in reviews], depth, limit)
+    for review in reviews:
+        review._replies = trees[review.id]
+
+
+def reviews(rows, fields, depth=None, limit=None):
+    """Render review rows like ReviewSerializer(many=True)"""
+    children = {}
+    if 'children' in fields:
+        children = reply_trees(
+            [(row['id'], row['path'], row['depth']) for row in rows], depth, limit)
+
+    selected = [name for name in REVIEW_FIELDS if name in fields]
+    results = []
+    for row in rows:
+        item = {}
+        for name in selected:
+            if name == 'children':
+                item[name] = children[row['id']]
+            elif name in ('created_at', 'updated_at'):
+                item[name] = format_date(row[name])
+            elif name == 'reply_count':
+                item[name] = row[name]
+            else:
+                item[name] = row[REVIEW_COLUMNS[name]]
+        results.append(item)
+    return results
@@ -0,0 +1,63 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.db.models import Count
+
+from ... import images
+from ...cache import bump_generation
+from ...models import Department
+
+
+class Command(BaseCommand):
+    help = ('Render the missing image derivatives of departments that have '
+            'an image, in parallel worker processes')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'department_ids', nargs='*', type=int,
+            help='Only backfill these departments (default: all)'
+        )
+        parser.add_argument(
+            '--processes', type=int, default=None,
+            help='Worker processes (default: one per CPU)'
+        )
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Render every derivative again, even those already stored'
+        )
+
+    def handle(self, *args, **options):
+        departments = Department.objects.exclude(image=None).exclude(image='')
+        if options['department_ids']:
+            departments = departments.filter(pk__in=options['department_ids'])
+        if not options['all']:
+            kinds = list(images.get_options()['DERIVATIVES'])
+            complete = Department.objects.filter(
+                image_derivatives__kind__in=kinds
+            ).values('id').annotate(count=Count('image_derivatives')).filter(
+                count=len(kinds)).values('id')
+            departments = departments.exclude(pk__in=complete)
+        jobs = [
+            (department.pk, department.image.get_prep_value())
+            for department in departments.only('id', 'image')
+        ]
+
+        # The workers are forked, they must not share our connections
+        connections.close_all()
+        done = failed = 0
+        with ProcessPoolExecutor(options['processes']) as pool:
+            futures = {pool.submit(images.backfill, *job): job[0] for job in jobs}
+            for future in as_completed(futures):
+                try:
+                    department_id, derivatives = future.result()
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write('Department %d failed: %s' % (futures[future], error))
+                    continue
+                images.save_derivatives(department_id, derivatives)
+                done += 1
+        if done:
+            bump_generation()
+        self.stdout.write(self.style.SUCCESS(
+            'Rendered image derivatives for %d departments, %d failed' % (done, failed)))
@@ -0,0 +1,147 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from ... import benchmarks
+
+
+# Rates of the throttled scopes for a server started by --gunicorn, high
+# enough for the scenarios' writes
+UNTHROTTLED = {
+    'REVIEW_RATE': '1000000/s',
+    'REPLY_RATE': '1000000/s',
+    'RATING_RATE': '1000000/s',
+}
+
+
+class Command(BaseCommand):
+    help = ('Measure latency percentiles, throughput and query counts of every '
+            'API route and emit the results as JSON. By default the routes are '
+            'called in process against a freshly created and seeded test '
+            'database; --url or --gunicorn benchmark a server whose database '
+            'was seeded with seed_benchmark_data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--concurrency', type=int, default=1)
+        parser.add_argument('--only', action='append',
+                            help='Only run scenarios starting with this name')
+        parser.add_argument('--departments', type=int, default=50)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--reviews', type=int, default=2000)
+        parser.add_argument('--replies', type=int, default=2)
+        parser.add_argument('--ratings', type=int, default=20)
+        parser.add_argument('--url', help='Benchmark the server at this URL')
+        parser.add_argument('--gunicorn', action='store_true',
+                            help='Start a local gunicorn and benchmark it')
+        parser.add_argument('--workers', type=int, default=2,
+                            help='gunicorn workers')
+        parser.add_argument('--worker-class', default='sync',
+                            help='gunicorn worker class')
+        parser.add_argument('--app', default='HudumaMMU.wsgi',
+                            help='Application module gunicorn serves')
+        parser.add_argument('--output', help='Write the JSON results to this file')
+        parser.add_argument('--baseline', help='Fail on regressions against this file')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed latency growth against the baseline')
+
+    def handle(self, *args, **options):
+        if options['gunicorn']:
+            results = self.run_gunicorn(options)
+        elif options['url']:
+            results = self.run_http(options['url'], options)
+        else:
+            results = self.run_in_process(options)
+
+        report = {
+            'mode': 'gunicorn' if options['gunicorn'] else 'http' if options['url'] else 'client',
+            'database': connection.vendor,
+            'iterations': options['iterations'],
+            'concurrency': options['concurrency'],
+            'routes': results,
+        }
+        output = json.dumps(report, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output + '\n')
+        self.stdout.write(output)
+
+        if options['baseline']:
+            with open(options['baseline']) as handle:
+                baseline = json.load(handle)['routes']
+            regressions = benchmarks.compare(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('Regressions against %s:\n%s' % (
+                    options['baseline'], '\n'.join(regressions)))
+
+    def run_in_process(self, options):
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False)
+        try:
+            benchmarks.seed(
+                departments=options['departments'],
+                users=options['users'],
+                reviews=options['reviews'],
+                replies=options['replies'],
+                ratings=options['ratings'],
+            )
+            # Every scenario writes far more often than the rate limits allow
+            with override_settings(REQUEST_THROTTLES=dict(
+                    settings.REQUEST_THROTTLES, RATES={})):
+                return benchmarks.run(
+                    benchmarks.ClientTransport(), options['iterations'],
+                    options['concurrency'], options['only'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run_http(self, url, options):
+        return benchmarks.run(
+            benchmarks.HTTPTransport(url), options['iterations'],
+            options['concurrency'], options['only'])
+
+    def run_gunicorn(self, options):
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+        url = 'http://127.0.0.1:%d' % port
+        server = subprocess.Popen(
+            [sys.executable, '-c', 'from gunicorn.app.wsgiapp import run; run()',
+             options['app'],
+             '--bind', '127.0.0.1:%d' % port,
+             '--workers', str(options['workers']),
+             '--worker-class', options['worker_class']],
+            cwd=settings.BASE_DIR,
+            env=dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get(
+                'DJANGO_SETTINGS_MODULE', 'HudumaMMU.settings'), **UNTHROTTLED),
+        )
+        try:
+            self.wait_for(url, server)
+            return self.run_http(url, options)
+        finally:
+            server.terminate()
+            server.wait()
+
+    def wait_for(self, url, server, timeout=30):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if server.poll() is not None:
+                raise CommandError('gunicorn exited with status %s' % server.returncode)
+            try:
+                urllib.request.urlopen(url + '/metrics')
+                return
+            except urllib.error.HTTPError:
+                # Answered, if only to refuse an unauthorized reader
+                return
+            except OSError:
+                time.sleep(0.2)
+        raise CommandError('gunicorn did not start within %d seconds' % timeout)
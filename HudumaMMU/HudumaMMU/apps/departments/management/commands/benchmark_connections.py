@@ -0,0 +1,69 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connection
+from django.db.backends.signals import connection_created
+
+from HudumaMMU import database
+from ...models import Department
+
+
+class Command(BaseCommand):
+    help = ('Compare the cost of a request running one primary key query '
+            'when every request opens its own database connection '
+            '(CONN_MAX_AGE=0) and when connections persist, with and without '
+            'the idle health check. Requests are simulated by sending the '
+            'request signals that open and close connections.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+
+    def handle(self, *args, **options):
+        opened = []
+
+        def count(sender, connection, **kwargs):
+            opened.append(connection.alias)
+
+        department_id = Department.objects.values_list('id', flat=True).first() or 0
+        configured = connection.settings_dict['CONN_MAX_AGE']
+        results = {}
+        connection_created.connect(count)
+        try:
+            for name, max_age, health_check in (
+                    ('per_request', 0, False),
+                    ('persistent', 600, False),
+                    ('persistent_checked', 600, True)):
+                connection.close()
+                connection.settings_dict['CONN_MAX_AGE'] = max_age
+                del opened[:]
+                results[name] = dict(self.timings(
+                    department_id, options['requests'], health_check),
+                    connections_opened=len(opened))
+        finally:
+            connection_created.disconnect(count)
+            connection.settings_dict['CONN_MAX_AGE'] = configured
+            connection.close()
+        results['vendor'] = connection.vendor
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def timings(self, department_id, requests, health_check):
+        durations = []
+        for _ in range(requests):
+            started = time.perf_counter()
+            request_started.send(sender=self.__class__)
+            if health_check:
+                database.check_connections(0)
+            list(Department.objects.filter(pk=department_id).values_list('id'))
+            if health_check:
+                database.mark_used()
+            request_finished.send(sender=self.__class__)
+            durations.append((time.perf_counter() - started) * 1000)
+        durations.sort()
+        return {
+            'mean_ms': round(statistics.mean(durations), 3),
+            'p50_ms': round(durations[len(durations) // 2], 3),
+            'p99_ms': round(durations[int(len(durations) * 0.99)], 3),
+        }
@@ -0,0 +1,49 @@
+import json
+import os
+import tempfile
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+
+DEPLOYMENTS = (
+    ('wsgi-sync', 'HudumaMMU.wsgi', 'sync'),
+    ('asgi-uvicorn', 'HudumaMMU.asgi:application', 'uvicorn.workers.UvicornWorker'),
+)
+READ_ROUTES = ('departments.list', 'departments.retrieve', 'reviews.list', 'ratings.get')
+
+
+class Command(BaseCommand):
+    help = ('Compare the throughput of the read endpoints under concurrent '
+            'connections between gunicorn sync workers and uvicorn workers. '
+            'Seed the configured database with seed_benchmark_data first.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200)
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--workers', type=int, default=2)
+
+    def handle(self, *args, **options):
+        comparison = {}
+        for name, app, worker_class in DEPLOYMENTS:
+            with tempfile.TemporaryDirectory() as directory:
+                output = os.path.join(directory, 'results.json')
+                call_command(
+                    'benchmark_api', gunicorn=True, app=app,
+                    worker_class=worker_class, workers=options['workers'],
+                    iterations=options['iterations'],
+                    concurrency=options['concurrency'],
+                    only=list(READ_ROUTES), output=output, stdout=StringIO())
+                with open(output) as handle:
+                    routes = json.load(handle)['routes']
+            for route, result in routes.items():
+                comparison.setdefault(route, {})[name] = {
+                    metric: result[metric]
+                    for metric in ('throughput_rps', 'p50_ms', 'p99_ms', 'statuses')
+                }
+        self.stdout.write(json.dumps({
+            'workers': options['workers'],
+            'concurrency': options['concurrency'],
+            'routes': comparison,
+        }, indent=2, sort_keys=True))
@@ -0,0 +1,97 @@
+import json
+import random
+import statistics
+import time
+
+from django.db import transaction
+from django.db.models import Q
+from django.core.management.base import BaseCommand
+
+from ... import search
+from ...models import Department
+
+
+WORDS = (
+    'birth', 'certificate', 'passport', 'identity', 'card', 'driving',
+    'licence', 'business', 'permit', 'health', 'insurance', 'pension',
+    'police', 'clearance', 'land', 'registry', 'tax', 'compliance',
+    'marriage', 'student', 'loan', 'vehicle', 'inspection', 'logbook',
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Compare full-text search against icontains scans on a seeded '
+            'department table. The seeded rows are rolled back afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000)
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        try:
+            with transaction.atomic():
+                self.seed(options['rows'])
+                results = self.measure(options['queries'], options['limit'])
+                raise Rollback
+        except Rollback:
+            pass
+        results['rows'] = options['rows']
+        results['backend'] = 'postgresql' if search.uses_postgres() else 'search_term'
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def phrase(self, words):
+        return ' '.join(self.random.choice(WORDS) for _ in range(words))
+
+    def seed(self, rows):
+        departments = (
+            Department(
+                name=self.phrase(2).title(),
+                service=self.phrase(8),
+                email='benchmark-%d@example.com' % number
+            ) for number in range(rows)
+        )
+        batch = []
+        for department in departments:
+            batch.append(department)
+            if len(batch) == 1000:
+                Department.objects.bulk_create(batch)
+                batch = []
+        Department.objects.bulk_create(batch)
+        search.reindex(Department.objects.filter(email__startswith='benchmark-'))
+
+    def measure(self, queries, limit):
+        terms = [self.phrase(2)[:-2] for _ in range(queries)]
+
+        def full_text(term):
+            return search.search(Department.objects.all(), term, limit)
+
+        def icontains(term):
+            matches = Q()
+            for word in term.split():
+                matches &= Q(name__icontains=word) | Q(service__icontains=word)
+            return list(Department.objects.filter(matches).order_by('id')[:limit])
+
+        return {
+            name: self.timings(function, terms)
+            for name, function in (('full_text', full_text), ('icontains', icontains))
+        }
+
+    def timings(self, function, terms):
+        durations = []
+        for term in terms:
+            started = time.perf_counter()
+            function(term)
+            durations.append((time.perf_counter() - started) * 1000)
+        durations.sort()
+        return {
+            'mean_ms': round(statistics.mean(durations), 3),
+            'p50_ms': round(durations[len(durations) // 2], 3),
+            'p95_ms': round(durations[int(len(durations) * 0.95) - 1], 3),
+        }
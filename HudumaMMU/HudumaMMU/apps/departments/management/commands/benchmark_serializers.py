@@ -0,0 +1,97 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from HudumaMMU.renderers import FastJSONRenderer, orjson
+from ... import benchmarks, listings
+from ...models import Department, Review
+from ...serializers import DepartmentSerializers, ReviewSerializer
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Compare rendering department and review listings through the DRF '
+            'serializers and JSONRenderer with the values() listings and '
+            'FastJSONRenderer. The seeded rows are rolled back afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100,
+                            help='Departments or reviews rendered per listing')
+        parser.add_argument('--replies', type=int, default=3)
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                benchmarks.seed(
+                    departments=options['rows'], users=50,
+                    reviews=options['rows'], replies=options['replies'], ratings=5)
+                results = self.measure(options['rows'], options['repeat'])
+                raise Rollback
+        except Rollback:
+            pass
+        results['orjson'] = orjson is not None
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def measure(self, rows, repeat):
+        departments = Department.objects.filter(
+            email__startswith='benchmark-department-').order_by('id')
+        department_fields = set(DepartmentSerializers.sparse_fields)
+        department_id = departments.values_list('id', flat=True)[0]
+        threads = Review.objects.filter(
+            department_id=department_id, parent=None).order_by('-created_at')
+        review_fields = set(ReviewSerializer.sparse_fields)
+
+        def serialized_departments():
+            page = list(departments.for_fields(department_fields)[:rows])
+            return JSONRenderer().render(DepartmentSerializers(page, many=True).data)
+
+        def listed_departments():
+            page = list(listings.department_rows(
+                departments.for_fields(department_fields), department_fields)[:rows])
+            return FastJSONRenderer().render(listings.departments(page, department_fields))
+
+        def serialized_reviews():
+            page = list(threads.with_replies()[:rows])
+            return JSONRenderer().render(ReviewSerializer(page, many=True).data)
+
+        def listed_reviews():
+            page = list(listings.review_rows(
+                threads.with_replies(review_fields), review_fields)[:rows])
+            return FastJSONRenderer().render(listings.reviews(page, review_fields))
+
+        results = {}
+        for name, serialized, listed in (
+                ('departments', serialized_departments, listed_departments),
+                ('reviews', serialized_reviews, listed_reviews)):
+            results[name] = {
+                'serializer': self.timings(serialized, repeat),
+                'listing': self.timings(listed, repeat),
+                'identical': json.loads(serialized()) == json.loads(listed()),
+            }
+
+        data = ReviewSerializer(list(threads.with_replies()[:rows]), many=True).data
+        results['renderer'] = {
+            'json': self.timings(lambda: JSONRenderer().render(data), repeat),
+            'fast': self.timings(lambda: FastJSONRenderer().render(data), repeat),
+        }
+        return results
+
+    def timings(self, function, repeat):
+        durations = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            durations.append((time.perf_counter() - started) * 1000)
+        durations.sort()
+        return {
+            'mean_ms': round(statistics.mean(durations), 3),
+            'p50_ms': round(durations[len(durations) // 2], 3),
+        }
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from ... import bulk
+
+
+class Command(BaseCommand):
+    help = 'Export every department as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=bulk.FORMATS, default='ndjson')
+        parser.add_argument('--output', help='File to write to (default: stdout)')
+
+    def handle(self, *args, **options):
+        rows = bulk.export_departments(options['format'])
+        if not options['output']:
+            for row in rows:
+                self.stdout.write(row, ending='')
+            return
+        with open(options['output'], 'w', newline='') as output:
+            output.writelines(rows)
@@ -0,0 +1,40 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from ... import bulk
+
+
+class Command(BaseCommand):
+    help = 'Import departments from a CSV or NDJSON file'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, - for stdin')
+        parser.add_argument(
+            '--format', choices=bulk.FORMATS,
+            help='Format of the file (default: guessed from the file name)'
+        )
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or bulk.format_for(filename=path)
+        if path == '-':
+            report = self.load(sys.stdin, file_format, options['batch_size'])
+        else:
+            try:
+                with open(path, newline='') as source:
+                    report = self.load(source, file_format, options['batch_size'])
+            except OSError as error:
+                raise CommandError(error)
+
+        for error in report['errors']:
+            self.stderr.write('row %s: %s' % (error['row'], json.dumps(error['errors'])))
+        self.stdout.write(self.style.SUCCESS(
+            'Imported %d departments, %d rows failed' % (
+                report['created'], len(report['errors']))))
+
+    def load(self, source, file_format, batch_size):
+        return bulk.import_departments(
+            bulk.read_rows(source, file_format), batch_size=batch_size)
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from ... import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search index of departments and reviews'
+
+    def handle(self, *args, **options):
+        for model in search.INDEXED_FIELDS:
+            count = search.reindex(model.objects.all())
+            self.stdout.write(self.style.SUCCESS(
+                'Indexed %d %s' % (count, model._meta.verbose_name_plural)))
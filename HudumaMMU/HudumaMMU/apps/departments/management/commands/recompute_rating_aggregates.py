@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from ...models import RatingAggregate
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-department rating aggregates from the ratings table'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'department_ids', nargs='*', type=int,
+            help='Only recompute these departments (default: all)'
+        )
+
+    def handle(self, *args, **options):
+        written = RatingAggregate.objects.rebuild(options['department_ids'])
+        self.stdout.write(self.style.SUCCESS(
+            'Recomputed rating aggregates for %d departments' % written))
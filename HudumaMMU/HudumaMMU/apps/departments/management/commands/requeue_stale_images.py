@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from ... import images
+
+
+class Command(BaseCommand):
+    help = ('Queue again the image uploads of departments left pending or '
+            'processing, whose background job was lost in a restart')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stale-after', type=int, default=None,
+            help='Seconds an upload may wait before it is requeued '
+                 '(default: DEPARTMENT_IMAGES STALE_AFTER)'
+        )
+
+    def handle(self, *args, **options):
+        requeued, failed = images.requeue_stale(options['stale_after'])
+        self.stdout.write(self.style.SUCCESS(
+            'Requeued %d image uploads, %d were lost and marked failed' % (
+                requeued, failed)))
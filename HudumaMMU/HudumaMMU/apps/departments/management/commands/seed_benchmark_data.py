@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ... import benchmarks
+
+
+class Command(BaseCommand):
+    help = ('Seed the configured database with benchmark departments, users, '
+            'reviews and ratings, e.g. before running benchmark_api --url')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--departments', type=int, default=50)
+        parser.add_argument('--users', type=int, default=200)
+        parser.add_argument('--reviews', type=int, default=2000)
+        parser.add_argument('--replies', type=int, default=2,
+                            help='Replies per top-level review')
+        parser.add_argument('--ratings', type=int, default=20,
+                            help='Ratings per department')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            benchmarks.seed(
+                departments=options['departments'],
+                users=options['users'],
+                reviews=options['reviews'],
+                replies=options['replies'],
+                ratings=options['ratings'],
+            )
+        self.stdout.write(self.style.SUCCESS(
+            'Seeded benchmark data, users log in as %s with password %s' % (
+                benchmarks.EMAIL % 1, benchmarks.PASSWORD)))
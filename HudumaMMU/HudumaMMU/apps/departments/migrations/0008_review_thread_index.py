@@ -0,0 +1,17 @@
+# Generated by Django 3.0.3 on 2026-10-18 08:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('departments', '0007_auto_20201023_1337'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['department', 'parent', 'created_at'], name='review_thread_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.0.3 on 2026-10-18 08:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_aggregates(apps, schema_editor):
+    """Fold the existing ratings into the new aggregates"""
+    Rating = apps.get_model('departments', 'Rating')
+    RatingAggregate = apps.get_model('departments', 'RatingAggregate')
+    aggregates = {}
+    for department_id, value in Rating.objects.values_list(
+            'department_id', 'user_rating').iterator():
+        aggregate = aggregates.setdefault(
+            department_id, RatingAggregate(department_id=department_id))
+        bucket = 'rating_%d' % min(max(int(value + 0.5), 1), 5)
+        aggregate.rating_count += 1
+        aggregate.rating_sum += value
+        setattr(aggregate, bucket, getattr(aggregate, bucket) + 1)
+    RatingAggregate.objects.bulk_create(aggregates.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('departments', '0008_review_thread_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingAggregate',
+            fields=[
+                ('department', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_aggregate', serialize=False, to='departments.Department')),
+                ('rating_count', models.PositiveIntegerField(default=0)),
+                ('rating_sum', models.FloatField(default=0)),
+                ('rating_1', models.PositiveIntegerField(default=0)),
+                ('rating_2', models.PositiveIntegerField(default=0)),
+                ('rating_3', models.PositiveIntegerField(default=0)),
+                ('rating_4', models.PositiveIntegerField(default=0)),
+                ('rating_5', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(build_aggregates, migrations.RunPython.noop),
+    ]
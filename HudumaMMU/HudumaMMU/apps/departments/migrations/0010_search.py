@@ -0,0 +1,74 @@
+# Generated by Django 3.0.3 on 2026-10-18 08:44
+
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+GIN_INDEXES = (
+    ('department_search_idx', 'departments_department'),
+    ('review_search_idx', 'departments_review'),
+)
+VECTORS = (
+    ('departments_department',
+     "setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+     "setweight(to_tsvector('simple', coalesce(service, '')), 'B')"),
+    ('departments_review',
+     "setweight(to_tsvector('simple', coalesce(body, '')), 'A')"),
+)
+
+
+def create_search_indexes(apps, schema_editor):
+    """Index and fill the search vectors, other databases use SearchTerm"""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for table, vector in VECTORS:
+        schema_editor.execute('UPDATE %s SET search_vector = %s' % (table, vector))
+    for name, table in GIN_INDEXES:
+        schema_editor.execute(
+            'CREATE INDEX %s ON %s USING gin (search_vector)' % (name, table))
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in GIN_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS %s' % name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('departments', '0009_ratingaggregate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('object_id', models.PositiveIntegerField()),
+                ('term', models.CharField(max_length=50)),
+                ('weight', models.FloatField(default=1)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='department',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='searchterm',
+            index=models.Index(fields=['kind', 'term'], name='search_term_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchterm',
+            index=models.Index(fields=['kind', 'object_id'], name='search_object_idx'),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
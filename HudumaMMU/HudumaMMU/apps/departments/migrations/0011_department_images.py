@@ -0,0 +1,33 @@
+# Generated by Django 3.0.3 on 2026-10-18 08:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('departments', '0010_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='department',
+            name='image_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], editable=False, max_length=20),
+        ),
+        migrations.CreateModel(
+            name='ImageDerivative',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=20)),
+                ('name', models.CharField(max_length=255)),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('department', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='image_derivatives', to='departments.Department')),
+            ],
+            options={
+                'unique_together': {('department', 'kind')},
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.0.3 on 2026-10-18 09:09
+
+from django.db import migrations, models
+
+
+def log_existing(apps, schema_editor):
+    """Log everything that already exists so a sync from 0 returns it all"""
+    Change = apps.get_model('departments', 'Change')
+    for kind, model in (('department', 'Department'), ('review', 'Review'),
+                        ('rating', 'RatingAggregate')):
+        ids = apps.get_model('departments', model).objects.order_by(
+            'pk').values_list('pk', flat=True)
+        Change.objects.bulk_create(
+            (Change(kind=kind, object_id=object_id) for object_id in ids.iterator()),
+            batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('departments', '0011_department_images'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('department', 'Department'), ('review', 'Review'), ('rating', 'Rating aggregate')], max_length=20)),
+                ('object_id', models.PositiveIntegerField()),
+                ('deleted', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(log_existing, migrations.RunPython.noop),
+    ]
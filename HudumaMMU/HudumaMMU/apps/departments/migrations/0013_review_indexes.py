@@ -0,0 +1,25 @@
+# Generated by Django 3.0.3 on 2026-10-18 09:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('departments', '0012_change_log'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='review',
+            name='review_thread_idx',
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['department', 'parent', 'created_at', 'id'], name='review_thread_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['parent', 'created_at'], name='review_reply_idx'),
+        ),
+    ]
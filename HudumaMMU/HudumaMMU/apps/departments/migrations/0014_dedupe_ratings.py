@@ -0,0 +1,45 @@
+# Generated by Django 3.0.3 on 2026-10-18 09:14
+
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def dedupe_ratings(apps, schema_editor):
+    """Keep only the latest rating of each user for a department
+
+    The aggregates of the departments that lost ratings are recomputed
+    from the ratings left, and the changes logged for sync.
+    """
+    Rating = apps.get_model('departments', 'Rating')
+    RatingAggregate = apps.get_model('departments', 'RatingAggregate')
+    Change = apps.get_model('departments', 'Change')
+    duplicates = Rating.objects.values('user', 'department').order_by().annotate(
+        count=Count('id'), latest=Max('id')).filter(count__gt=1)
+    department_ids = set()
+    for row in duplicates.iterator():
+        Rating.objects.filter(
+            user_id=row['user'], department_id=row['department']
+        ).exclude(pk=row['latest']).delete()
+        department_ids.add(row['department'])
+
+    for department_id in sorted(department_ids):
+        aggregate = RatingAggregate(department_id=department_id)
+        for value in Rating.objects.filter(
+                department_id=department_id).values_list('user_rating', flat=True):
+            bucket = 'rating_%d' % min(max(int(value + 0.5), 1), 5)
+            aggregate.rating_count += 1
+            aggregate.rating_sum += value
+            setattr(aggregate, bucket, getattr(aggregate, bucket) + 1)
+        aggregate.save()
+        Change.objects.create(kind='rating', object_id=department_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('departments', '0013_review_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_ratings, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.0.3 on 2026-10-18 09:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('departments', '0014_dedupe_ratings'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='rating',
+            constraint=models.UniqueConstraint(fields=('user', 'department'), name='rating_user_department_unique'),
+        ),
+    ]
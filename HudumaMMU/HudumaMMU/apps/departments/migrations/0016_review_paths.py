@@ -0,0 +1,43 @@
+# Generated by Django 3.0.3 on 2026-10-18 09:17
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Cast, Concat, LPad
+
+
+def fill_paths(apps, schema_editor):
+    """Give every review its path, one level of replies per update"""
+    Review = apps.get_model('departments', 'Review')
+    segment = Concat(
+        LPad(Cast('id', models.CharField(max_length=10)), 10, Value('0')), Value('/'))
+    Review.objects.filter(parent=None).update(path=segment, depth=0)
+    parents = Review.objects.filter(pk=OuterRef('parent_id'))
+    while Review.objects.filter(path='', parent__path__gt='').update(
+            path=Concat(Subquery(parents.values('path')), segment),
+            depth=Subquery(parents.values('depth')) + 1):
+        pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('departments', '0015_rating_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='review',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='path',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['path'], name='review_path_idx', opclasses=['varchar_pattern_ops']),
+        ),
+    ]
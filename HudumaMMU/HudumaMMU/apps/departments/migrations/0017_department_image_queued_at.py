@@ -0,0 +1,18 @@
+# Generated by Django 3.0.3 on 2026-10-18 09:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('departments', '0016_review_paths'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='department',
+            name='image_queued_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 3.0.3 on 2026-10-18 09:43
+
+import HudumaMMU.apps.departments.models
+from django.db import migrations
+
+
+INDEXES = (
+    ('department', HudumaMMU.apps.departments.models.SearchVectorIndex(
+        fields=['search_vector'], name='department_search_idx')),
+    ('review', HudumaMMU.apps.departments.models.SearchVectorIndex(
+        fields=['search_vector'], name='review_search_idx')),
+)
+
+
+def add_fallback_indexes(apps, schema_editor):
+    """0010 already created the GIN indexes on PostgreSQL"""
+    if schema_editor.connection.vendor == 'postgresql':
+        return
+    for model_name, index in INDEXES:
+        schema_editor.add_index(apps.get_model('departments', model_name), index)
+
+
+def remove_fallback_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        return
+    for model_name, index in INDEXES:
+        schema_editor.remove_index(apps.get_model('departments', model_name), index)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('departments', '0017_department_image_queued_at'),
+    ]
+
+    operations = [
+        # Records the indexes 0010 created with raw SQL in the migration
+        # state, so later schema changes and squashes keep them
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(model_name=model_name, index=index)
+                for model_name, index in INDEXES
+            ],
+            database_operations=[
+                migrations.RunPython(add_fallback_indexes, remove_fallback_indexes),
+            ],
+        ),
+    ]
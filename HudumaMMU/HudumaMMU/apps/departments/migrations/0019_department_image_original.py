@@ -0,0 +1,18 @@
+# Generated by Django 3.0.3 on 2026-10-18 09:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('departments', '0018_search_indexes_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='department',
+            name='image_original',
+            field=models.CharField(blank=True, editable=False, max_length=255),
+        ),
+    ]
@@ -1,7 +1,18 @@
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db import IntegrityError, models, transaction
+from django.db.models import (
+    Case, Count, F, FloatField, OuterRef, Q, Subquery, Sum, Value, When)
+from django.db.models.functions import Cast, Coalesce, Concat, LPad
+from django.db.models.query import ModelIterable
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.core.validators import RegexValidator
 from ..authentication.models import User
 from cloudinary.models import CloudinaryField
+from .cache import bump_generation
+from . import leaderboard
+from .images import STATUSES as IMAGE_STATUSES
 
 # Create your models here.
 
@@ -10,6 +21,65 @@ from cloudinary.models import CloudinaryField
 
 
 
+# Columns backing the serializer fields of the same name
+DEPARTMENT_COLUMNS = (
+    'id', 'name', 'service', 'email', 'phone_number', 'image', 'image_status',
+    'created_by',
+)
+# Digits of each id in a review's path
+PATH_DIGITS = 10
+REVIEW_COLUMNS = {
+    'id': 'id', 'body': 'body', 'created_at': 'created_at',
+    'updated_at': 'updated_at', 'author_id': 'author',
+    'department_id': 'department',
+}
+
+
+class DepartmentQuerySet(models.QuerySet):
+    """Optional summaries computed in the same query as the departments"""
+
+    def for_fields(self, fields):
+        """Load only what the given DepartmentSerializers fields need"""
+        columns = [name for name in DEPARTMENT_COLUMNS if name in fields]
+        queryset = self.only(*(columns or ['id']))
+        if 'image_derivatives' in fields:
+            queryset = queryset.prefetch_related('image_derivatives')
+        return queryset
+
+    def with_rating_summary(self):
+        """Annotate average_rating and rating_count from the aggregates"""
+        return self.annotate(
+            rating_count=Coalesce(F('rating_aggregate__rating_count'), 0),
+            average_rating=Case(
+                When(rating_aggregate__rating_count__gt=0, then=(
+                    F('rating_aggregate__rating_sum') / F('rating_aggregate__rating_count'))),
+                default=None,
+                output_field=FloatField()
+            )
+        )
+
+    def with_review_count(self):
+        """Annotate review_count, the number of top-level reviews"""
+        reviews = Review.objects.filter(
+            department=OuterRef('pk'), parent=None
+        ).order_by().values('department').annotate(count=Count('id')).values('count')
+        return self.annotate(review_count=Coalesce(Subquery(reviews), 0))
+
+
+class SearchVectorIndex(GinIndex):
+    """A GIN index on PostgreSQL and a plain index elsewhere
+
+    Lets search_vector declare its index in Meta, where migrations can
+    see it, while SQLite can still create the tables of these models.
+    """
+
+    def create_sql(self, model, schema_editor, using='', **kwargs):
+        if schema_editor.connection.vendor != 'postgresql':
+            return models.Index.create_sql(
+                self, model, schema_editor, using=using, **kwargs)
+        return super().create_sql(model, schema_editor, using=using, **kwargs)
+
+
 class Department(models.Model):
     """Create models for the departments"""
     name = models.CharField(max_length=50, blank=False)
@@ -18,9 +88,24 @@ class Department(models.Model):
     phone_regex = RegexValidator(regex=r'^\+?1?\d{9,15}$', message="Phone number must be entered in the format: '+999999999'. Up to 15 digits allowed.")
     phone_number = models.CharField(validators=[phone_regex], max_length=17, blank=True) # validators should be a list
     image = CloudinaryField(blank=True, null=True)
+    image_status = models.CharField(
+        max_length=20, choices=IMAGE_STATUSES, blank=True, editable=False)
+    # When the latest upload was queued, so jobs lost with their process
+    # can be found and queued again
+    image_queued_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Stored name of the uploaded original waiting to be processed
+    image_original = models.CharField(max_length=255, blank=True, editable=False)
     created_by = models.ForeignKey(User, related_name='departments',
                                on_delete=models.CASCADE,
                                blank=True, null=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = DepartmentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            SearchVectorIndex(fields=['search_vector'], name='department_search_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -31,6 +116,115 @@ class Department(models.Model):
         super().save(*args, **kwargs)
 
 
+class ImageDerivative(models.Model):
+    """A resized copy of a department's image, rendered after upload
+
+    The kinds rendered are configured by DEPARTMENT_IMAGES['DERIVATIVES'].
+    """
+    department = models.ForeignKey(
+        Department,
+        related_name='image_derivatives',
+        on_delete=models.CASCADE
+    )
+    kind = models.CharField(max_length=20)
+    name = models.CharField(max_length=255)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = (('department', 'kind'), )
+
+    def __str__(self):
+        return self.name
+
+
+class ReviewQuerySet(models.QuerySet):
+    """Queries for loading review threads"""
+
+    def __init__(self, *args, **kwargs):
+        super(ReviewQuerySet, self).__init__(*args, **kwargs)
+        self._reply_tree = None
+
+    def _clone(self):
+        clone = super(ReviewQuerySet, self)._clone()
+        clone._reply_tree = self._reply_tree
+        return clone
+
+    def _fetch_all(self):
+        fetched = self._result_cache is None
+        super(ReviewQuerySet, self)._fetch_all()
+        if fetched and self._reply_tree is not None \
+                and self._iterable_class is ModelIterable:
+            from . import listings
+            listings.attach_replies(self._result_cache, **self._reply_tree)
+
+    def threads(self, department_id, fields=None, depth=None, limit=None):
+        """Return the top-level reviews of a department with their replies
+
+        The authors, department and replies (with their authors) are loaded
+        up front so serializing the whole forest runs a fixed number of
+        queries no matter how many reviews the department has.
+        """
+        return self.filter(
+            department_id=department_id, parent=None
+        ).with_replies(fields, depth, limit).order_by('-created_at')
+
+    def replies(self, depth=None, limit=None):
+        """Attach the replies under every review as a nested tree
+
+        At most `depth` levels and `limit` replies per review are loaded,
+        all of them in a single query, see listings.reply_trees.
+        """
+        clone = self._chain()
+        clone._reply_tree = {'depth': depth, 'limit': limit}
+        return clone
+
+    def with_replies(self, fields=None, depth=None, limit=None):
+        """Load the author, department and replies of every review
+
+        `fields` limits the loading to what those ReviewSerializer fields
+        need, by default everything is loaded.
+        """
+        if fields is None:
+            return self.select_related('author', 'department').replies(
+                depth, limit).annotate(reply_count=Count('children'))
+
+        queryset = self
+        # created_at orders the threads and their pagination cursors
+        columns = ['id', 'created_at'] + [
+            column for name, column in REVIEW_COLUMNS.items() if name in fields]
+        for relation, column in (('author', 'email'), ('department', 'name')):
+            if relation in fields:
+                queryset = queryset.select_related(relation)
+                columns.append('%s__%s' % (relation, column))
+        if 'children' in fields:
+            queryset = queryset.replies(depth, limit)
+            columns += ['path', 'depth']
+        if 'reply_count' in fields:
+            queryset = queryset.annotate(reply_count=Count('children'))
+        return queryset.only(*columns)
+
+    def fill_paths(self):
+        """Give the reviews inserted without a path, by bulk_create, their
+        path and depth
+
+        Runs one update per level of replies.
+        """
+        segment = Concat(
+            LPad(Cast('id', models.CharField(max_length=PATH_DIGITS)), PATH_DIGITS, Value('0')),
+            Value('/'))
+        updated = self.filter(parent=None, path='').update(path=segment, depth=0)
+        parents = Review.objects.filter(pk=OuterRef('parent_id'))
+        while True:
+            # The replies whose parents got their path in the last round
+            filled = self.filter(path='', parent__path__gt='').update(
+                path=Concat(Subquery(parents.values('path')), segment),
+                depth=Subquery(parents.values('depth')) + 1)
+            if not filled:
+                return updated
+            updated += filled
+
+
 class Review(models.Model):
     """This class creates a model for department reviews
     
@@ -49,15 +243,85 @@ class Review(models.Model):
     )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # The zero padded ids of the review's ancestors and its own, each
+    # followed by a slash, so a subtree is the reviews with its path as a
+    # prefix
+    path = models.CharField(max_length=255, blank=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = ReviewQuerySet.as_manager()
+
+    # Replies nested deeper than this are refused, the path of the
+    # deepest one fits in 255 characters
+    MAX_DEPTH = 20
+
+    class Meta:
+        indexes = [
+            # Threads are paged by (created_at, id)
+            models.Index(fields=['department', 'parent', 'created_at', 'id'],
+                         name='review_thread_idx'),
+            models.Index(fields=['parent', 'created_at'],
+                         name='review_reply_idx'),
+            # Supports the LIKE 'prefix%' subtree lookups under any locale
+            models.Index(fields=['path'], name='review_path_idx',
+                         opclasses=['varchar_pattern_ops']),
+            SearchVectorIndex(fields=['search_vector'], name='review_search_idx'),
+        ]
 
     def __str__(self):
         """Return a human readable version of model objects"""
         return self.body
 
     def save(self, *args, **kwargs):
-        return super(Review, self).save(*args, **kwargs)
+        """Save the review, giving a new one its path below its parent"""
+        if self.pk is not None or self.path:
+            return super(Review, self).save(*args, **kwargs)
+        if self.parent_id and not self.parent.path:
+            # A parent inserted by bulk_create, whose thread has no paths yet
+            Review.objects.filter(department_id=self.parent.department_id).fill_paths()
+            self.parent.refresh_from_db(fields=['path', 'depth'])
+        parent_path = self.parent.path if self.parent_id else ''
+        self.depth = self.parent.depth + 1 if self.parent_id else 0
+        # The path needs the id, it is set in the transaction of the
+        # insert so no other connection ever reads the review without one
+        with transaction.atomic():
+            super(Review, self).save(*args, **kwargs)
+            self.path = '%s%0*d/' % (parent_path, PATH_DIGITS, self.pk)
+            Review.objects.filter(pk=self.pk).update(path=self.path)
         
 
+class RatingManager(models.Manager):
+    def rate(self, user, department_id, value):
+        """Create or replace a user's rating of a department
+
+        The existing rating is locked while it is replaced so the
+        aggregate always removes the value that was actually stored. Two
+        first ratings racing each other are settled by the unique
+        constraint, the loser retries as a replacement.
+        """
+        for attempt in range(2):
+            try:
+                with transaction.atomic():
+                    return self.replace(user, department_id, value)
+            except IntegrityError:
+                if attempt:
+                    raise
+
+    def replace(self, user, department_id, value):
+        previous = self.select_for_update().filter(
+            user=user, department_id=department_id
+        ).values_list('pk', 'user_rating').first()
+        rating = self.model(user=user, department_id=department_id, user_rating=value)
+        if previous is None:
+            rating.save()
+            return rating
+        rating.pk = previous[0]
+        self.filter(pk=rating.pk).update(user_rating=value)
+        RatingAggregate.objects.record(department_id, added=value, removed=previous[1])
+        return rating
+
+
 class Rating(models.Model):
     """Rating model"""
     user = models.ForeignKey(
@@ -73,5 +337,255 @@ class Rating(models.Model):
 
     user_rating = models.FloatField(default=0)
 
+    objects = RatingManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'department'],
+                                    name='rating_user_department_unique'),
+        ]
+
+    def __str__(self):
+        return self.user_rating
+
+    def save(self, *args, **kwargs):
+        """Save the rating and fold it into the department's aggregate"""
+        with transaction.atomic():
+            previous = None
+            if self.pk:
+                previous = Rating.objects.select_for_update().filter(
+                    pk=self.pk).values_list('department_id', 'user_rating').first()
+            super(Rating, self).save(*args, **kwargs)
+            removed = None
+            if previous and previous[0] == self.department_id:
+                removed = previous[1]
+            elif previous:
+                RatingAggregate.objects.record(previous[0], removed=previous[1])
+            RatingAggregate.objects.record(
+                self.department_id, added=self.user_rating, removed=removed)
+
+
+class RatingAggregateManager(models.Manager):
+    def for_department(self, department_id):
+        """Return the aggregate of a department, empty if it has no ratings"""
+        aggregate = self.filter(pk=department_id).first()
+        return aggregate or self.model(department_id=department_id)
+
+    def record(self, department_id, added=None, removed=None):
+        """Add and/or remove a single rating from a department's aggregate
+
+        The counters are changed with F() expressions so concurrent raters
+        never overwrite each other's updates.
+        """
+        changes = {}
+        for value, step in ((added, 1), (removed, -1)):
+            if value is None:
+                continue
+            bucket = RatingAggregate.bucket(value)
+            changes['rating_count'] = changes.get('rating_count', F('rating_count')) + step
+            changes['rating_sum'] = changes.get('rating_sum', F('rating_sum')) + step * value
+            changes[bucket] = changes.get(bucket, F(bucket)) + step
+        if not changes:
+            return
+        if added is not None:
+            self.get_or_create(department_id=department_id)
+        self.filter(pk=department_id).update(**changes)
+        leaderboard.changed(department_id)
+        Change.objects.record(Change.RATING, [department_id])
+        transaction.on_commit(lambda: bump_generation('ratings'))
+
+    def rebuild(self, department_ids=None):
+        """Recompute aggregates from the ratings table
+
+        Returns the number of aggregates written.
+        """
+        departments = Department.objects.all()
+        ratings = Rating.objects.all()
+        if department_ids:
+            departments = departments.filter(pk__in=department_ids)
+            ratings = ratings.filter(department_id__in=department_ids)
+        totals = {
+            row['department']: row for row in ratings.values(
+                'department').order_by().annotate(**rating_totals())
+        }
+        department_ids = list(departments.values_list('id', flat=True))
+        with transaction.atomic():
+            for department_id in department_ids:
+                row = totals.get(department_id, {})
+                self.update_or_create(department_id=department_id, defaults={
+                    field: row.get(field) or 0
+                    for field in rating_totals()
+                })
+            Change.objects.record(Change.RATING, department_ids)
+        leaderboard.changed()
+        transaction.on_commit(lambda: bump_generation('ratings'))
+        return len(department_ids)
+
+
+def rating_totals():
+    """Aggregate expressions matching the fields of RatingAggregate"""
+    totals = {
+        'rating_count': Count('id'),
+        'rating_sum': Sum('user_rating'),
+    }
+    for star in range(1, 6):
+        bounds = Q()
+        if star > 1:
+            bounds &= Q(user_rating__gte=star - 0.5)
+        if star < 5:
+            bounds &= Q(user_rating__lt=star + 0.5)
+        totals['rating_%d' % star] = Count('id', filter=bounds)
+    return totals
+
+
+class RatingAggregate(models.Model):
+    """Running rating totals for a department
+
+    Kept up to date whenever a rating is saved or deleted so reading a
+    department's rating is a single primary key lookup.
+    """
+    department = models.OneToOneField(
+        Department,
+        related_name='rating_aggregate',
+        on_delete=models.CASCADE,
+        primary_key=True
+    )
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_sum = models.FloatField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
+
+    objects = RatingAggregateManager()
+
+    def __str__(self):
+        return str(self.average_rating)
+
+    @staticmethod
+    def bucket(value):
+        """Return the histogram field a rating value is counted in"""
+        return 'rating_%d' % min(max(int(value + 0.5), 1), 5)
+
+    @property
+    def average_rating(self):
+        """The mean rating, None until the department has been rated"""
+        if not self.rating_count:
+            return None
+        return self.rating_sum / self.rating_count
+
+    @property
+    def histogram(self):
+        return {
+            star: getattr(self, 'rating_%d' % star) for star in range(1, 6)
+        }
+
+
+class SearchTerm(models.Model):
+    """Inverted index used for search on databases other than PostgreSQL
+
+    Holds one row per distinct word of an indexed department or review.
+    """
+    kind = models.CharField(max_length=20)
+    object_id = models.PositiveIntegerField()
+    term = models.CharField(max_length=50)
+    weight = models.FloatField(default=1)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['kind', 'term'], name='search_term_idx'),
+            models.Index(fields=['kind', 'object_id'], name='search_object_idx'),
+        ]
+
+    def __str__(self):
+        return self.term
+
+
+class ChangeManager(models.Manager):
+    def record(self, kind, object_ids, deleted=False):
+        """Append a change for each of the objects, in one insert
+
+        The insert waits for the surrounding transaction to commit, so a
+        change is never given a lower id than one that committed before it.
+        """
+        changes = [
+            self.model(kind=kind, object_id=object_id, deleted=deleted)
+            for object_id in object_ids
+        ]
+        transaction.on_commit(lambda: self.bulk_create(changes))
+
+
+class Change(models.Model):
+    """Append-only log of the departments, reviews and rating aggregates
+    that were saved or deleted
+
+    Read by the sync/ feed, whose clients keep the id of the last change
+    they have seen as their watermark.
+    """
+    DEPARTMENT = 'department'
+    REVIEW = 'review'
+    RATING = 'rating'
+    KINDS = (
+        (DEPARTMENT, 'Department'),
+        (REVIEW, 'Review'),
+        (RATING, 'Rating aggregate'),
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    kind = models.CharField(max_length=20, choices=KINDS)
+    object_id = models.PositiveIntegerField()
+    deleted = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ChangeManager()
+
     def __str__(self):
-        return self.user_rating
\ No newline at end of file
+        return '%s %s' % (self.kind, self.object_id)
+
+
+@receiver(post_delete, sender=Rating)
+def remove_rating_from_aggregate(sender, instance, **kwargs):
+    """Also runs for ratings removed by a cascading delete"""
+    RatingAggregate.objects.record(
+        instance.department_id, removed=instance.user_rating)
+
+
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+def invalidate_department_responses(sender, **kwargs):
+    """Cached department responses are stale once any department changes"""
+    transaction.on_commit(bump_generation)
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_review_counts(sender, instance, **kwargs):
+    """Responses embedding review counts are stale once a review changes"""
+    if instance.parent_id is None:
+        transaction.on_commit(lambda: bump_generation('reviews'))
+
+
+@receiver(post_save, sender=Department)
+@receiver(post_delete, sender=Department)
+def update_leaderboard(sender, instance, **kwargs):
+    """The department's service may have changed, or it is gone"""
+    leaderboard.changed(instance.pk)
+
+
+@receiver(post_save, sender=Department)
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Department)
+@receiver(post_delete, sender=Review)
+@receiver(post_delete, sender=RatingAggregate)
+def log_change(sender, instance, **kwargs):
+    """Deletes are logged as tombstones, including cascading ones"""
+    kind = {
+        Department: Change.DEPARTMENT,
+        Review: Change.REVIEW,
+        RatingAggregate: Change.RATING,
+    }[sender]
+    Change.objects.record(kind, [instance.pk], deleted=kwargs['signal'] is post_delete)
+
+
+from . import search  # noqa: E402 connects the search index receivers
@@ -0,0 +1,114 @@
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination, LimitOffsetPagination
+from rest_framework.response import Response
+
+
+class DepartmentCursorPagination(CursorPagination):
+    """Keyset pagination over the department id
+
+    The cursor is an opaque token encoding the last id seen so every page
+    is a single indexed seek regardless of how deep the client scrolls.
+    """
+    ordering = ('id',)
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    results_key = 'results'
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            (self.results_key, data)
+        ]))
+
+
+class ReviewCursorPagination(DepartmentCursorPagination):
+    """Keyset pagination over (created_at, id) for department reviews,
+    newest first
+
+    DRF's cursor seeks on the first ordering field only and skips the
+    rows sharing its value with an offset. This cursor carries both the
+    created_at and the id of the boundary review, so every page, however
+    many reviews share a timestamp, is a single seek on the thread index.
+    Pages are taken from rows as well as model instances.
+    """
+    ordering = ('-created_at', '-id')
+    results_key = 'Reviews'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+        self.base_url = request.build_absolute_uri()
+        self.request = request
+        cursor = self.decode_cursor(request)
+        self.reverse = cursor is not None and cursor.reverse
+        self.position = None if cursor is None else self.decode_position(cursor.position)
+
+        if self.position is None:
+            queryset = queryset.order_by('-created_at', '-id')
+        else:
+            created_at, id_ = self.position
+            if self.reverse:
+                queryset = queryset.filter(
+                    Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=id_)
+                ).order_by('created_at', 'id')
+            else:
+                queryset = queryset.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=id_)
+                ).order_by('-created_at', '-id')
+
+        results = list(queryset[:self.page_size + 1])
+        has_following = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if self.reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_following
+        else:
+            self.has_next, self.has_previous = has_following, cursor is not None
+        return self.page
+
+    def decode_position(self, position):
+        try:
+            created_at, id_ = position.rsplit(' ', 1)
+            created_at = parse_datetime(created_at)
+            id_ = int(id_)
+        except (AttributeError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return created_at, id_
+
+    def link(self, review, reverse):
+        if review is None:
+            if self.position is None:
+                return None
+            created_at, id_ = self.position
+        elif isinstance(review, dict):
+            created_at, id_ = review['created_at'], review['id']
+        else:
+            created_at, id_ = review.created_at, review.id
+        return self.encode_cursor(Cursor(
+            offset=0, reverse=reverse,
+            position='%s %d' % (created_at.isoformat(), id_)))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        return self.link(self.page[-1] if self.page else None, False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        return self.link(self.page[0] if self.page else None, True)
+
+
+class LeaderboardPagination(LimitOffsetPagination):
+    """Offset pagination over the in-memory department ranking"""
+    default_limit = 20
+    max_limit = 100
@@ -0,0 +1,138 @@
+"""Full-text search over departments and reviews
+
+On PostgreSQL each indexed model keeps a stored, GIN indexed
+``search_vector`` column. Other databases fall back to the SearchTerm
+table, a plain inverted index with one row per word and document, so the
+feature behaves the same in development and tests.
+"""
+import re
+from collections import defaultdict
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Department, Review, SearchTerm
+
+
+CONFIG = 'simple'
+# PostgreSQL's default rank weights for the labels used below
+WEIGHTS = {'A': 1.0, 'B': 0.4, 'C': 0.2, 'D': 0.1}
+INDEXED_FIELDS = {
+    Department: (('name', 'A'), ('service', 'B')),
+    Review: (('body', 'A'), ),
+}
+MAX_TERM_LENGTH = SearchTerm._meta.get_field('term').max_length
+
+
+def uses_postgres():
+    return connection.vendor == 'postgresql'
+
+
+def tokenize(text):
+    return [
+        word[:MAX_TERM_LENGTH] for word in re.findall(r'\w+', (text or '').lower())
+    ]
+
+
+def search_vector(model):
+    """The expression stored in a model's search_vector column"""
+    vector = None
+    for field, weight in INDEXED_FIELDS[model]:
+        part = SearchVector(field, weight=weight, config=CONFIG)
+        vector = part if vector is None else vector + part
+    return vector
+
+
+def reindex(queryset):
+    """Rebuild the search index of every object in a queryset"""
+    model = queryset.model
+    if uses_postgres():
+        return queryset.update(search_vector=search_vector(model))
+
+    kind = model._meta.model_name
+    fields = [field for field, _ in INDEXED_FIELDS[model]]
+    SearchTerm.objects.filter(
+        kind=kind, object_id__in=queryset.values('id')).delete()
+    terms = []
+    count = 0
+    for row in queryset.values('id', *fields).iterator():
+        weights = {}
+        for field, weight in INDEXED_FIELDS[model]:
+            for term in tokenize(row[field]):
+                weights[term] = max(weights.get(term, 0), WEIGHTS[weight])
+        terms.extend(
+            SearchTerm(kind=kind, object_id=row['id'], term=term, weight=weight)
+            for term, weight in weights.items()
+        )
+        if len(terms) >= 1000:
+            SearchTerm.objects.bulk_create(terms)
+            terms = []
+        count += 1
+    SearchTerm.objects.bulk_create(terms)
+    return count
+
+
+def search(queryset, text, limit=20):
+    """Return the objects matching every word of `text`, best match first
+
+    The last word is matched as a prefix so the search can back a
+    type-ahead box.
+    """
+    model = queryset.model
+    words = tokenize(text)
+    if not words:
+        return []
+
+    if uses_postgres():
+        terms = words[:-1] + ['%s:*' % words[-1]]
+        query = SearchQuery(' & '.join(terms), config=CONFIG, search_type='raw')
+        return list(queryset.annotate(
+            rank=SearchRank(F('search_vector'), query)
+        ).filter(search_vector=query).order_by('-rank', 'id')[:limit])
+
+    matches = Q(term__startswith=words[-1])
+    for word in words[:-1]:
+        matches |= Q(term=word)
+    scores = defaultdict(float)
+    found = defaultdict(set)
+    rows = SearchTerm.objects.filter(
+        matches, kind=model._meta.model_name
+    ).values_list('object_id', 'term', 'weight')
+    for object_id, term, weight in rows.iterator():
+        for position, word in enumerate(words):
+            last = position == len(words) - 1
+            if term == word or (last and term.startswith(word)):
+                found[object_id].add(position)
+                scores[object_id] += weight
+    ranked = sorted(
+        (object_id for object_id in found if len(found[object_id]) == len(words)),
+        key=lambda object_id: (-scores[object_id], object_id)
+    )[:limit]
+    objects = queryset.in_bulk(ranked)
+    results = []
+    for object_id in ranked:
+        obj = objects.get(object_id)
+        if obj is not None:
+            obj.rank = scores[object_id]
+            results.append(obj)
+    return results
+
+
+@receiver(post_save, sender=Department)
+@receiver(post_save, sender=Review)
+def index_on_save(sender, instance, update_fields=None, **kwargs):
+    indexed = set(field for field, _ in INDEXED_FIELDS[sender])
+    if update_fields is not None and not indexed.intersection(update_fields):
+        return
+    reindex(sender.objects.filter(pk=instance.pk))
+
+
+@receiver(post_delete, sender=Department)
+@receiver(post_delete, sender=Review)
+def unindex_on_delete(sender, instance, **kwargs):
+    if not uses_postgres():
+        SearchTerm.objects.filter(
+            kind=sender._meta.model_name, object_id=instance.pk).delete()
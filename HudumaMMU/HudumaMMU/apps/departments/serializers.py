@@ -1,14 +1,66 @@
+from django.core.files.uploadedfile import UploadedFile
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
 from rest_framework.validators import UniqueValidator
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db.models import Avg
+from django.utils import timezone
 from .models import User
-from .models import Department, Review, Rating
+from .models import Department, Review, Rating, RatingAggregate
+from . import images, listings
+from .listings import format_date
 
 
 
 
-class DepartmentSerializers(serializers.ModelSerializer):
+def selected_fields(request, available):
+    """Return the names among `available` picked with ?fields= and ?exclude=
+
+    Both take comma separated names. Only reads are trimmed, writes always
+    use every field.
+    """
+    if request is None or request.method not in SAFE_METHODS:
+        return set(available)
+    fields, exclude = (
+        [name for name in request.query_params.get(param, '').split(',') if name]
+        for param in ('fields', 'exclude')
+    )
+    unknown = set(fields + exclude).difference(available)
+    if unknown:
+        raise serializers.ValidationError({
+            'fields': 'Unknown fields: %s. Expected any of: %s' % (
+                ', '.join(sorted(unknown)), ', '.join(available))
+        })
+    return set(fields or available).difference(exclude)
+
+
+class SparseFieldsMixin:
+    """Drops the fields a read request did not ask for
+
+    `sparse_fields` lists every name the serializer can output, including
+    those added in to_representation, which should check `selected`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(SparseFieldsMixin, self).__init__(*args, **kwargs)
+        self.selected = selected_fields(self.context.get('request'), self.sparse_fields)
+        for name in list(self.fields):
+            if name not in self.selected:
+                self.fields.pop(name)
+
+
+class DepartmentImageField(serializers.ImageField):
+    """Takes an uploaded image, or the stored name of one as before"""
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            return data
+        return super(DepartmentImageField, self).to_internal_value(data)
+
+    def to_representation(self, value):
+        return Department._meta.get_field('image').get_prep_value(value)
+
+
+class DepartmentSerializers(SparseFieldsMixin, serializers.ModelSerializer):
     name = serializers.CharField(
         required=True,
         max_length =500,
@@ -38,18 +90,80 @@ class DepartmentSerializers(serializers.ModelSerializer):
             'invalid': 'Enter a valid email address.'
         }
     )
+    image = DepartmentImageField(required=False, allow_null=True)
+    image_derivatives = serializers.SerializerMethodField()
+
     class Meta:
         model = Department
-        fields = ('id', 'name', 'service', 'email', 'phone_number', 'image', 'created_by')
+        fields = ('id', 'name', 'service', 'email', 'phone_number', 'image',
+                  'image_status', 'image_derivatives', 'created_by')
 
+    sparse_fields = Meta.fields + ('rating_summary', 'review_count')
 
-class ReviewSerializer(serializers.ModelSerializer):
+    def to_representation(self, instance):
+        """Add the summaries the queryset was annotated with, if any"""
+        representation = super(DepartmentSerializers, self).to_representation(instance)
+        if hasattr(instance, 'average_rating') and 'rating_summary' in self.selected:
+            representation['rating_summary'] = {
+                'average_rating': instance.average_rating,
+                'rating_count': instance.rating_count,
+            }
+        if hasattr(instance, 'review_count') and 'review_count' in self.selected:
+            representation['review_count'] = instance.review_count
+        return representation
+
+    def get_image_derivatives(self, obj):
+        """Returns the url and size of each resized copy of the image
+
+        Prefetch image_derivatives when serializing many departments.
+        """
+        storage = images.get_storage()
+        return {
+            derivative.kind: {
+                'url': storage.url(derivative.name),
+                'width': derivative.width,
+                'height': derivative.height,
+            } for derivative in obj.image_derivatives.all()
+        }
+
+    def pop_upload(self, validated_data):
+        """Take an uploaded image out of the data saved with the department
+
+        The department keeps its current image until the upload has been
+        processed in the background.
+        """
+        upload = validated_data.get('image')
+        if not isinstance(upload, UploadedFile):
+            return None
+        del validated_data['image']
+        validated_data['image_original'] = images.store_original(upload)
+        validated_data['image_status'] = images.PENDING
+        validated_data['image_queued_at'] = timezone.now()
+        return upload
+
+    def create(self, validated_data):
+        upload = self.pop_upload(validated_data)
+        department = super(DepartmentSerializers, self).create(validated_data)
+        if upload:
+            images.schedule(department)
+        return department
+
+    def update(self, instance, validated_data):
+        upload = self.pop_upload(validated_data)
+        department = super(DepartmentSerializers, self).update(instance, validated_data)
+        if upload:
+            images.schedule(department)
+        return department
+
+
+class ReviewSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """This is a serializer for the reviews
     body is a required input
     """
 
     author_id = serializers.SerializerMethodField()
     department_id = serializers.SerializerMethodField()
+    children = serializers.SerializerMethodField()
     body = serializers.CharField(
         required=True,
         max_length=250,
@@ -59,33 +173,32 @@ class ReviewSerializer(serializers.ModelSerializer):
     )
 
     def format_date(self, date):
-        return date.strftime('%d %b %Y %H:%M:%S')
+        return format_date(date)
 
     def create_children(self, instance):
-        children = [
-            {
-                'id': thread.id,
-                'body': thread.body,
-                'author': thread.author.email,
-                'created_at': self.format_date(thread.created_at),
-                'updated_at': self.format_date(thread.updated_at)
-            } for thread in instance.children.all()
-        ]
-        return children
+        """The nested replies, attached by ReviewQuerySet.replies() or
+        else loaded now"""
+        if getattr(instance, '_replies', None) is None:
+            listings.attach_replies([instance])
+        return instance._replies
 
     def to_representation(self, instance):
         """For custom output"""
 
-        children = self.create_children(instance)
-
         representation = super(ReviewSerializer,
                                self).to_representation(instance)
-        representation['created_at'] = self.format_date(instance.created_at)
-        representation['updated_at'] = self.format_date(instance.updated_at)
-        representation['author'] = instance.author.email
-        representation['department'] = instance.department.name
-        representation['reply_count'] = instance.children.count()
-        representation['children'] = children
+        for name in ('created_at', 'updated_at'):
+            if name in self.selected:
+                representation[name] = self.format_date(getattr(instance, name))
+        if 'author' in self.selected:
+            representation['author'] = instance.author.email
+        if 'department' in self.selected:
+            representation['department'] = instance.department.name
+        if 'reply_count' in self.selected:
+            representation['reply_count'] = getattr(
+                instance, 'reply_count', None)
+            if representation['reply_count'] is None:
+                representation['reply_count'] = len(instance.children.all())
 
         return representation
 
@@ -100,13 +213,19 @@ class ReviewSerializer(serializers.ModelSerializer):
             'author_id', 'parent', 'children'
         )
 
+    sparse_fields = Meta.fields + ('author', 'department', 'reply_count')
+
     def get_author_id(self, obj):
         """Return author username"""
-        return obj.author.id
+        return obj.author_id
 
     def get_department_id(self, obj):
         """Return department """
-        return obj.department.id
+        return obj.department_id
+
+    def get_children(self, obj):
+        """Return the nested replies"""
+        return self.create_children(obj)
 
     def create(self, validated_data):
         return Review.objects.create(**validated_data)
@@ -132,17 +251,33 @@ class RatingSerializer(serializers.ModelSerializer):
 
     department_id = serializers.SerializerMethodField()
     average_rating = serializers.SerializerMethodField()
+    rating_count = serializers.SerializerMethodField()
+    rating_histogram = serializers.SerializerMethodField()
+
+    def get_aggregate(self, obj):
+        """Returns the department's rating aggregate, loaded once per rating"""
+        if getattr(obj, '_aggregate', None) is None:
+            obj._aggregate = RatingAggregate.objects.for_department(
+                obj.department_id)
+        return obj._aggregate
 
     def get_department_id(self, obj):
         """Returns the department's id"""
-        return obj.department.id
+        return obj.department_id
 
     def get_average_rating(self, obj):
         """Returns the average rating for a department"""
-        average_rating = Rating.objects.filter(
-            department=obj.department).aggregate(Avg('user_rating'))
-        return average_rating["user_rating__avg"]
+        return self.get_aggregate(obj).average_rating
+
+    def get_rating_count(self, obj):
+        """Returns the number of ratings for a department"""
+        return self.get_aggregate(obj).rating_count
+
+    def get_rating_histogram(self, obj):
+        """Returns how many ratings fall in each star bucket"""
+        return self.get_aggregate(obj).histogram
 
     class Meta:
         model = Rating
-        fields = ("department_id", "user_rating", "average_rating")
\ No newline at end of file
+        fields = ("department_id", "user_rating", "average_rating",
+                  "rating_count", "rating_histogram")
\ No newline at end of file
@@ -0,0 +1,120 @@
+"""Incremental sync of departments, reviews and rating aggregates
+
+Every save or delete of a synced object appends a row to the Change log.
+A client passes the id of the last change it has seen as ?since= and gets
+back the current state of everything changed after it, plus the ids of
+what was deleted, so it only ever downloads deltas.
+
+Change rows are inserted once the transaction that made the change has
+committed, each in its own short transaction, so ids follow commit order
+however long the original transaction ran. Only those inserts may still
+commit out of order, changes younger than SETTLE_SECONDS are held back
+to give them time to.
+"""
+import datetime
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import listings
+from .models import Change, Department, RatingAggregate, Review
+from .serializers import DepartmentSerializers
+
+
+DEFAULTS = {
+    # Changes read per request, a client follows has_more for the rest
+    'PAGE_SIZE': 500,
+    'MAX_PAGE_SIZE': 2000,
+    'SETTLE_SECONDS': 2,
+}
+SECTIONS = (
+    (Change.DEPARTMENT, 'departments'),
+    (Change.REVIEW, 'reviews'),
+    (Change.RATING, 'ratings'),
+)
+
+
+def get_options():
+    return dict(DEFAULTS, **getattr(settings, 'DEPARTMENT_SYNC', {}))
+
+
+def pending_changes(since, limit):
+    """Return up to `limit` settled changes after `since`, and if there are more"""
+    settled = timezone.now() - datetime.timedelta(seconds=get_options()['SETTLE_SECONDS'])
+    changes = list(Change.objects.filter(
+        id__gt=since, created_at__lte=settled
+    ).order_by('id').values_list('id', 'kind', 'object_id', 'deleted')[:limit + 1])
+    return changes[:limit], len(changes) > limit
+
+
+def departments(ids):
+    fields = set(DepartmentSerializers.sparse_fields)
+    queryset = Department.objects.filter(pk__in=ids).order_by('id')
+    return listings.departments(
+        list(listings.department_rows(queryset, fields)), fields)
+
+
+def reviews(ids):
+    return [
+        {
+            'id': row['id'],
+            'department_id': row['department_id'],
+            'parent_id': row['parent_id'],
+            'body': row['body'],
+            'author': row['author__email'],
+            'created_at': listings.format_date(row['created_at']),
+            'updated_at': listings.format_date(row['updated_at']),
+        } for row in Review.objects.filter(pk__in=ids).order_by('id').values(
+            'id', 'department_id', 'parent_id', 'body', 'author__email',
+            'created_at', 'updated_at')
+    ]
+
+
+def ratings(ids):
+    return [
+        {
+            'department_id': aggregate.department_id,
+            'average_rating': aggregate.average_rating,
+            'rating_count': aggregate.rating_count,
+            'rating_histogram': aggregate.histogram,
+        } for aggregate in RatingAggregate.objects.filter(pk__in=ids).order_by('pk')
+    ]
+
+
+LOADERS = {
+    Change.DEPARTMENT: departments,
+    Change.REVIEW: reviews,
+    Change.RATING: ratings,
+}
+
+
+def changes_since(since, limit):
+    """Build the sync response for the changes after watermark `since`
+
+    Several changes to one object collapse into its latest state, which
+    is loaded with one query per kind. An object that is gone by the time
+    it is loaded is reported as deleted; its tombstone follows in the log.
+    """
+    changes, has_more = pending_changes(since, limit)
+    latest = {}
+    for _, kind, object_id, deleted in changes:
+        latest[kind, object_id] = deleted
+
+    response = {
+        'watermark': changes[-1][0] if changes else since,
+        'has_more': has_more,
+    }
+    for kind, section in SECTIONS:
+        updated = [
+            object_id for (change_kind, object_id), deleted in latest.items()
+            if change_kind == kind and not deleted
+        ]
+        deleted = {
+            object_id for (change_kind, object_id), deleted in latest.items()
+            if change_kind == kind and deleted
+        }
+        rows = LOADERS[kind](updated) if updated else []
+        key = 'department_id' if kind == Change.RATING else 'id'
+        deleted.update(set(updated) - {row[key] for row in rows})
+        response[section] = {'updated': rows, 'deleted': sorted(deleted)}
+    return response
@@ -1,3 +1,850 @@
-from django.test import TestCase
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from unittest import skipIf, skipUnless
 
-# Create your tests here.
+from PIL import Image
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection, transaction
+from django.test import (
+    TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature)
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from HudumaMMU.apps.authentication.models import User
+from HudumaMMU.throttling import SlidingWindowThrottle
+from . import benchmarks, bulk, images, search, sync
+from .views import RatingAPIView, ReviewViewSet
+from .models import (
+    Change, Department, ImageDerivative, Rating, RatingAggregate, Review,
+    SearchTerm)
+
+
+def create_user(number=0):
+    return User.objects.create_user(
+        email='user%d@example.com' % number, password='password')
+
+
+def create_department(user, number=0):
+    return Department.objects.create(
+        name='Department %d' % number, service='Service',
+        email='department%d@example.com' % number, created_by=user)
+
+
+class LostJobQueue:
+    """Drops every job, like a process stopping before they run"""
+
+    def __init__(self, options):
+        pass
+
+    def submit(self, function, *args):
+        pass
+
+    def close(self):
+        pass
+
+
+class ReviewListQueryTests(TestCase):
+    """Listing reviews costs the same queries however many there are"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.department = create_department(self.user)
+
+    def add_threads(self, count):
+        for _ in range(count):
+            review = Review.objects.create(
+                body='Review', department=self.department, author=self.user)
+            reply = Review.objects.create(
+                body='Reply', department=self.department, author=self.user,
+                parent=review)
+            Review.objects.create(
+                body='Nested reply', department=self.department,
+                author=self.user, parent=reply)
+
+    def list_reviews(self):
+        response = self.client.get(
+            '/api/v1/departments/%d/reviews/' % self.department.pk)
+        self.assertEqual(response.status_code, 200)
+        return response.data['Reviews']
+
+    def test_query_count_does_not_grow_with_reviews(self):
+        self.add_threads(2)
+        with CaptureQueriesContext(connection) as queries:
+            reviews = self.list_reviews()
+        self.assertEqual(len(reviews), 2)
+        self.assertEqual(len(reviews[0]['children'][0]['children']), 1)
+
+        self.add_threads(10)
+        with self.assertNumQueries(len(queries)):
+            reviews = self.list_reviews()
+        self.assertEqual(len(reviews), 12)
+        self.assertEqual(len(reviews[0]['children'][0]['children']), 1)
+
+    def test_reply_limit_applies_to_each_thread(self):
+        self.add_threads(3)
+        response = self.client.get(
+            '/api/v1/departments/%d/reviews/' % self.department.pk, {'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        for review in response.data['Reviews']:
+            self.assertEqual(len(review['children']), 1)
+            self.assertEqual(review['children'][0]['children'], [])
+
+    def test_reply_to_review_without_path(self):
+        review = Review.objects.create(
+            body='Review', department=self.department, author=self.user)
+        Review.objects.filter(pk=review.pk).update(path='')
+        review.refresh_from_db()
+        reply = Review.objects.create(
+            body='Reply', department=self.department, author=self.user,
+            parent=review)
+        review.refresh_from_db()
+        self.assertTrue(review.path)
+        self.assertTrue(reply.path.startswith(review.path))
+        self.assertEqual(reply.depth, 1)
+
+
+class SparseFieldsTests(TestCase):
+    """Reads return, and load, only the fields asked for"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = create_user()
+        self.department = create_department(self.user)
+        Review.objects.create(body='Review', department=self.department, author=self.user)
+        self.client.force_authenticate(self.user)
+
+    def test_departments_load_only_the_selected_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/departments/', {'fields': 'id,name'})
+        self.assertEqual(response.json()['results'], [
+            {'id': self.department.pk, 'name': 'Department 0'}])
+        select = queries.captured_queries[-1]['sql']
+        self.assertIn('"name"', select)
+        self.assertNotIn('"service"', select)
+
+    def test_exclude(self):
+        department = self.client.get(
+            '/api/v1/departments/%d/' % self.department.pk,
+            {'exclude': 'service,image_derivatives'}).json()
+        self.assertIn('email', department)
+        self.assertNotIn('service', department)
+        self.assertNotIn('image_derivatives', department)
+
+    def test_unknown_fields_are_rejected(self):
+        response = self.client.get('/api/v1/departments/', {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('secret', response.data['fields'])
+
+    def test_reviews(self):
+        response = self.client.get(
+            '/api/v1/departments/%d/reviews/' % self.department.pk, {'fields': 'id,body'})
+        self.assertEqual(
+            [dict(review) for review in response.data['Reviews']],
+            [{'id': self.department.reviews.get().pk, 'body': 'Review'}])
+
+    def test_writes_return_every_field(self):
+        response = self.client.post('/api/v1/departments/?fields=id', {
+            'name': 'New', 'service': 'Service', 'email': 'new@example.com'
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['service'], 'Service')
+
+
+class ReviewPaginationTests(TestCase):
+    """Review pages seek on (created_at, id), ties included"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.department = create_department(self.user)
+        reviews = [
+            Review.objects.create(
+                body='Review %d' % number, department=self.department, author=self.user)
+            for number in range(7)
+        ]
+        # Four of them share a timestamp, right across page boundaries
+        Review.objects.filter(pk__in=[review.pk for review in reviews[1:5]]).update(
+            created_at=reviews[0].created_at)
+        self.expected = list(Review.objects.filter(parent=None).order_by(
+            '-created_at', '-id').values_list('id', flat=True))
+
+    def walk(self, url, link):
+        ids, pages = [], []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append(response.data)
+            ids += [review['id'] for review in response.data['Reviews']]
+            url = response.data[link]
+        return ids, pages
+
+    def test_pages_neither_skip_nor_repeat_ties(self):
+        ids, pages = self.walk(
+            '/api/v1/departments/%d/reviews/?page_size=2&fields=id' % self.department.pk,
+            'next')
+        self.assertEqual(ids, self.expected)
+        self.assertEqual(len(pages), 4)
+
+        # And walking back from the last page yields the same pages
+        previous, _ = self.walk(pages[-1]['previous'], 'previous')
+        self.assertEqual(previous, [
+            review['id'] for page in reversed(pages[:-1]) for review in page['Reviews']])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(
+            '/api/v1/departments/%d/reviews/?cursor=bm9wZQ==' % self.department.pk)
+        self.assertEqual(response.status_code, 404)
+
+
+class RatingSummaryTests(TestCase):
+    """Unrated departments have no average rather than an average of 0"""
+
+    def setUp(self):
+        self.owner = create_user(0)
+        self.rated = create_department(self.owner, 0)
+        self.unrated = create_department(self.owner, 1)
+        Rating.objects.rate(create_user(1), self.rated.pk, 4)
+        Rating.objects.rate(create_user(2), self.rated.pk, 3)
+
+    def test_aggregate_average(self):
+        self.assertEqual(
+            RatingAggregate.objects.for_department(self.rated.pk).average_rating, 3.5)
+        self.assertIsNone(
+            RatingAggregate.objects.for_department(self.unrated.pk).average_rating)
+
+    def test_annotated_average(self):
+        summaries = dict(Department.objects.with_rating_summary().values_list(
+            'id', 'average_rating'))
+        self.assertEqual(summaries, {self.rated.pk: 3.5, self.unrated.pk: None})
+
+    def test_listing_renders_null(self):
+        cache.clear()
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        response = client.get('/api/v1/departments/', {'include': 'rating_summary'})
+        summaries = {
+            department['id']: department['rating_summary']
+            for department in response.json()['results']
+        }
+        self.assertEqual(summaries[self.unrated.pk],
+                         {'average_rating': None, 'rating_count': 0})
+        self.assertEqual(summaries[self.rated.pk],
+                         {'average_rating': 3.5, 'rating_count': 2})
+
+
+class ResponseCacheTests(TransactionTestCase):
+    """Cached reads answer conditional requests until their data changes"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = create_user()
+        self.department = create_department(self.user)
+        self.client.force_authenticate(self.user)
+        self.path = '/api/v1/departments/%d/' % self.department.pk
+
+    def test_matching_etag_is_not_modified(self):
+        response = self.client.get(self.path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['name'], 'Department 0')
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.path, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+        response = self.client.get(
+            self.path, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(
+            self.client.get(self.path, HTTP_IF_NONE_MATCH='"stale"').status_code, 200)
+
+    def test_saving_a_department_invalidates_its_responses(self):
+        etag = self.client.get(self.path)['ETag']
+        self.department.name = 'Renamed'
+        self.department.save()
+
+        response = self.client.get(self.path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['name'], 'Renamed')
+
+    def test_ratings_only_invalidate_responses_that_embed_them(self):
+        plain = self.client.get('/api/v1/departments/')['ETag']
+        summary = self.client.get(
+            '/api/v1/departments/', {'include': 'rating_summary'})['ETag']
+        Rating.objects.rate(self.user, self.department.pk, 4)
+
+        self.assertEqual(self.client.get(
+            '/api/v1/departments/', HTTP_IF_NONE_MATCH=plain).status_code, 304)
+        response = self.client.get(
+            '/api/v1/departments/', {'include': 'rating_summary'},
+            HTTP_IF_NONE_MATCH=summary)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['rating_summary'],
+                         {'average_rating': 4.0, 'rating_count': 1})
+
+
+class BulkImportTests(TestCase):
+    """Imports validate row by row and write in batches"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.existing = create_department(self.user)
+        self.client.force_authenticate(self.user)
+
+    def rows(self, start, count):
+        return [
+            {'name': 'Imported %d' % number, 'service': 'Service',
+             'email': 'imported%d@example.com' % number}
+            for number in range(start, start + count)
+        ]
+
+    def ndjson(self, rows):
+        return ''.join(json.dumps(row) + '\n' for row in rows).encode('utf-8')
+
+    def test_import_reports_invalid_rows(self):
+        rows = self.rows(0, 2)
+        body = self.ndjson(rows[:1]) + b'not json\n\n' + self.ndjson([
+            rows[1],
+            {'name': 'Taken', 'service': 'Service', 'email': self.existing.email},
+            {'name': 'Repeated', 'service': 'Service', 'email': rows[0]['email']},
+            {'name': 'No email', 'service': 'Service'},
+        ])
+        response = self.client.post(
+            '/api/v1/departments/bulk/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(
+            [error['row'] for error in response.data['errors']], [2, 5, 6, 7])
+        self.assertEqual(
+            set(Department.objects.filter(created_by=self.user).values_list(
+                'email', flat=True)),
+            {self.existing.email, rows[0]['email'], rows[1]['email']})
+
+    def test_csv_import(self):
+        lines = ['name,service,email\n'] + [
+            '%(name)s,%(service)s,%(email)s\n' % row for row in self.rows(0, 3)]
+        report = bulk.import_departments(bulk.read_rows(lines, 'csv'), self.user)
+        self.assertEqual(report, {'created': 3, 'errors': []})
+
+    def test_query_count_does_not_grow_with_rows(self):
+        def run(rows):
+            lines = self.ndjson(rows).splitlines(keepends=True)
+            with CaptureQueriesContext(connection) as queries:
+                report = bulk.import_departments(
+                    bulk.read_rows(lines, 'ndjson'), self.user)
+            self.assertEqual(report['created'], len(rows))
+            return len(queries)
+
+        self.assertEqual(run(self.rows(0, 3)), run(self.rows(3, 30)))
+
+    def test_export_streams_every_department(self):
+        bulk.import_departments(
+            bulk.read_rows(self.ndjson(self.rows(0, 3)).splitlines(), 'ndjson'),
+            self.user)
+        response = self.client.get(
+            '/api/v1/departments/bulk/', {'file_format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual(lines[0], ','.join(bulk.EXPORT_FIELDS))
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(self.client.get(
+            '/api/v1/departments/bulk/', {'file_format': 'xml'}).status_code, 400)
+
+
+class SearchTests(TestCase):
+    """Search ranks name matches first and follows saves and deletes"""
+
+    def setUp(self):
+        self.user = create_user()
+        self.water = Department.objects.create(
+            name='Water Services', service='Connections and billing',
+            email='water@example.com', created_by=self.user)
+        self.billing = Department.objects.create(
+            name='Revenue', service='Water billing and permits',
+            email='revenue@example.com', created_by=self.user)
+
+    def find(self, text, model=Department):
+        return [obj.pk for obj in search.search(model.objects.all(), text)]
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(self.find('water'), [self.water.pk, self.billing.pk])
+        self.assertEqual(self.find('billing'), [self.water.pk, self.billing.pk])
+
+    def test_every_word_must_match_and_the_last_is_a_prefix(self):
+        self.assertEqual(self.find('water perm'), [self.billing.pk])
+        self.assertEqual(self.find('wat'), [self.water.pk, self.billing.pk])
+        self.assertEqual(self.find('water roads'), [])
+        self.assertEqual(self.find('  '), [])
+
+    def test_saves_reindex_and_deletes_unindex(self):
+        self.water.name = 'Roads'
+        self.water.save()
+        self.assertEqual(self.find('roads'), [self.water.pk])
+        self.assertEqual(self.find('water'), [self.billing.pk])
+
+        self.billing.delete()
+        self.assertEqual(self.find('water'), [])
+
+    def test_reviews_are_indexed(self):
+        review = Review.objects.create(
+            body='The queue was short', department=self.water, author=self.user)
+        self.assertEqual(self.find('queue', Review), [review.pk])
+
+    @skipIf(search.uses_postgres(), 'PostgreSQL uses search_vector')
+    def test_fallback_keeps_one_term_per_word(self):
+        terms = dict(SearchTerm.objects.filter(
+            kind='department', object_id=self.water.pk).values_list('term', 'weight'))
+        self.assertEqual(terms, {
+            'water': 1.0, 'services': 1.0, 'connections': 0.4, 'and': 0.4,
+            'billing': 0.4})
+
+        # Saves that leave the indexed fields alone keep the terms
+        with self.assertNumQueries(1):
+            self.water.save(update_fields=['phone_number'])
+
+    @skipUnless(search.uses_postgres(), 'GIN indexes need PostgreSQL')
+    def test_search_vectors_are_gin_indexed(self):
+        with connection.cursor() as cursor:
+            for model in (Department, Review):
+                constraints = connection.introspection.get_constraints(
+                    cursor, model._meta.db_table)
+                index = constraints['%s_search_idx' % model._meta.model_name]
+                self.assertEqual(index['type'], 'gin')
+                self.assertEqual(index['columns'], ['search_vector'])
+
+
+class RatingUniquenessTests(TestCase):
+    """A user has at most one rating per department"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user()
+        self.department = create_department(self.user)
+
+    def test_second_rating_row_is_refused(self):
+        Rating.objects.create(user=self.user, department=self.department, user_rating=4)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Rating.objects.create(
+                user=self.user, department=self.department, user_rating=2)
+
+    def test_rating_again_replaces_the_rating(self):
+        client = APIClient()
+        client.force_authenticate(create_user(1))
+        path = '/api/v1/rate/%d/' % self.department.pk
+        for value in (4, 2):
+            response = client.post(path, {'user_rating': value}, format='json')
+            self.assertEqual(response.status_code, 201)
+
+        self.assertEqual(list(Rating.objects.values_list('user_rating', flat=True)), [2])
+        aggregate = RatingAggregate.objects.for_department(self.department.pk)
+        self.assertEqual((aggregate.rating_count, aggregate.rating_sum), (1, 2))
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentRatingTests(TransactionTestCase):
+    """Aggregates stay exact when users rate the same departments at once"""
+
+    def setUp(self):
+        self.users = [create_user(number) for number in range(4)]
+        self.departments = [
+            create_department(self.users[0], number) for number in range(2)]
+
+    def rate_concurrently(self, rate):
+        errors = []
+        start = threading.Barrier(len(self.users))
+
+        def run(user):
+            try:
+                start.wait()
+                for value in (1, 5, 3, 4, 2, 5):
+                    for department in self.departments:
+                        rate(user, department, value)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(user,)) for user in self.users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def assertAggregatesMatchRatings(self):
+        fields = ['department_id', 'rating_count', 'rating_sum'] + [
+            'rating_%d' % star for star in range(1, 6)]
+        maintained = list(RatingAggregate.objects.order_by('pk').values(*fields))
+        RatingAggregate.objects.rebuild()
+        rebuilt = list(RatingAggregate.objects.order_by('pk').values(*fields))
+        self.assertEqual(maintained, rebuilt)
+        for aggregate in maintained:
+            self.assertEqual(aggregate['rating_count'], len(self.users))
+            self.assertEqual(aggregate['rating_sum'], 5 * len(self.users))
+
+    def test_concurrent_rate(self):
+        self.rate_concurrently(
+            lambda user, department, value: Rating.objects.rate(
+                user, department.pk, value))
+        self.assertAggregatesMatchRatings()
+
+    def test_concurrent_replace(self):
+        for user in self.users:
+            for department in self.departments:
+                Rating.objects.rate(user, department.pk, 3)
+
+        def replace(user, department, value):
+            with transaction.atomic():
+                Rating.objects.replace(user, department.pk, value)
+
+        self.rate_concurrently(replace)
+        self.assertAggregatesMatchRatings()
+
+
+class RatingBatchQueryTests(TestCase):
+    """Batch rating lookups cost the same queries for any number of ids"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user()
+        self.departments = [
+            create_department(self.user, number) for number in range(20)]
+        for department in self.departments[::2]:
+            Rating.objects.rate(self.user, department.pk, 4)
+
+    def get_batch(self, departments, queries):
+        ids = ','.join(str(department.pk) for department in departments)
+        with self.assertNumQueries(queries):
+            response = self.client.get('/api/v1/rate/batch/', {'ids': ids})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), len(departments))
+        return response.data['results']
+
+    def test_anonymous_lookup_runs_one_query(self):
+        for size in (2, 20):
+            self.get_batch(self.departments[:size], 1)
+
+    def test_user_lookup_adds_one_query_for_their_ratings(self):
+        self.client.force_authenticate(self.user)
+        for size in (2, 20):
+            results = self.get_batch(self.departments[:size], 2)
+            self.assertEqual(results[0]['user_rating'], 4)
+            self.assertIsNone(results[1]['user_rating'])
+
+
+class DepartmentListQueryTests(TestCase):
+    """Listing departments with their summaries costs the same queries
+    for any page size"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+        for number in range(20):
+            department = create_department(self.user, number)
+            Rating.objects.rate(create_user(number + 1), department.pk, 1 + number % 5)
+            Review.objects.create(body='Review', department=department, author=self.user)
+
+    def list_departments(self, page_size):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/v1/departments/', {
+                'include': 'rating_summary,review_count', 'page_size': page_size})
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(len(results), page_size)
+        self.assertEqual(results[0]['review_count'], 1)
+        self.assertEqual(results[0]['rating_summary']['rating_count'], 1)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_page_size(self):
+        self.assertEqual(self.list_departments(2), self.list_departments(20))
+
+
+@override_settings(DEPARTMENT_SYNC={'SETTLE_SECONDS': 0})
+class ChangeFeedTests(TransactionTestCase):
+    """A change committed late is still after the watermarks handed out"""
+
+    def setUp(self):
+        self.user = create_user()
+
+    def synced_ids(self, since):
+        response = sync.changes_since(since, 100)
+        return response['watermark'], [
+            department['id'] for department in response['departments']['updated']]
+
+    def test_changes_are_logged_when_committed(self):
+        with transaction.atomic():
+            department = create_department(self.user)
+            self.assertFalse(Change.objects.filter(object_id=department.pk).exists())
+        self.assertTrue(Change.objects.filter(
+            kind=Change.DEPARTMENT, object_id=department.pk).exists())
+
+    @skipUnlessDBFeature('test_db_allows_multiple_connections')
+    def test_change_committed_late_is_synced(self):
+        created, commit = threading.Event(), threading.Event()
+        late = []
+
+        def long_transaction():
+            try:
+                with transaction.atomic():
+                    late.append(create_department(self.user, 1))
+                    created.set()
+                    commit.wait(10)
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=long_transaction)
+        thread.start()
+        created.wait(10)
+        early = create_department(self.user, 2)
+        watermark, ids = self.synced_ids(0)
+        self.assertEqual(ids, [early.pk])
+
+        commit.set()
+        thread.join()
+        _, ids = self.synced_ids(watermark)
+        self.assertEqual(ids, [late[0].pk])
+
+
+@override_settings(REQUEST_THROTTLES={'RATES': {'reviews': '2/min', 'ratings': '1/min'}})
+class WriteThrottleTests(TestCase):
+    """Review and rating writes are limited per user"""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.owner = create_user(0)
+        self.user = create_user(1)
+        self.department = create_department(self.owner)
+        self.client.force_authenticate(self.user)
+
+    def post_review(self, parent=None):
+        path = '/api/v1/departments/%d/reviews/' % self.department.pk
+        if parent:
+            path += '%d/' % parent
+        return self.client.post(path, {'body': 'Review'}, format='json')
+
+    def test_views_name_their_scopes(self):
+        self.assertEqual(ReviewViewSet.throttle_scopes,
+                         {'create': 'reviews', 'create_reply': 'replies'})
+        self.assertEqual(RatingAPIView.throttle_scopes, {'post': 'ratings'})
+
+    def test_reviews_over_the_rate_are_rejected(self):
+        first = self.post_review()
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(self.post_review().status_code, 201)
+        response = self.post_review()
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+
+        # Replies have no rate and other users their own counters
+        self.assertEqual(self.post_review(first.data['id']).status_code, 201)
+        self.client.force_authenticate(self.owner)
+        self.assertEqual(self.post_review().status_code, 201)
+
+    def test_ratings_over_the_rate_are_rejected(self):
+        path = '/api/v1/rate/%d/' % self.department.pk
+        self.assertEqual(
+            self.client.post(path, {'user_rating': 4}, format='json').status_code, 201)
+        self.assertEqual(
+            self.client.post(path, {'user_rating': 5}, format='json').status_code, 429)
+        self.assertEqual(self.client.get(path).status_code, 200)
+
+    def override(self, overrides):
+        return self.settings(REQUEST_THROTTLES={
+            'RATES': {'reviews': '2/min', 'ratings': '1/min'},
+            'OVERRIDES': overrides,
+        })
+
+    def test_client_overrides_take_precedence(self):
+        with self.override({'user:%d' % self.user.pk: {'reviews': '3/min', 'ratings': None}}):
+            for _ in range(3):
+                self.assertEqual(self.post_review().status_code, 201)
+            self.assertEqual(self.post_review().status_code, 429)
+
+            path = '/api/v1/rate/%d/' % self.department.pk
+            for value in (3, 4, 5):
+                self.assertEqual(self.client.post(
+                    path, {'user_rating': value}, format='json').status_code, 201)
+
+            # Other users keep the scope's rate
+            self.client.force_authenticate(self.owner)
+            self.assertEqual(self.post_review().status_code, 201)
+            self.assertEqual(self.post_review().status_code, 201)
+            self.assertEqual(self.post_review().status_code, 429)
+
+    def test_ip_overrides_apply_to_anonymous_clients(self):
+        request = Request(APIRequestFactory().post('/api/v1/rate/1/'))
+        request.user = AnonymousUser()
+        with self.override({'ip:127.0.0.1': {'ratings': '2/min'}}):
+            for allowed in (True, True, False):
+                self.assertEqual(SlidingWindowThrottle().allow_request(
+                    request, RatingAPIView()), allowed)
+
+
+@override_settings(REQUEST_THROTTLES={'RATES': {}})
+class BenchmarkTests(TestCase):
+    """Every benchmark scenario succeeds and none costs more queries on
+    a larger database
+
+    A small, CI sized run of the benchmark_api scenarios whose query
+    counts are compared with benchmarks.compare, as --baseline does.
+    """
+
+    def run_seeded(self, scale):
+        cache.clear()
+        with transaction.atomic():
+            benchmarks.seed(
+                departments=20 * scale, users=25 * scale, reviews=20 * scale,
+                replies=2, ratings=3 * scale)
+            results = benchmarks.run(benchmarks.ClientTransport(), iterations=2)
+            transaction.set_rollback(True)
+        return results
+
+    def test_query_counts_do_not_grow_with_the_data(self):
+        small, large = self.run_seeded(1), self.run_seeded(3)
+        self.assertEqual(set(small), set(large))
+        for name, result in large.items():
+            self.assertTrue(
+                all(int(status) < 400 for status in result['statuses']),
+                '%s answered %s' % (name, result['statuses']))
+        self.assertEqual(benchmarks.compare(large, small, float('inf')), [])
+
+    def test_compare_reports_regressions(self):
+        baseline = {'reviews.list': {'p50_ms': 10, 'p90_ms': 20, 'queries': 3}}
+        self.assertEqual(benchmarks.compare(
+            {'reviews.list': {'p50_ms': 11, 'p90_ms': 20, 'queries': 3}},
+            baseline, 0.2), [])
+        self.assertEqual(benchmarks.compare(
+            {'reviews.list': {'p50_ms': 13, 'p90_ms': 20, 'queries': 4}},
+            baseline, 0.2), [
+                'reviews.list p50_ms: 10.000 -> 13.000',
+                'reviews.list queries: 3 -> 4'])
+
+
+class ImageUploadTestCase(TransactionTestCase):
+    """Runs image jobs synchronously against LocalStorage in a scratch
+    directory"""
+
+    def setUp(self):
+        cache.clear()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.images = self.settings(DEPARTMENT_IMAGES={
+            'QUEUE': 'HudumaMMU.apps.departments.images.SyncQueue',
+            'STORAGE': 'HudumaMMU.apps.departments.images.LocalStorage',
+            'LOCAL_ROOT': self.root,
+        })
+        self.images.enable()
+        self.addCleanup(self.images.disable)
+        self.client = APIClient()
+        self.user = create_user()
+        self.client.force_authenticate(self.user)
+
+    def upload(self, size=(1200, 900), number=0):
+        content = io.BytesIO()
+        Image.new('RGB', size, 'green').save(content, 'PNG')
+        response = self.client.post('/api/v1/departments/', {
+            'name': 'Department %d' % number, 'service': 'Service',
+            'email': 'department%d@example.com' % number,
+            'image': SimpleUploadedFile('image.png', content.getvalue(), 'image/png'),
+        }, format='multipart')
+        self.assertEqual(response.status_code, 201)
+        return Department.objects.get(pk=response.data['id'])
+
+    def stored_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(directory, name), self.root)
+            for directory, _, names in os.walk(self.root) for name in names)
+
+
+class ImageRequeueTests(ImageUploadTestCase):
+    """Uploads whose job was lost are processed from the stored original"""
+
+    def test_lost_job_is_requeued_from_the_stored_original(self):
+        with self.settings(DEPARTMENT_IMAGES=dict(
+                self.images.options['DEPARTMENT_IMAGES'],
+                QUEUE='HudumaMMU.apps.departments.tests.LostJobQueue')):
+            department = self.upload()
+        self.assertEqual(department.image_status, images.PENDING)
+        self.assertTrue(department.image_original.startswith('departments/originals/'))
+        self.assertEqual(self.stored_files(), [department.image_original])
+
+        # Not stale yet
+        self.assertEqual(images.requeue_stale(), (0, 0))
+        self.assertEqual(images.requeue_stale(0), (1, 0))
+        department.refresh_from_db()
+        self.assertEqual(department.image_status, images.READY)
+        self.assertEqual(department.image_original, '')
+        self.assertNotIn('departments/originals', '\n'.join(self.stored_files()))
+
+        # A duplicate of the job finds nothing left to do
+        images.process_upload(department.pk, 'departments/originals/gone')
+        department.refresh_from_db()
+        self.assertEqual(department.image_status, images.READY)
+
+    def test_upload_without_original_is_marked_failed(self):
+        department = create_department(self.user)
+        Department.objects.filter(pk=department.pk).update(image_status=images.PENDING)
+        self.assertEqual(images.requeue_stale(0), (0, 1))
+        department.refresh_from_db()
+        self.assertEqual(department.image_status, images.FAILED)
+
+
+class ImageDerivativeTests(ImageUploadTestCase):
+    """Uploads are resized into derivatives served from immutable URLs"""
+
+    def sizes(self, department):
+        return {
+            derivative.kind: (derivative.width, derivative.height)
+            for derivative in ImageDerivative.objects.filter(department=department)
+        }
+
+    def test_upload_renders_every_derivative(self):
+        department = self.upload()
+        self.assertEqual(department.image_status, images.READY)
+        self.assertEqual(self.sizes(department), {
+            'thumbnail': (200, 150), 'medium': (800, 600), 'webp': (800, 600)})
+
+        derivatives = self.client.get(
+            '/api/v1/departments/%d/' % department.pk).json()['image_derivatives']
+        self.assertEqual(set(derivatives), {'thumbnail', 'medium', 'webp'})
+        response = self.client.get(derivatives['webp']['url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('immutable', response['Cache-Control'])
+        with Image.open(io.BytesIO(b''.join(response.streaming_content))) as image:
+            self.assertEqual(image.size, (800, 600))
+
+    def test_small_images_are_not_enlarged(self):
+        department = self.upload(size=(100, 80))
+        self.assertEqual(self.sizes(department), {
+            'thumbnail': (100, 80), 'medium': (100, 80), 'webp': (100, 80)})
+
+    def test_backfill_renders_from_the_stored_image(self):
+        department = self.upload()
+        ImageDerivative.objects.filter(department=department).delete()
+        department_id, derivatives = images.backfill(
+            department.pk, department.image.get_prep_value())
+        images.save_derivatives(department_id, derivatives)
+        self.assertEqual(self.sizes(department)['thumbnail'], (200, 150))
+
+    def test_image_paths_stay_under_the_storage_root(self):
+        self.assertEqual(
+            self.client.get('/api/v1/images/../../etc/passwd').status_code, 404)
+        self.assertEqual(
+            self.client.get('/api/v1/images/departments/0/missing.jpg').status_code, 404)
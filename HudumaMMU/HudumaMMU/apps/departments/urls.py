@@ -7,6 +7,10 @@ app_name="department"
 urlpatterns = [
     path('departments/', views.DepartmentViewSet.as_view(
         {'get': 'list', 'post': 'create'}), name='posts-all'),
+    path('departments/top/', views.LeaderboardAPIView.as_view(),
+        name='departments-top'),
+    path('departments/bulk/', views.DepartmentBulkAPIView.as_view(),
+        name='departments-bulk'),
     path('departments/<pk>/', views.DepartmentViewSet.as_view(
         {"get": "retrieve", "put": "update", "patch": "partial_update", "delete": "destroy"}
     ), name="single-post"),
@@ -16,6 +20,10 @@ urlpatterns = [
     path('departments/<pk>/reviews/<id>/', views.ReviewViewSet.as_view(
         {'get': 'retrieve', "put": "update",
          "delete": "destroy", "post": "create_reply"}), name='single-comment'),
+    path('rate/batch/', views.RatingBatchAPIView.as_view(), name='rating-batch'),
     path('rate/<id>/', views.RatingAPIView.as_view(), name='rating'),
+    path('search/', views.SearchAPIView.as_view(), name='search'),
+    path('sync/', views.SyncAPIView.as_view(), name='sync'),
+    path('images/<path:name>', views.image_file, name='image-file'),
 
 ]
@@ -1,19 +1,77 @@
+import mimetypes
+import os
+
 from django.shortcuts import render, get_object_or_404
-from django.db.models import Avg
+from django.http import FileResponse, Http404, StreamingHttpResponse
 from rest_framework import status, viewsets
-from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.generics import GenericAPIView
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticatedOrReadOnly, IsAuthenticated
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.views import APIView
-from .serializers import DepartmentSerializers, ReviewSerializer, RatingSerializer
-from .models import Department, Review, Rating
+from .serializers import (
+    DepartmentSerializers, ReviewSerializer, RatingSerializer, selected_fields)
+from .models import Department, Review, Rating, RatingAggregate
+from .pagination import (
+    DepartmentCursorPagination, LeaderboardPagination, ReviewCursorPagination)
+from .cache import cached_response
+from . import bulk, images, listings, search, sync
+from .leaderboard import get_leaderboard
 from rest_framework import mixins, generics
 
 
 
 # Create your views here.
+INCLUDES = {
+    'rating_summary': ('ratings', lambda queryset: queryset.with_rating_summary()),
+    'review_count': ('reviews', lambda queryset: queryset.with_review_count()),
+}
+
+
+def department_queryset(request):
+    """Departments loaded for the fields and summaries a read asks for
+
+    Applies ?fields=/?exclude= and the summaries requested with
+    ?include=rating_summary,review_count. Returns the queryset, the
+    selected fields and the cache namespaces the response depends on.
+    """
+    fields = selected_fields(request, DepartmentSerializers.sparse_fields)
+    queryset = Department.objects.for_fields(fields)
+    namespaces = ['departments']
+    for name in request.query_params.get('include', '').split(','):
+        if not name:
+            continue
+        if name not in INCLUDES:
+            raise ValidationError({
+                'include': 'Expected any of: %s' % ', '.join(sorted(INCLUDES))
+            })
+        if name not in fields:
+            continue
+        namespace, annotate = INCLUDES[name]
+        if namespace not in namespaces:
+            namespaces.append(namespace)
+            queryset = annotate(queryset)
+    return queryset, fields, namespaces
+
+
+def reply_options(request):
+    """The ?depth= and ?limit= of the replies loaded under each review
+
+    depth counts the levels of replies and limit the replies per review,
+    both are unlimited by default.
+    """
+    options = {}
+    for name in ('depth', 'limit'):
+        value = request.query_params.get(name)
+        if value is None:
+            continue
+        if not value.isdigit():
+            raise ValidationError({name: 'Expected a non-negative integer'})
+        options[name] = int(value)
+    return options
+
+
 def get_department(id):
     try:
         department = Department.objects.get(id=id)
@@ -32,10 +90,18 @@ class DepartmentAPIView(generics.CreateAPIView):
     serializer_class = DepartmentSerializers
 
     def post(self, request):
-        id_ = request.data.get("department_id", '')
-        queryset = Department.objects.filter(id=id_).first()
-        serializer = DepartmentSerializers(queryset, context={'request': request})
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        try:
+            id_ = int(request.data.get("department_id", ''))
+        except (TypeError, ValueError):
+            raise ValidationError({'department_id': 'Expected an integer'})
+
+        def build():
+            queryset = Department.objects.filter(id=id_).prefetch_related(
+                'image_derivatives').first()
+            serializer = DepartmentSerializers(queryset, context={'request': request})
+            return serializer.data
+
+        return cached_response(request, 'detail:%d' % id_, build)
     
     def patch(self, request):
         """update department"""
@@ -58,19 +124,109 @@ class DepartmentAPIView(generics.CreateAPIView):
             "message": "Department deleted successfully"
         },
         status=status.HTTP_200_OK)
+
+
+class LeaderboardAPIView(APIView):
+    """Departments ordered by their Bayesian weighted rating, best first
+
+    Only departments with at least one rating are ranked. Filter with
+    ?service= and page with ?limit= and ?offset=.
+    """
+    permission_classes = (IsAuthenticatedOrReadOnly, )
+    pagination_class = LeaderboardPagination
+
+    def get(self, request):
+        ranking = get_leaderboard().ranking(request.query_params.get('service'))
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(ranking, request, view=self)
+        departments = Department.objects.prefetch_related(
+            'image_derivatives').in_bulk([entry.department_id for entry in page])
+        results = []
+        for rank, entry in enumerate(page, paginator.offset + 1):
+            department = departments.get(entry.department_id)
+            if department is None:
+                continue
+            data = DepartmentSerializers(department, context={'request': request}).data
+            data.update({
+                'rank': rank,
+                'score': round(entry.score, 4),
+                'average_rating': entry.average_rating,
+                'rating_count': entry.rating_count,
+            })
+            results.append(data)
+        return paginator.get_paginated_response(results)
+
+
+class DepartmentBulkAPIView(APIView):
+    """Import departments from, or export them to, CSV or NDJSON
+
+    Both directions are streamed so the request or response body is never
+    held in memory as a whole.
+    """
+    permission_classes = (IsAuthenticated, )
+
+    def get(self, request):
+        """stream every department"""
+        file_format = request.query_params.get('file_format', 'ndjson')
+        if file_format not in bulk.FORMATS:
+            return Response({
+                "error": "file_format must be one of: %s" % ', '.join(bulk.FORMATS)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        content_type = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+        response = StreamingHttpResponse(
+            bulk.export_departments(file_format), content_type=content_type)
+        response['Content-Disposition'] = \
+            'attachment; filename="departments.%s"' % file_format
+        return response
+
+    def post(self, request):
+        """create departments from the rows in the request body"""
+        file_format = bulk.format_for(content_type=request.content_type)
+        stream = request.stream
+        lines = iter(stream.readline, b'') if stream is not None else []
+        report = bulk.import_departments(
+            bulk.read_rows(lines, file_format), created_by=request.user)
+        return Response(report, status=status.HTTP_200_OK)
+
+
+def image_file(request, name):
+    """Serve an image kept by LocalStorage
+
+    Stored names contain the hash of their content, so the same URL always
+    serves the same bytes and may be cached for a year.
+    """
+    storage = images.get_storage()
+    if not hasattr(storage, 'path') or '..' in name.split('/'):
+        raise Http404
+    path = storage.path(name)
+    if not os.path.isfile(path):
+        raise Http404
+    response = FileResponse(
+        open(path, 'rb'), content_type=mimetypes.guess_type(path)[0])
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
 class DepartmentViewSet(viewsets.ViewSet):
     queryset = Department.objects.all()
     serializer_class = DepartmentSerializers
+    pagination_class = DepartmentCursorPagination
     permission_classes = (IsAuthenticatedOrReadOnly, IsAuthenticated, )
 
 
 
     def list(self, request):
-        queryset = Department.objects.all()
-        serializer = DepartmentSerializers(
-            queryset, many=True, context={'request': request}
-        )
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        queryset, fields, namespaces = department_queryset(request)
+
+        def build():
+            paginator = self.pagination_class()
+            page = paginator.paginate_queryset(
+                listings.department_rows(queryset, fields), request, view=self)
+            return paginator.get_paginated_response(
+                listings.departments(page, fields)).data
+
+        return cached_response(
+            request, 'list:%s' % request.GET.urlencode(), build, namespaces)
 
 
     def create(self, request):
@@ -84,10 +240,15 @@ class DepartmentViewSet(viewsets.ViewSet):
 
     def retrieve(self, request, pk=None):
         """Return department when selected with Id"""
-        queryset = Department.objects.all()
-        department = get_object_or_404(queryset, pk=pk)
-        serializer = DepartmentSerializers(department, context={'request': request})
-        return Response(serializer.data)
+        queryset, _, namespaces = department_queryset(request)
+
+        def build():
+            department = get_object_or_404(queryset, pk=pk)
+            serializer = DepartmentSerializers(department, context={'request': request})
+            return serializer.data
+
+        return cached_response(
+            request, 'detail:%s:%s' % (pk, request.GET.urlencode()), build, namespaces)
 
 
     def update(self, request, pk):
@@ -135,14 +296,18 @@ class ReviewViewSet(viewsets.ViewSet):
     """
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
+    pagination_class = ReviewCursorPagination
     permission_classes = (IsAuthenticatedOrReadOnly,)
+    throttle_scopes = {'create': 'reviews', 'create_reply': 'replies'}
 
-    def get_specific_review(self, department_id, review_id, request):
+    def get_specific_review(self, department_id, review_id, request, fields=None,
+                            depth=None, limit=None):
         """This methos a single review related to a specific department"""
         get_department(department_id)
         try:
-            review = Review.objects.filter(pk=review_id,
-                                             department_id=department_id).first()
+            review = Review.objects.filter(
+                pk=review_id, department_id=department_id
+            ).with_replies(fields, depth, limit).first()
         except Exception:
             raise NotFound("Error when retrieving review")
 
@@ -156,20 +321,19 @@ class ReviewViewSet(viewsets.ViewSet):
         department_id = self.kwargs['pk']
         get_department(department_id)
 
+        fields = selected_fields(request, ReviewSerializer.sparse_fields)
+        replies = reply_options(request)
         try:
-            reviews = Review.objects.filter(department_id=department_id,
-                                              parent=None).order_by(
-                '-created_at')
+            reviews = Review.objects.threads(department_id, fields, **replies)
         except Exception:
             return Response({"error": "No reviews found"},
                             status=status.HTTP_404_NOT_FOUND)
 
-        serializer = self.serializer_class(reviews, many=True)
-        return Response(
-            {
-                'Reviews': serializer.data
-            }
-        )
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(
+            listings.review_rows(reviews, fields), request, view=self)
+        return paginator.get_paginated_response(
+            listings.reviews(page, fields, **replies))
 
     def create(self, request, **kwargs):
         """This is the view for creating a new review"""
@@ -189,11 +353,13 @@ class ReviewViewSet(viewsets.ViewSet):
         """This is the view for updating a review"""
         department_id = self.kwargs['pk']
         review = self.get_specific_review(
-            department_id, id, request
+            department_id, id, request,
+            selected_fields(request, ReviewSerializer.sparse_fields),
+            **reply_options(request)
         )
         if isinstance(review, Response):
             return review
-        serializer = self.serializer_class(review)
+        serializer = self.serializer_class(review, context={'request': request})
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def update(self, request, id, **kwargs):
@@ -220,7 +386,7 @@ class ReviewViewSet(viewsets.ViewSet):
         """This is the view for deleting a review"""
         department_id = self.kwargs['pk']
         review = self.get_specific_review(
-            department_id, id, request
+            department_id, id, request, depth=0
         )
         if isinstance(review, Response):
             return review
@@ -239,7 +405,7 @@ class ReviewViewSet(viewsets.ViewSet):
         """This is the view that handles creation of child reviews"""
         department_id = self.kwargs['pk']
         review = self.get_specific_review(
-            department_id, id, request
+            department_id, id, request, depth=0
         )
         if isinstance(review, Response):
             return review
@@ -248,7 +414,7 @@ class ReviewViewSet(viewsets.ViewSet):
         serializer = self.serializer_class(
             data=review_data, context={'request': request}
         )
-        if review.parent:
+        if review.depth >= Review.MAX_DEPTH:
             return Response({
                 "error": "You cannot reply to this review"
             },
@@ -263,6 +429,7 @@ class RatingAPIView(GenericAPIView):
     queryset = Rating.objects.all()
     serializer_class = RatingSerializer
     permission_classes = (IsAuthenticatedOrReadOnly,)
+    throttle_scopes = {'post': 'ratings'}
 
     def post(self, request, id):
         """POST request to rate an department."""
@@ -274,22 +441,14 @@ class RatingAPIView(GenericAPIView):
                 "message": "You cannot rate your own department"
             }, status=status.HTTP_403_FORBIDDEN)
 
-        try:
-            current_rating = Rating.objects.get(
-                user=request.user.id,
-                department=department
-            )
-            serializer = self.serializer_class(
-                current_rating, data=rating)
-        except Rating.DoesNotExist:
-            serializer = self.serializer_class(data=rating)
-
+        serializer = self.serializer_class(data=rating)
         serializer.is_valid(raise_exception=True)
-        serializer.save(user=request.user, department=department)
+        current_rating = Rating.objects.rate(
+            request.user, department.id, serializer.validated_data['user_rating'])
 
         return Response({
             'message': 'Rating submitted sucessfully',
-            'data': serializer.data
+            'data': self.serializer_class(current_rating).data
         }, status=status.HTTP_201_CREATED)
 
     def get(self, request, id):
@@ -303,16 +462,17 @@ class RatingAPIView(GenericAPIView):
             rating = None
 
         if rating is None:
-            avg = Rating.objects.filter(
-                department=department).aggregate(Avg('user_rating'))
-            average_rating = avg['user_rating__avg']
-            if avg["user_rating__avg"] is None:
+            aggregate = RatingAggregate.objects.for_department(department.id)
+            average_rating = aggregate.average_rating
+            if average_rating is None:
                 average_rating = 0
 
             if request.user.is_authenticated is False:
                 return Response({
                     'department_id': department.id,
                     'average_rating': average_rating,
+                    'rating_count': aggregate.rating_count,
+                    'rating_histogram': aggregate.histogram,
                     'user_rating': 'login to rate the department'
                 }, status=status.HTTP_200_OK)
 
@@ -321,6 +481,8 @@ class RatingAPIView(GenericAPIView):
                 'data': {
                     "department_id": department.id,
                     'average_rating': average_rating,
+                    'rating_count': aggregate.rating_count,
+                    'rating_histogram': aggregate.histogram,
                     'user_rating': 'you have not rated this department'
                 }
             }, status=status.HTTP_200_OK)
@@ -329,4 +491,114 @@ class RatingAPIView(GenericAPIView):
         return Response({
             'message': 'department rating',
             'data': serialized_data.data
-        }, status=status.HTTP_200_OK)
\ No newline at end of file
+        }, status=status.HTTP_200_OK)
+
+
+class RatingBatchAPIView(APIView):
+    """Ratings of many departments at once, ?ids=1,2,3
+
+    Runs one query for the departments and their aggregates and, for a
+    logged in user, one for their own ratings, however many ids are given.
+    """
+    permission_classes = (IsAuthenticatedOrReadOnly,)
+    max_ids = 100
+
+    def get(self, request):
+        try:
+            ids = [int(id_) for id_ in request.query_params.get('ids', '').split(',') if id_]
+        except ValueError:
+            return Response({
+                "error": "ids must be a comma separated list of department ids"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if not ids or len(ids) > self.max_ids:
+            return Response({
+                "error": "Provide between 1 and %d department ids" % self.max_ids
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        aggregates = {
+            department_id: RatingAggregate(
+                department_id=department_id, rating_count=count or 0, rating_sum=total or 0)
+            for department_id, count, total in Department.objects.filter(
+                pk__in=ids).values_list(
+                    'id', 'rating_aggregate__rating_count', 'rating_aggregate__rating_sum')
+        }
+        user_ratings = {}
+        if request.user.is_authenticated:
+            user_ratings = dict(Rating.objects.filter(
+                user=request.user, department_id__in=aggregates
+            ).values_list('department_id', 'user_rating'))
+
+        results = [
+            {
+                'department_id': department_id,
+                'average_rating': aggregates[department_id].average_rating,
+                'rating_count': aggregates[department_id].rating_count,
+                'user_rating': user_ratings.get(department_id),
+            } for department_id in dict.fromkeys(ids) if department_id in aggregates
+        ]
+        return Response({
+            'results': results,
+            'not_found': [id_ for id_ in dict.fromkeys(ids) if id_ not in aggregates]
+        }, status=status.HTTP_200_OK)
+
+
+class SyncAPIView(APIView):
+    """Departments, reviews and rating aggregates changed since ?since=
+
+    Clients start from ?since=0 and pass the returned watermark on their
+    next sync, following has_more until the feed is drained. Page with
+    ?limit=, the number of changes read per request.
+    """
+    permission_classes = (IsAuthenticatedOrReadOnly,)
+
+    def get(self, request):
+        options = sync.get_options()
+        try:
+            since = int(request.query_params.get('since', 0))
+            limit = int(request.query_params.get('limit', options['PAGE_SIZE']))
+        except ValueError:
+            return Response({
+                "error": "since and limit must be integers"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if since < 0 or limit < 1:
+            return Response({
+                "error": "since must not be negative and limit must be positive"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            sync.changes_since(since, min(limit, options['MAX_PAGE_SIZE'])),
+            status=status.HTTP_200_OK)
+
+
+class SearchAPIView(APIView):
+    """Ranked full-text search over departments or reviews"""
+    permission_classes = (IsAuthenticatedOrReadOnly,)
+    max_limit = 50
+
+    def get(self, request):
+        text = request.query_params.get('q', '')
+        kind = request.query_params.get('type', 'departments')
+        try:
+            limit = int(request.query_params.get('limit', 20))
+        except ValueError:
+            return Response({
+                "error": "limit must be an integer"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, self.max_limit))
+
+        if kind == 'departments':
+            results = search.search(
+                Department.objects.prefetch_related('image_derivatives'), text, limit)
+            serializer = DepartmentSerializers(
+                results, many=True, context={'request': request})
+        elif kind == 'reviews':
+            results = search.search(Review.objects.with_replies(), text, limit)
+            serializer = ReviewSerializer(results, many=True)
+        else:
+            return Response({
+                "error": "type must be departments or reviews"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.data
+        for item, result in zip(data, results):
+            item['rank'] = result.rank
+        return Response({'results': data}, status=status.HTTP_200_OK)
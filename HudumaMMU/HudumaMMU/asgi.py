@@ -0,0 +1,49 @@
+"""
+ASGI config for HudumaMMU project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Run it under uvicorn workers, for example:
+
+    gunicorn HudumaMMU.asgi:application -k uvicorn.workers.UvicornWorker
+
+The event loop accepts and holds connections while views run in a thread
+pool of ASGI_THREADS threads per worker (default 32), so a slow database
+or Cloudinary call no longer pins a whole worker process.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'HudumaMMU.settings')
+
+django_application = get_asgi_application()
+
+# Start the image queue with the server rather than on the first upload,
+# so its sweep for jobs lost in a restart runs from the start
+from HudumaMMU.apps.departments import images  # noqa: E402
+
+images.get_queue()
+
+_loops = set()
+
+
+async def application(scope, receive, send):
+    """Run Django with a bounded thread pool on the server's event loop
+
+    Each request's view runs through sync_to_async on the loop's default
+    executor; replacing it caps how many threads, and so database
+    connections, a worker can use.
+    """
+    loop = asyncio.get_event_loop()
+    if loop not in _loops:
+        _loops.add(loop)
+        loop.set_default_executor(ThreadPoolExecutor(
+            max_workers=int(os.environ.get('ASGI_THREADS', 32)),
+            thread_name_prefix='asgi'))
+    await django_application(scope, receive, send)
@@ -0,0 +1,122 @@
+"""Database settings from the environment and connection health checks
+
+config() builds the default database from DATABASE_URL, as set by Heroku,
+or from DB_NAME, DB_USER, DB_PASSWORD, DB_HOST and DB_PORT, falling back
+to the older NAME, USER, PASSWORD, HOST and PORT variables. Connections
+are kept open between requests for CONN_MAX_AGE seconds, 600 by default,
+so a request normally reuses its worker's connection instead of paying
+for a new one.
+
+With PGBOUNCER set, connections go through pgbouncer in transaction
+pooling mode. Server-side cursors do not survive the transaction moving
+between server connections there, so they are disabled.
+
+Django 3.0 reuses a persistent connection without checking that it still
+works, so the first request after a database restart or failover would
+fail. ConnectionHealthMiddleware pings connections that sat idle for
+longer than DATABASE_CONNECTIONS['HEALTH_CHECK_AFTER'] seconds and
+reopens the dead ones before the view runs.
+
+replicas() adds the read replicas of DATABASE_REPLICA_URLS, which
+HudumaMMU/routers.py sends reads to.
+"""
+import os
+import time
+
+import dj_database_url
+from django.conf import settings
+from django.db import connections
+
+
+DEFAULTS = {
+    # Seconds a connection may sit idle before it is checked, 0 checks
+    # on every request and None never does
+    'HEALTH_CHECK_AFTER': 30,
+}
+
+
+def get_options():
+    return dict(DEFAULTS, **getattr(settings, 'DATABASE_CONNECTIONS', {}))
+
+
+def enabled(value):
+    return (value or '').lower() in ('1', 'true', 'yes', 'on')
+
+
+def config(environ=os.environ, url=None):
+    """Return the settings of the default database, or of the one at `url`"""
+    url = url or environ.get('DATABASE_URL')
+    conn_max_age = int(environ.get('CONN_MAX_AGE', 600))
+    if url:
+        database = dj_database_url.parse(
+            url, conn_max_age=conn_max_age,
+            ssl_require=enabled(environ.get('DATABASE_SSL_REQUIRE', 'true')))
+    else:
+        def variable(name, default=''):
+            return environ.get('DB_' + name, environ.get(name, default))
+
+        database = {
+            'ENGINE': 'django.db.backends.postgresql_psycopg2',
+            'NAME': variable('NAME'),
+            'USER': variable('USER'),
+            'HOST': variable('HOST', 'localhost'),
+            'PASSWORD': variable('PASSWORD'),
+            'PORT': variable('PORT', '5432'),
+            'CONN_MAX_AGE': conn_max_age,
+        }
+    if enabled(environ.get('PGBOUNCER')):
+        database['DISABLE_SERVER_SIDE_CURSORS'] = True
+    return database
+
+
+def replicas(environ=os.environ):
+    """Return the read replicas listed in DATABASE_REPLICA_URLS
+
+    The URLs are comma separated, the replicas are named replica_1,
+    replica_2 and so on. Tests read the default database through them.
+    """
+    databases = {}
+    urls = [url for url in environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+    for number, url in enumerate(urls, 1):
+        database = config(environ, url)
+        database['TEST'] = {'MIRROR': 'default'}
+        databases['replica_%d' % number] = database
+    return databases
+
+
+def check_connections(idle):
+    """Close the open persistent connections that idled for `idle`
+    seconds and no longer respond, the next query reconnects"""
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is None or not connection.settings_dict['CONN_MAX_AGE']:
+            continue
+        last_used = getattr(connection, 'health_checked_at', None)
+        if last_used is not None and now - last_used < idle:
+            continue
+        if not connection.is_usable():
+            connection.close()
+
+
+def mark_used():
+    now = time.monotonic()
+    for connection in connections.all():
+        if connection.connection is not None:
+            connection.health_checked_at = now
+
+
+class ConnectionHealthMiddleware:
+    """Reopens persistent connections that died while idle"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        idle = get_options()['HEALTH_CHECK_AFTER']
+        if idle is None:
+            return self.get_response(request)
+        check_connections(idle)
+        try:
+            return self.get_response(request)
+        finally:
+            mark_used()
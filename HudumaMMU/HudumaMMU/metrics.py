@@ -0,0 +1,244 @@
+"""Per-view request instrumentation
+
+RequestMetricsMiddleware times every request, counts its database queries
+and measures how long the response body took to render to JSON, whether
+by DRF or by the department response cache. The numbers are sent back in
+a Server-Timing header, slow requests are logged as JSON and everything
+is aggregated into in-process histograms that the /metrics view renders
+in the Prometheus text format for staff or holders of the metrics token.
+"""
+import hmac
+import json
+import logging
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Requests slower than this many seconds are logged
+    'SLOW_REQUEST_THRESHOLD': 0.5,
+    'DURATION_BUCKETS': (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+    'QUERY_BUCKETS': (0, 1, 2, 5, 10, 20, 50, 100),
+    'SIZE_BUCKETS': (256, 1024, 4096, 16384, 65536, 262144, 1048576),
+    # Bearer token that may read /metrics, staff users always can
+    'TOKEN': None,
+}
+
+
+def get_options():
+    return dict(DEFAULTS, **getattr(settings, 'REQUEST_METRICS', {}))
+
+
+class Histogram:
+    """Cumulative histogram of observations, split by label values"""
+
+    def __init__(self, name, documentation, labels, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[label] for label in self.labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {
+                    'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0
+                }
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [
+            '# HELP %s %s' % (self.name, self.documentation),
+            '# TYPE %s histogram' % self.name,
+        ]
+        with self.lock:
+            series = sorted(self.series.items())
+        for key, values in series:
+            labels = list(zip(self.labels, key))
+            for bound, count in zip(self.buckets, values['buckets']):
+                lines.append('%s_bucket%s %d' % (
+                    self.name, format_labels(labels + [('le', bound)]), count))
+            lines.append('%s_bucket%s %d' % (
+                self.name, format_labels(labels + [('le', '+Inf')]), values['count']))
+            lines.append('%s_sum%s %s' % (self.name, format_labels(labels), values['sum']))
+            lines.append('%s_count%s %d' % (self.name, format_labels(labels), values['count']))
+        return lines
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        '%s="%s"' % (name, str(value).replace('\\', '\\\\').replace(
+            '"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{%s}' % ','.join(escaped)
+
+
+class Registry:
+    def __init__(self):
+        options = get_options()
+        labels = ('view', 'method')
+        self.request_duration = Histogram(
+            'huduma_request_duration_seconds', 'Wall time spent handling requests',
+            labels + ('status', ), options['DURATION_BUCKETS'])
+        self.db_duration = Histogram(
+            'huduma_db_duration_seconds', 'Time spent in database queries per request',
+            labels, options['DURATION_BUCKETS'])
+        self.db_queries = Histogram(
+            'huduma_db_queries', 'Database queries run per request',
+            labels, options['QUERY_BUCKETS'])
+        self.render_duration = Histogram(
+            'huduma_render_duration_seconds', 'Time spent rendering response bodies',
+            labels, options['DURATION_BUCKETS'])
+        self.response_size = Histogram(
+            'huduma_response_size_bytes', 'Size of response bodies',
+            labels, options['SIZE_BUCKETS'])
+
+    def histograms(self):
+        return (self.request_duration, self.db_duration, self.db_queries,
+                self.render_duration, self.response_size)
+
+    def render(self):
+        lines = []
+        for histogram in self.histograms():
+            lines.extend(histogram.render())
+        lines.extend(render_auth_cache_stats())
+        return '\n'.join(lines) + '\n'
+
+
+def render_auth_cache_stats():
+    from .apps.authentication.cache import get_auth_cache
+
+    name = 'huduma_jwt_auth_cache_events_total'
+    lines = [
+        '# HELP %s Lookups in the JWT authentication cache' % name,
+        '# TYPE %s counter' % name,
+    ]
+    for event, count in sorted(get_auth_cache().stats().items()):
+        lines.append('%s%s %d' % (name, format_labels([('event', event)]), count))
+    return lines
+
+
+registry = Registry()
+
+
+class QueryTimer:
+    """Database execute wrapper counting queries and their duration"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+
+
+@contextmanager
+def rendering(request):
+    """Count the time spent in the block as the request's render time"""
+    request = getattr(request, '_request', request)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        request._render_duration = getattr(request, '_render_duration', 0) + \
+            time.perf_counter() - started
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.route or match.view_name or match._func_path
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_request_threshold = get_options()['SLOW_REQUEST_THRESHOLD']
+
+    def __call__(self, request):
+        started = time.perf_counter()
+        queries = QueryTimer()
+        request._render_duration = 0
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(queries))
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        labels = {'view': view_name(request), 'method': request.method}
+        size = None if response.streaming else len(response.content)
+        registry.request_duration.observe(
+            duration, status=response.status_code, **labels)
+        registry.db_duration.observe(queries.duration, **labels)
+        registry.db_queries.observe(queries.count, **labels)
+        registry.render_duration.observe(request._render_duration, **labels)
+        if size is not None:
+            registry.response_size.observe(size, **labels)
+
+        response['Server-Timing'] = ', '.join((
+            'total;dur=%.1f' % (duration * 1000),
+            'db;dur=%.1f;desc="%d queries"' % (queries.duration * 1000, queries.count),
+            'render;dur=%.1f' % (request._render_duration * 1000),
+        ))
+
+        if duration >= self.slow_request_threshold:
+            logger.warning(json.dumps({
+                'event': 'slow_request',
+                'view': labels['view'],
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'duration_ms': round(duration * 1000, 1),
+                'db_queries': queries.count,
+                'db_duration_ms': round(queries.duration * 1000, 1),
+                'render_duration_ms': round(request._render_duration * 1000, 1),
+                'response_bytes': size,
+            }))
+        return response
+
+    def process_template_response(self, request, response):
+        """Render DRF responses here so the time spent can be measured"""
+        with rendering(request):
+            response.render()
+        return response
+
+
+def can_read_metrics(request):
+    token = get_options()['TOKEN']
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if token and hmac.compare_digest(authorization, 'Bearer %s' % token):
+        return True
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_active and user.is_staff
+
+
+def metrics_view(request):
+    """Expose the metrics of this process in the Prometheus text format"""
+    if not can_read_metrics(request):
+        return HttpResponseForbidden()
+    return HttpResponse(
+        registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
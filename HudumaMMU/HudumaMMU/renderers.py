@@ -0,0 +1,32 @@
+"""JSON rendering backed by orjson
+
+orjson serializes dicts, lists, datetimes and the other common types in C
+and returns bytes directly. It is optional: without it, or for requests
+asking for indented output, the renderer behaves exactly like DRF's
+JSONRenderer.
+"""
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class FastJSONRenderer(JSONRenderer):
+    """Renders JSON with orjson when it is installed"""
+
+    def __init__(self):
+        self.default = JSONEncoder().default
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or \
+                self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super(FastJSONRenderer, self).render(
+                data, accepted_media_type, renderer_context)
+        # Types orjson does not know, such as Decimal or lazy translations,
+        # are handed to DRF's encoder
+        return orjson.dumps(
+            data, default=self.default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z)
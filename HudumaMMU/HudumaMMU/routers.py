@@ -0,0 +1,138 @@
+"""Routing of reads to read replicas
+
+ReplicaRoutingMiddleware sends the queries of GET, HEAD and OPTIONS
+requests to one of the DATABASE_REPLICAS['ALIASES'] databases, picked at
+random. Everything else, including any query run inside a transaction or
+after the request wrote something, uses the primary.
+
+A replica lags the primary, so a client that just wrote would not see
+its own review or rating on its next read. After a request writes, the
+client, identified by its Authorization header or else its IP, has its
+reads pinned to the primary for PIN_SECONDS. The pin is kept in the
+cache, so it holds across processes.
+
+A replica that cannot be connected to is skipped for RETRY_AFTER seconds
+and reads fall back to the primary when none is left.
+
+Queries run outside a request, such as those of background jobs and
+management commands, always use the primary.
+"""
+import hashlib
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, DEFAULT_DB_ALIAS, connections
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ALIASES': [],
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'replica',
+    # Seconds a client reads from the primary after writing
+    'PIN_SECONDS': 5,
+    # Seconds an unreachable replica is skipped for
+    'RETRY_AFTER': 30,
+}
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+_state = threading.local()
+# Replica alias -> time.monotonic() until which it is skipped
+_unavailable = {}
+
+
+def get_options():
+    return dict(DEFAULTS, **getattr(settings, 'DATABASE_REPLICAS', {}))
+
+
+def client_key(request, options):
+    identity = request.META.get('HTTP_AUTHORIZATION') or request.META.get('REMOTE_ADDR', '')
+    return '%s:pin:%s' % (
+        options['KEY_PREFIX'], hashlib.sha1(identity.encode('utf-8')).hexdigest())
+
+
+def choose_replica(options):
+    """Return a replica that accepts connections, None if there is none"""
+    now = time.monotonic()
+    aliases = [
+        alias for alias in options['ALIASES']
+        if _unavailable.get(alias, 0) <= now
+    ]
+    random.shuffle(aliases)
+    for alias in aliases:
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError as error:
+            logger.warning('Replica %s is unavailable, skipping it: %s', alias, error)
+            _unavailable[alias] = now + options['RETRY_AFTER']
+            continue
+        return alias
+    return None
+
+
+@contextmanager
+def primary():
+    """Read from the primary within the block
+
+    For reads whose results are kept, such as cached responses, where
+    replica lag would otherwise outlive the request.
+    """
+    alias = getattr(_state, 'alias', None)
+    _state.alias = None
+    try:
+        yield
+    finally:
+        _state.alias = alias
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        alias = getattr(_state, 'alias', None)
+        if alias is None or getattr(_state, 'wrote', False) \
+                or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaRoutingMiddleware:
+    """Chooses the database the reads of a request go to"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        options = get_options()
+        if not options['ALIASES']:
+            return self.get_response(request)
+
+        cache = caches[options['CACHE_ALIAS']]
+        key = client_key(request, options)
+        _state.alias = None
+        _state.wrote = False
+        if request.method in SAFE_METHODS and not cache.get(key):
+            _state.alias = choose_replica(options)
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = _state.wrote
+            _state.alias = None
+            _state.wrote = False
+        if wrote:
+            cache.set(key, 1, options['PIN_SECONDS'])
+        return response
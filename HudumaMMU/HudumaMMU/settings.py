@@ -14,6 +14,8 @@ import os
 import django_heroku
 import cloudinary
 
+from HudumaMMU import database
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -53,6 +55,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'HudumaMMU.metrics.RequestMetricsMiddleware',
+    'HudumaMMU.database.ConnectionHealthMiddleware',
+    'HudumaMMU.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -98,25 +103,101 @@ WSGI_APPLICATION = 'HudumaMMU.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.postgresql_psycopg2',
-        'NAME': os.environ['NAME'],
-        'USER': os.environ['USER'],
-        'HOST': os.environ['HOST'],
-        'PASSWORD': os.environ['PASSWORD'],
-        'PORT': os.environ['PORT']
-    }
+# See HudumaMMU/database.py for the environment variables read
+DATABASES = dict({
+    'default': database.config(),
+}, **database.replicas())
+
+DATABASE_ROUTERS = ['HudumaMMU.routers.ReplicaRouter']
+
+# Reads of safe requests go to the replicas, see HudumaMMU/routers.py for
+# the available options
+DATABASE_REPLICAS = {
+    'ALIASES': [alias for alias in DATABASES if alias != 'default'],
+    'PIN_SECONDS': int(os.environ.get('DB_REPLICA_PIN_SECONDS', 5)),
+}
+
+# Checks of persistent connections, see HudumaMMU/database.py for the
+# available options
+DATABASE_CONNECTIONS = {
+    'HEALTH_CHECK_AFTER': int(os.environ.get('DB_HEALTH_CHECK_AFTER', 30)),
 }
 
 REST_FRAMEWORK = {
     # 'NON_FIELD_ERRORS_KEY': 'error',
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'HudumaMMU.apps.authentication.backends.JWTAuthentication',
-    )
+    ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'HudumaMMU.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+    'DEFAULT_THROTTLE_CLASSES': (
+        'HudumaMMU.throttling.SlidingWindowThrottle',
+    ),
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# Cache of verified tokens and authenticated users, see
+# HudumaMMU/apps/authentication/cache.py for the available options
+JWT_AUTH_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 300,
+}
+
+# Request instrumentation, see HudumaMMU/metrics.py for the available options
+REQUEST_METRICS = {
+    'SLOW_REQUEST_THRESHOLD': float(os.environ.get('SLOW_REQUEST_THRESHOLD', 0.5)),
+    'TOKEN': os.environ.get('METRICS_TOKEN'),
+}
+
+# Rate limits of write endpoints by the throttle_scopes of their views,
+# see HudumaMMU/throttling.py for the available options
+REQUEST_THROTTLES = {
+    'CACHE_ALIAS': 'default',
+    'RATES': {
+        'reviews': os.environ.get('REVIEW_RATE', '10/min'),
+        'replies': os.environ.get('REPLY_RATE', '30/min'),
+        'ratings': os.environ.get('RATING_RATE', '30/min'),
+    },
+}
+
+# Cache of rendered department responses, see
+# HudumaMMU/apps/departments/cache.py for the available options
+DEPARTMENT_RESPONSE_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 600,
+}
+
+# Background processing of department images, see
+# HudumaMMU/apps/departments/images.py for the available options
+DEPARTMENT_IMAGES = {
+    'QUEUE': 'HudumaMMU.apps.departments.images.ThreadPoolQueue',
+    'STORAGE': 'HudumaMMU.apps.departments.images.CloudinaryStorage',
+    'WORKERS': int(os.environ.get('IMAGE_WORKERS', 2)),
+}
+
+# Ranking of departments by rating, see
+# HudumaMMU/apps/departments/leaderboard.py for the available options
+DEPARTMENT_LEADERBOARD = {
+    'CACHE_ALIAS': 'default',
+    'PRIOR_WEIGHT': 10,
+}
+
+# Change feed read by offline clients, see
+# HudumaMMU/apps/departments/sync.py for the available options
+DEPARTMENT_SYNC = {
+    'PAGE_SIZE': 500,
+    'SETTLE_SECONDS': 2,
 }
 
-django_heroku.settings(locals()) 
+# DATABASES is configured above
+django_heroku.settings(locals(), databases=False)
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -138,6 +219,36 @@ AUTH_PASSWORD_VALIDATORS = [
 
 AUTH_USER_MODEL = 'authentication.User'
 
+PASSWORD_HASHERS = [
+    'HudumaMMU.apps.authentication.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+]
+
+# Cost of hashing a password, changing it rehashes passwords on next login
+PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', 180000))
+
+# Seconds the tokens issued at login stay valid, the access token is
+# renewed with the refresh token at user/token/refresh/
+JWT_ACCESS_TOKEN_LIFETIME = int(os.environ.get('JWT_ACCESS_TOKEN_LIFETIME', 900))
+JWT_REFRESH_TOKEN_LIFETIME = int(os.environ.get('JWT_REFRESH_TOKEN_LIFETIME', 14 * 24 * 3600))
+
+# Revoked token list, see HudumaMMU/apps/authentication/revocation.py
+JWT_REVOCATION = {
+    'CACHE_ALIAS': 'default',
+    'BLOOM_SIZE': 2 ** 20,
+    'BLOOM_HASHES': 7,
+    'MAX_CHANGES': 1000,
+}
+
+# Failed login throttling, see HudumaMMU/apps/authentication/ratelimit.py
+LOGIN_RATE_LIMIT = {
+    'EMAIL_ATTEMPTS': 5,
+    'IP_ATTEMPTS': 50,
+    'WINDOW': 300,
+}
+
 # Internationalization
 # https://docs.djangoproject.com/en/2.2/topics/i18n/
 
@@ -0,0 +1,142 @@
+"""Rate limiting of write endpoints with sliding window counters
+
+A view names the scope of each action it wants limited in
+throttle_scopes, e.g. {'create': 'reviews'} on a viewset or
+{'post': 'ratings'} on an APIView, and REQUEST_THROTTLES['RATES'] gives
+each scope a rate such as '10/min'. Requests are counted per user, or
+per client IP for anonymous requests. REQUEST_THROTTLES['OVERRIDES']
+gives single clients their own rates, e.g.
+{'user:5': {'reviews': '100/min'}, 'ip:10.0.0.1': {'reviews': None}},
+where None lifts the limit.
+
+Each client has one counter per fixed window in the cache, bumped with an
+atomic incr. The request is allowed while
+
+    previous window count * share of the previous window still covered
+        + current window count
+
+stays within the rate, which approximates a true sliding window without
+storing a timestamp per request. A closed window's count no longer
+changes, so each process reads it once and remembers it, and a check
+normally costs the single incr and no query. Rejected requests count too,
+so a client that keeps hammering stays throttled.
+
+The counters are only shared between processes if CACHE_ALIAS names a
+cache that is, such as memcached or Redis.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework.throttling import BaseThrottle
+
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    'KEY_PREFIX': 'throttle',
+    # Scope -> rate, as a number of requests per s(econd), m(inute),
+    # h(our) or d(ay)
+    'RATES': {},
+    # Client ('user:<pk>' or 'ip:<address>') -> scope -> rate or None,
+    # taking precedence over RATES
+    'OVERRIDES': {},
+    # Closed window counts remembered per process
+    'MAX_REMEMBERED': 10000,
+}
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Final counts of closed windows, by cache key
+_closed = {}
+
+
+def get_options():
+    return dict(DEFAULTS, **getattr(settings, 'REQUEST_THROTTLES', {}))
+
+
+def parse_rate(rate):
+    """Return the (requests, seconds) of a rate like '10/min'"""
+    requests, period = rate.split('/')
+    return int(requests), PERIODS[period[0]]
+
+
+def hit(cache, key, timeout):
+    """Count a request in a window and return the window's count"""
+    try:
+        return cache.incr(key)
+    except ValueError:
+        if cache.add(key, 1, timeout):
+            return 1
+        return cache.incr(key)
+
+
+def closed_count(cache, key, options):
+    """Return the count of a window that has ended"""
+    count = _closed.get(key)
+    if count is None:
+        if len(_closed) >= options['MAX_REMEMBERED']:
+            _closed.clear()
+        count = _closed[key] = cache.get(key, 0)
+    return count
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    """Limits the actions a view lists in throttle_scopes"""
+
+    def __init__(self):
+        self.wait_seconds = None
+
+    def get_scope(self, request, view):
+        scopes = getattr(view, 'throttle_scopes', None)
+        if not scopes:
+            return None
+        return scopes.get(getattr(view, 'action', None) or request.method.lower())
+
+    def get_client(self, request):
+        if request.user and request.user.is_authenticated:
+            return 'user:%s' % request.user.pk
+        return 'ip:%s' % self.get_ident(request)
+
+    def allow_request(self, request, view):
+        scope = self.get_scope(request, view)
+        if not scope:
+            return True
+        options = get_options()
+        client = self.get_client(request)
+        overrides = options['OVERRIDES'].get(client, {})
+        rate = overrides[scope] if scope in overrides else options['RATES'].get(scope)
+        if rate is None:
+            return True
+        limit, window = parse_rate(rate)
+        cache = caches[options['CACHE_ALIAS']]
+        prefix = '%s:%s:%s' % (options['KEY_PREFIX'], scope, client)
+
+        now = time.time()
+        number = int(now // window)
+        covered = 1 - (now - number * window) / window
+        current = hit(cache, '%s:%d' % (prefix, number), 2 * window)
+        previous = closed_count(cache, '%s:%d' % (prefix, number - 1), options)
+        if previous * covered + current <= limit:
+            return True
+
+        # Without further requests the estimate falls within the limit
+        # once enough of the previous window has slid out, or failing
+        # that, enough of the current one
+        if current < limit:
+            self.wait_seconds = window * (covered - (limit - current) / previous)
+        else:
+            self.wait_seconds = window * (covered + 1 - limit / current)
+        return False
+
+    def wait(self):
+        if self.wait_seconds is None:
+            return None
+        return max(math.ceil(self.wait_seconds), 1)
+
+
+@receiver(setting_changed)
+def reset_closed_counts(setting, **kwargs):
+    if setting in ('REQUEST_THROTTLES', 'CACHES'):
+        _closed.clear()
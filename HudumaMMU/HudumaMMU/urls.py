@@ -19,6 +19,8 @@ from django.urls import path, include
 # from .departments.views import DepartmentViewSet
 from rest_framework import routers
 
+from .metrics import metrics_view
+
 
 # router = routers.DefaultRouter()
 # router.register('articles', DepartmentViewSet, base_name='departments')
@@ -27,6 +29,7 @@ app_name="HudumaMMU"
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', metrics_view, name='metrics'),
     path('api/v1/', include('HudumaMMU.apps.authentication.urls')),
     path('api/v1/', include('HudumaMMU.apps.departments.urls'))
 ]
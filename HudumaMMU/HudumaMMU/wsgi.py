@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'HudumaMMU.settings')
 
 application = get_wsgi_application()
+
+# Start the image queue with the server rather than on the first upload,
+# so its sweep for jobs lost in a restart runs from the start
+from HudumaMMU.apps.departments import images  # noqa: E402
+
+images.get_queue()